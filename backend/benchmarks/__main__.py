@@ -0,0 +1,103 @@
+"""
+Offline benchmark and load-test suite, nothing here talks to Firebase, OpenAI or Stockfish.
+
+Usage:
+    uv run python -m benchmarks micro --output benchmarks/results/micro.json
+    uv run python -m benchmarks load --concurrency 32 --duration 30 --output benchmarks/results/load.json
+    uv run python -m benchmarks compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+from benchmarks.fakes import seed_data
+from benchmarks.results import compare, metadata, write_results
+
+
+def _print_table(results: dict) -> None:
+    print(f"{'benchmark':<42} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>10}")
+    for name, summary in results.items():
+        print(f"{name:<42} {summary['count']:>8} {summary['p50_ms']:>9.3f} {summary['p95_ms']:>9.3f} "
+              f"{summary['p99_ms']:>9.3f} {summary['ops_per_s']:>10.1f}")
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline backend benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def data_arguments(command: argparse.ArgumentParser) -> None:
+        command.add_argument("--puzzles", type=int, default=100000, help="puzzles in the fake database")
+        command.add_argument("--users", type=int, default=50000, help="users in the fake database")
+        command.add_argument("--seed", type=int, default=1, help="random seed for the data and the inputs")
+        command.add_argument("--output", default=None, help="JSON file the results are written to")
+
+    micro = commands.add_parser("micro", help="time single functions")
+    data_arguments(micro)
+    micro.add_argument("--min-time", type=float, default=1.0, help="seconds spent on each benchmark")
+
+    load = commands.add_parser("load", help="drive the Flask app with concurrent clients")
+    data_arguments(load)
+    load.add_argument("--concurrency", type=int, default=16, help="clients sending requests back to back")
+    load.add_argument("--duration", type=float, default=10.0, help="seconds measured")
+    load.add_argument("--warmup", type=float, default=2.0, help="seconds of unmeasured traffic first")
+    load.add_argument("--routes", default=None, help="comma separated subset of the route mix")
+    load.add_argument("--firebase-latency", type=float, default=0.02, help="seconds per fake Firebase call")
+    load.add_argument("--openai-latency", type=float, default=0.5, help="seconds per fake OpenAI call")
+    load.add_argument("--engine-think", type=float, default=0.05, help="seconds per fake engine search")
+
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("baseline", help="results of the earlier run")
+    diff.add_argument("current", help="results of the run being checked")
+    diff.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    diff.add_argument("--all", action="store_true", help="also list metrics that did not regress")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        with open(args.current, encoding="utf-8") as handle:
+            current = json.load(handle)
+        regressions = 0
+        for name, before, after, change, worse in compare(baseline, current, args.threshold):
+            regressions += worse
+            if worse or args.all:
+                print(f"{'REGRESSION' if worse else '':<10} {name:<60} {before:>12.3f} -> {after:>12.3f} ({change:+.1%})")
+        print(f"{regressions} regressions above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    started = time.perf_counter()
+    data = seed_data(puzzles=args.puzzles, users=args.users, seed=args.seed)
+    print(f"Built {args.puzzles} puzzles and {args.users} users in {time.perf_counter() - started:.1f}s")
+
+    if args.command == "micro":
+        from benchmarks.micro import run
+        results = run(data, args.min_time, args.seed)
+    else:
+        from benchmarks.load import drive, route_mix, start_app
+        app_module, base_url, stop = start_app(data, args.firebase_latency, args.openai_latency, args.engine_think)
+        mix = route_mix(data)
+        if args.routes:
+            mix = {name: mix[name] for name in args.routes.split(",")}
+        try:
+            results = drive(base_url, mix, args.concurrency, args.duration, args.warmup, args.seed)
+            # Cache hit rates and queue sizes help explain a change, they are kept with the run but not compared
+            app_stats = app_module.app.test_client().get("/stats").get_json()
+        finally:
+            stop()
+
+    _print_table(results)
+    if args.output:
+        meta = metadata(vars(args))
+        if args.command == "load":
+            meta["app_stats"] = app_stats
+        write_results(args.output, dict(results, meta=meta))
+        print(f"Results written to {args.output}")
+    # Engine and writer threads of the app are not daemons
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
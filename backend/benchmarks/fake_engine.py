@@ -0,0 +1,56 @@
+"""
+Minimal UCI engine for the benchmarks: answers every search with legal moves and fixed scores
+after a configurable think time, so the engine pool and its callers can be measured without Stockfish.
+
+Usage:
+    python fake_engine.py --think 0.05
+"""
+import argparse
+import sys
+import time
+import chess
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake UCI engine")
+    parser.add_argument("--think", type=float, default=0.05, help="seconds every search takes")
+    args = parser.parse_args()
+
+    board = chess.Board()
+    multipv = 1
+    for line in sys.stdin:
+        parts = line.split()
+        if not parts:
+            continue
+        command = parts[0]
+        if command == "uci":
+            print("id name FakeEngine")
+            print("option name Threads type spin default 1 min 1 max 512")
+            print("option name Hash type spin default 16 min 1 max 33554432")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("uciok", flush=True)
+        elif command == "isready":
+            print("readyok", flush=True)
+        elif command == "setoption" and len(parts) >= 5 and parts[2] == "MultiPV":
+            multipv = int(parts[4])
+        elif command == "position":
+            if parts[1] == "startpos":
+                board = chess.Board()
+            else:
+                end = parts.index("moves") if "moves" in parts else len(parts)
+                board = chess.Board(" ".join(parts[2:end]))
+            if "moves" in parts:
+                for uci in parts[parts.index("moves") + 1:]:
+                    board.push_uci(uci)
+        elif command == "go":
+            time.sleep(args.think)
+            moves = list(board.legal_moves)[:multipv]
+            for rank, move in enumerate(moves, 1):
+                print(f"info depth 20 seldepth 24 multipv {rank} score cp {40 - 10 * rank} nodes 100000 pv {move.uci()}")
+            print(f"bestmove {moves[0].uci() if moves else '(none)'}", flush=True)
+        elif command == "quit":
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Local stand-ins for Firebase, OpenAI and the UCI engine, so the backend runs without network access.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+import chess
+import requests
+from pyrebase.pyrebase import Auth, Database
+
+FAKE_ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_engine.py")
+ID_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _path(*parts: Any) -> Tuple[str, ...]:
+    return tuple(key for part in parts for key in str(part).split("/") if key)
+
+
+class FakeStore:
+    """
+    The JSON tree behind the fake databases, shared by every FakeDatabase of one FakeFirebase.
+
+    Values are copied through JSON on the way in and out, like the REST API serializes them,
+    so callers pay a comparable decoding cost and can't mutate the stored tree.
+
+    Parameters:
+    - data (dict): initial tree
+    - latency (float): seconds every call sleeps, a stand-in for the round trip to Firebase
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, latency: float = 0.0):
+        self.data = data if data is not None else {}
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def _call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def read(self, path: Tuple[str, ...], shallow: bool = False) -> Any:
+        self._call("shallow" if shallow else "get")
+        with self.lock:
+            value = self.data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if shallow and isinstance(value, dict):
+                return {key: True for key in value}
+            return json.loads(json.dumps(value)) if value is not None else None
+
+    def write(self, path: Tuple[str, ...], value: Any, name: str = "set") -> None:
+        self._call(name)
+        value = json.loads(json.dumps(value))
+        with self.lock:
+            self._put(path, value)
+
+    def _put(self, path: Tuple[str, ...], value: Any) -> None:
+        if not path:
+            self.data = value if isinstance(value, dict) else {}
+            return
+        node = self.data
+        for key in path[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[key] = {} if not isinstance(child, list) else dict(enumerate(child))
+            node = child
+        if value is None:
+            node.pop(path[-1], None)
+        else:
+            node[path[-1]] = value
+
+
+class _Response:
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def val(self) -> Any:
+        return self.value
+
+
+class FakeDatabase(Database):
+    """In-memory pyrebase Database supporting the child, shallow, get, set, update, push and remove calls the app makes"""
+
+    def __init__(self, store: FakeStore, path: Tuple[str, ...] = (), shallow: bool = False):
+        # Database.__init__ would build a REST client, none of its state is used here
+        self.store = store
+        self.path = path
+        self.is_shallow = shallow
+
+    def child(self, *args: Any) -> "FakeDatabase":
+        return FakeDatabase(self.store, self.path + _path(*args), self.is_shallow)
+
+    def shallow(self) -> "FakeDatabase":
+        return FakeDatabase(self.store, self.path, True)
+
+    def get(self, token: str = None, json_kwargs: dict = {}) -> _Response:
+        return _Response(self.store.read(self.path, self.is_shallow))
+
+    def set(self, data: Any, token: str = None, json_kwargs: dict = {}) -> Any:
+        self.store.write(self.path, data)
+        return data
+
+    def update(self, data: Dict[str, Any], token: str = None, json_kwargs: dict = {}) -> Dict[str, Any]:
+        self.store._call("update")
+        data = json.loads(json.dumps(data))
+        with self.store.lock:
+            # Keys may be paths, a multi-path update
+            for key, value in data.items():
+                self.store._put(self.path + _path(key), value)
+        return data
+
+    def push(self, data: Any, token: str = None, json_kwargs: dict = {}) -> Dict[str, str]:
+        name = "-" + uuid.uuid4().hex[:19]
+        self.store.write(self.path + (name,), data, "push")
+        return {"name": name}
+
+    def remove(self, token: str = None) -> None:
+        self.store.write(self.path, None, "remove")
+
+
+class FakeAuth(Auth):
+    """Email and password accounts kept in memory"""
+
+    def __init__(self, store: FakeStore):
+        self.store = store
+        self.accounts: Dict[str, Tuple[str, str]] = {}
+        self.current_user = None
+
+    def _user(self, email: str, local_id: str) -> Dict[str, Any]:
+        return {"kind": "identitytoolkit#VerifyPasswordResponse", "localId": local_id, "email": email,
+                "idToken": uuid.uuid4().hex, "refreshToken": uuid.uuid4().hex, "expiresIn": "3600"}
+
+    def create_user_with_email_and_password(self, email: str, password: str) -> Dict[str, Any]:
+        self.store._call("auth")
+        if email in self.accounts:
+            raise requests.exceptions.HTTPError("EMAIL_EXISTS")
+        local_id = uuid.uuid4().hex[:28]
+        self.accounts[email] = (password, local_id)
+        return self._user(email, local_id)
+
+    def sign_in_with_email_and_password(self, email: str, password: str) -> Dict[str, Any]:
+        self.store._call("auth")
+        account = self.accounts.get(email)
+        if account is None or account[0] != password:
+            raise requests.exceptions.HTTPError("INVALID_LOGIN_CREDENTIALS")
+        self.current_user = self._user(email, account[1])
+        return self.current_user
+
+
+class FakeFirebase:
+    """Stands in for the pyrebase Firebase app, every database() shares one FakeStore"""
+
+    def __init__(self, store: FakeStore):
+        self.store = store
+        self.requests = requests.Session()
+        self._auth = FakeAuth(store)
+
+    def database(self) -> FakeDatabase:
+        return FakeDatabase(self.store)
+
+    def auth(self) -> FakeAuth:
+        return self._auth
+
+
+class _OpenAIResponse:
+    def __init__(self, text: str):
+        self.output_text = text
+
+
+class _Responses:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def create(self, **kwargs: Any) -> _OpenAIResponse:
+        self.calls += 1
+        time.sleep(self.latency)
+        return _OpenAIResponse(f"Look for a forcing move ({kwargs.get('model')}, call {self.calls})")
+
+
+class _AsyncResponses(_Responses):
+    async def create(self, **kwargs: Any) -> _OpenAIResponse:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return _OpenAIResponse(f"Look for a forcing move ({kwargs.get('model')}, call {self.calls})")
+
+
+class FakeOpenAI:
+    """OpenAI client whose responses.create sleeps for latency seconds and returns a canned hint"""
+
+    latency = 0.5
+
+    def __init__(self, api_key: str = None, **kwargs: Any):
+        self.responses = _Responses(self.latency)
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    def __init__(self, api_key: str = None, **kwargs: Any):
+        self.responses = _AsyncResponses(self.latency)
+
+
+def puzzle_id(number: int) -> str:
+    """Five character ids like Lichess puzzle ids, validate_puzzle_id rejects other lengths"""
+    chars = []
+    for _ in range(5):
+        number, digit = divmod(number, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def _positions(count: int, rng: random.Random) -> List[Tuple[str, str]]:
+    """Random middlegame positions with a legal four move line each"""
+    positions = []
+    while len(positions) < count:
+        board = chess.Board()
+        for _ in range(rng.randrange(10, 40)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        fen = board.fen()
+        line = []
+        for _ in range(4):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            line.append(move.uci())
+            board.push(move)
+        if len(line) == 4:
+            positions.append((fen, " ".join(line)))
+    return positions
+
+
+def seed_data(puzzles: int = 100000, users: int = 50000, communities: int = 20, friends: int = 20,
+              distinct_positions: int = 500, seed: int = 1) -> Dict[str, Any]:
+    """
+    Builds a Firebase tree shaped like production: puzzles, users with friends and communities
+
+    Parameters:
+    - puzzles (int): puzzles under /puzzles
+    - users (int): users under /users
+    - communities (int): communities, every user joins one besides "chess"
+    - friends (int): friends per user
+    - distinct_positions (int): positions the puzzles cycle through, generating one per puzzle would be slow
+    - seed (int): random seed, the same arguments always build the same tree
+    """
+    rng = random.Random(seed)
+    positions = _positions(distinct_positions, rng)
+    themes = ("fork", "pin", "mateIn2", "endgame", "sacrifice", "short", "long", "crushing")
+    puzzle_tree = {}
+    for number in range(puzzles):
+        fen, moves = positions[number % len(positions)]
+        puzzle_tree[puzzle_id(number)] = {
+            "PuzzleId": puzzle_id(number), "FEN": fen, "Moves": moves, "Rating": rng.randrange(600, 2800),
+            "RatingDeviation": 80, "Popularity": 90, "NbPlays": rng.randrange(100, 10000),
+            "Themes": " ".join(rng.sample(themes, 2)), "GameUrl": "", "OpeningTags": "",
+        }
+
+    userids = [f"user{number:07d}" for number in range(users)]
+    community_names = ["chess"] + [f"club{number}" for number in range(communities)]
+    user_tree = {}
+    members: Dict[str, Dict[str, bool]] = {name: {} for name in community_names}
+    for userid in userids:
+        community = rng.choice(community_names[1:]) if communities else None
+        joined = ["chess"] + ([community] if community else [])
+        for name in joined:
+            members[name][userid] = True
+        user_tree[userid] = {
+            "name": userid, "username": userid, "country": rng.choice(("US", "DE", "IN", "BR", "NL")),
+            "friends": {friend: True for friend in rng.sample(userids, min(friends, len(userids)))},
+            "community": joined, "rating": rng.randrange(400, 2600), "attempted": rng.randrange(0, 500),
+            "solved": 0, "streaks": rng.randrange(0, 30), "last_solved_date": None,
+        }
+    return {
+        "puzzles": puzzle_tree,
+        "users": user_tree,
+        "communities": {name: {"members": member_ids} for name, member_ids in members.items()},
+    }
+
+
+def install(store: FakeStore, openai_latency: float = 0.5) -> FakeFirebase:
+    """
+    Patches pyrebase and openai so that importing backend.app builds its clients on the fakes.
+    Must run before backend.app is imported.
+    """
+    import openai
+    import pyrebase
+
+    firebase = FakeFirebase(store)
+    pyrebase.initialize_app = lambda config: firebase
+    FakeOpenAI.latency = openai_latency
+    openai.OpenAI = FakeOpenAI
+    openai.AsyncOpenAI = FakeAsyncOpenAI
+    return firebase
+
+
+def engine_command(think: float = 0.05) -> List[str]:
+    """Command line for the fake UCI engine, usable as an EnginePool engine_path"""
+    return [sys.executable, FAKE_ENGINE, "--think", str(think)]
@@ -0,0 +1,154 @@
+"""
+Concurrent load driver against the Flask app, served on a local port with every upstream faked.
+"""
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+from benchmarks.fakes import FakeStore, engine_command, install
+from benchmarks.results import summarize
+
+# Request = (method, path, JSON body or None)
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    # HTTP/1.0 would open a new connection per request and measure the TCP handshake
+    protocol_version = "HTTP/1.1"
+
+
+def start_app(data: Dict[str, Any], firebase_latency: float = 0.0, openai_latency: float = 0.5,
+              engine_think: float = 0.05) -> Tuple[Any, str, Callable[[], None]]:
+    """
+    Imports backend.app on the fakes and serves it on a free local port
+
+    Returns:
+    - Tuple: the backend.app module, the base URL and a function that stops the server
+    """
+    # Empty values keep load_dotenv from enabling the optional components configured in a local .env
+    for name in ("PUZZLE_STORE_PATH", "FIREBASE_MIRROR_NODES", "ATTEMPT_LOG_PATH", "ANALYSIS_CACHE_PATH",
+                 "SYZYGY_PATH", "EVAL_STORE_PATH", "VERIFY_NEW_PROFILES"):
+        os.environ[name] = ""
+    os.environ["DATABASE_URL"] = "https://benchmark.firebaseio.com"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["HINT_STORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "hints.sqlite3")
+    install(FakeStore(data, firebase_latency), openai_latency)
+
+    from backend import app as app_module
+    app_module.engine_pool.engine_path = engine_command(engine_think)
+
+    # One access log line per request would slow the server down more than the routes
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True, request_handler=_KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True)
+    thread.start()
+
+    def stop() -> None:
+        server.shutdown()
+        app_module.engine_pool.close()
+        app_module.write_queue.close()
+        app_module.hint_store.close()
+    return app_module, f"http://127.0.0.1:{server.server_port}", stop
+
+
+def route_mix(data: Dict[str, Any]) -> Dict[str, Tuple[float, Callable[[random.Random], Request]]]:
+    """The routes driven by the load test, with their share of the traffic and a request builder each"""
+    puzzle_ids = list(data["puzzles"])
+    userids = list(data["users"])
+    communities = [name for name in data["communities"] if name != "chess"] or ["chess"]
+
+    def puzzle(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+        puzzle_id = rng.choice(puzzle_ids)
+        return puzzle_id, data["puzzles"][puzzle_id]
+
+    def attempt(rng: random.Random) -> Request:
+        puzzle_id, fields = puzzle(rng)
+        # The player answers every other move, starting with the second
+        return "POST", f"/puzzles/{puzzle_id}/attempt", {
+            "userid": rng.choice(userids), "moves": fields["Moves"].split(" ")[1::2]}
+
+    return {
+        "random_puzzle": (10, lambda rng: ("GET", "/puzzles/random/", None)),
+        "rated_puzzle": (10, lambda rng: (
+            "GET", f"/puzzles/random/rated?rating={rng.randrange(800, 2400)}&userid={rng.choice(userids)}", None)),
+        "best_move": (10, lambda rng: ("GET", f"/puzzles/{rng.choice(puzzle_ids)}/best-moves/2", None)),
+        "hint": (5, lambda rng: ("GET", f"/puzzles/{rng.choice(puzzle_ids)}/hints/2", None)),
+        "score": (5, lambda rng: ("POST", "/puzzles/score", {"fen": puzzle(rng)[1]["FEN"]})),
+        "attempt": (10, attempt),
+        "user_stats": (10, lambda rng: ("GET", f"/user/{rng.choice(userids)}/stats", None)),
+        "leaderboard_global": (10, lambda rng: ("GET", "/leaderboard/global", None)),
+        "leaderboard_community": (5, lambda rng: ("GET", f"/leaderboard/community/{rng.choice(communities)}", None)),
+        "leaderboard_friends": (5, lambda rng: ("GET", f"/leaderboard/friends/{rng.choice(userids)}", None)),
+    }
+
+
+def drive(base_url: str, mix: Dict[str, Tuple[float, Callable[[random.Random], Request]]], concurrency: int = 16,
+          duration: float = 10.0, warmup: float = 2.0, seed: int = 1) -> Dict[str, Dict[str, float]]:
+    """
+    Sends requests from concurrency closed-loop clients, each picking a route by weight
+
+    Parameters:
+    - base_url (str): server to load
+    - mix (dict): route name to (weight, request builder)
+    - concurrency (int): clients sending requests back to back
+    - duration (float): seconds measured
+    - warmup (float): seconds of traffic before measuring, fills indexes, caches and the engine pool
+    - seed (int): random seed, every client derives its own
+
+    Returns:
+    - dict: route name to latency summary, throughput and error rate, plus "total" for all routes
+    """
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+    samples: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    statuses: Dict[str, Dict[str, int]] = {name: {} for name in names}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client(number: int) -> None:
+        rng = random.Random(seed * 1000 + number)
+        session = requests.Session()
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            name = rng.choices(names, weights)[0]
+            method, path, body = mix[name][1](rng)
+            before = time.perf_counter()
+            try:
+                status = str(session.request(method, base_url + path, json=body, timeout=60).status_code)
+            except requests.RequestException:
+                status = "failed"
+            elapsed = time.perf_counter() - before
+            if before < measure_from:
+                continue
+            with lock:
+                samples[name].append(elapsed)
+                statuses[name][status] = statuses[name].get(status, 0) + 1
+                if status == "failed" or status.startswith("5"):
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=client, args=(number,), daemon=True) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for name in names:
+        summary = summarize(samples[name], duration)
+        summary["error_rate"] = errors[name] / len(samples[name]) if samples[name] else 0.0
+        summary["statuses"] = statuses[name]
+        results[name] = summary
+    every = [sample for name in names for sample in samples[name]]
+    results["total"] = summarize(every, duration)
+    results["total"]["error_rate"] = sum(errors.values()) / len(every) if every else 0.0
+    return results
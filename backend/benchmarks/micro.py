@@ -0,0 +1,66 @@
+"""
+Micro-benchmarks of single backend functions against the in-memory fakes.
+"""
+import random
+import time
+from typing import Any, Callable, Dict
+from backend.functions import get_fen, global_leaderboard, validate_puzzle_id, fetch_puzzle_ids
+from backend.leaderboard import RatingIndex
+from backend.puzzle_index import PuzzleIdIndex
+from benchmarks.fakes import FakeDatabase, FakeStore, puzzle_id
+from benchmarks.results import summarize
+
+
+def measure(call: Callable[[], Any], min_time: float = 1.0, max_calls: int = 100000, min_calls: int = 5,
+            warmup: int = 3) -> Dict[str, float]:
+    """Times call() one call at a time until min_time seconds and min_calls calls, or max_calls calls, have passed"""
+    for _ in range(warmup):
+        call()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_calls and (len(samples) < min_calls or time.perf_counter() - started < min_time):
+        before = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - before)
+    return summarize(samples)
+
+
+def run(data: Dict[str, Any], min_time: float = 1.0, seed: int = 1) -> Dict[str, Dict[str, float]]:
+    """
+    Runs every micro-benchmark on a tree built by fakes.seed_data
+
+    Parameters:
+    - data (dict): the Firebase tree
+    - min_time (float): seconds spent timing each benchmark
+    - seed (int): random seed for the inputs
+
+    Returns:
+    - dict: benchmark name to latency summary
+    """
+    rng = random.Random(seed)
+    db = FakeDatabase(FakeStore(data))
+    puzzles = data["puzzles"]
+    ids = list(puzzles)
+    sample = puzzles[ids[0]]
+    moves = sample["Moves"].split(" ")
+    results = {}
+
+    for move in range(len(moves) + 1):
+        results[f"get_fen.move_{move}"] = measure(lambda: get_fen(sample["FEN"], moves, move), min_time)
+
+    results["global_leaderboard.firebase_scan"] = measure(lambda: global_leaderboard(db, 25), min_time, max_calls=50)
+    index = RatingIndex(lambda: db.child("users").get().val(), rebuild_interval=None)
+    index.rebuild()
+    results["global_leaderboard.rating_index"] = measure(lambda: global_leaderboard(db, 25, index), min_time)
+
+    def existing() -> str:
+        return ids[rng.randrange(len(ids))]
+    def missing() -> str:
+        return puzzle_id(len(ids) + rng.randrange(1000))
+    results["validate_puzzle_id.firebase_shallow"] = measure(
+        lambda: validate_puzzle_id(db, existing()), min_time, max_calls=200)
+    puzzle_index = PuzzleIdIndex(lambda: fetch_puzzle_ids(db), ttl=3600)
+    puzzle_index.refresh()
+    results["validate_puzzle_id.index_hit"] = measure(lambda: validate_puzzle_id(db, existing(), puzzle_index), min_time)
+    results["validate_puzzle_id.index_miss"] = measure(lambda: validate_puzzle_id(db, missing(), puzzle_index), min_time)
+    return results
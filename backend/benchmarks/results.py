@@ -0,0 +1,113 @@
+"""
+Summarizing latency samples, storing benchmark runs as JSON and comparing two runs.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Context stored with a run, not compared
+SKIPPED_KEYS = ("meta", "statuses")
+# Metrics where a larger value is a regression, every other metric regresses when it shrinks
+LOWER_IS_BETTER = ("mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "error_rate")
+
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not ordered:
+        return 0.0
+    index = min(max(int(round(fraction * len(ordered) + 0.5)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(samples: List[float], elapsed: float = None) -> Dict[str, float]:
+    """
+    Latency summary of a list of durations in seconds, with throughput if the wall clock time is given
+
+    Returns:
+    - dict: count, mean, p50, p95, p99 and max in milliseconds, and ops_per_s
+    """
+    ordered = sorted(samples)
+    count = len(ordered)
+    summary = {
+        "count": count,
+        "mean_ms": sum(ordered) / count * 1000 if count else 0.0,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000 if count else 0.0,
+    }
+    total = elapsed if elapsed is not None else sum(ordered)
+    summary["ops_per_s"] = count / total if total else 0.0
+    return summary
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+def metadata(args: Dict[str, Any]) -> Dict[str, Any]:
+    """What a run needs to be compared fairly with another: code version, machine and settings"""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": args,
+    }
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if key in SKIPPED_KEYS:
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> List[Tuple[str, float, float, float, bool]]:
+    """
+    Compares every metric both runs have
+
+    Parameters:
+    - baseline (dict): results of the earlier run
+    - current (dict): results of the run being checked
+    - threshold (float): relative change that counts as a regression, 0.10 is 10%
+
+    Returns:
+    - list: (metric, baseline, current, relative change, regressed) sorted by metric
+    """
+    old, new = _flatten(baseline), _flatten(current)
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        if name.endswith(".count"):
+            continue
+        before, after = old[name], new[name]
+        if before:
+            change = (after - before) / before
+        else:
+            # Errors showing up where there were none is a regression whatever the threshold
+            change = float("inf") if after > 0 else 0.0
+        worse = change > threshold if name.rsplit(".", 1)[-1] in LOWER_IS_BETTER else change < -threshold
+        rows.append((name, before, after, change, worse))
+    return rows
@@ -0,0 +1,251 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from backend.metrics import timed
+
+# Priority classes, lower is admitted first. A player waiting on a hint or a position is
+# interactive, batch analysis can wait longer and is shed first.
+INTERACTIVE = 0
+BATCH = 1
+
+# Limiters held by the current request, so a call that already holds one doesn't queue for it again
+_holding: contextvars.ContextVar[Tuple["AdmissionLimiter", ...]] = contextvars.ContextVar("holding", default=())
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of waiting for a busy upstream"""
+
+    def __init__(self, resource: str, reason: str, retry_after: int):
+        super().__init__(f"{resource} is overloaded ({reason}), retry in {retry_after}s")
+        self.resource = resource
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status(self) -> int:
+        # Shed without waiting is 429, waited the whole timeout without getting in is 503
+        return 503 if self.reason == "timeout" else 429
+
+
+class _Waiter:
+    __slots__ = ("priority", "state", "event", "loop", "future")
+
+    def __init__(self, priority: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        # waiting, then granted, evicted or cancelled
+        self.state = "waiting"
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionLimiter:
+    """
+    Bounds the concurrent calls to one upstream, with a bounded priority queue in front of it.
+
+    Up to limit callers hold a slot at once. The next queue_size wait in priority order, and a
+    freed slot is handed straight to the first of them. A caller arriving at a full queue is shed
+    right away, unless it outranks a waiter, which is then shed in its place. A waiter that isn't
+    admitted within timeout seconds is shed as well. Shed callers get Overloaded with a retry
+    delay estimated from the recent hold times. Threads and event loop tasks share the same slots.
+
+    Parameters:
+    - name (str): upstream name used in errors, stats and metrics
+    - limit (int): concurrent calls
+    - queue_size (int): callers allowed to wait, 0 sheds everything over the limit
+    - timeout (float): seconds a caller waits before it is shed
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int = 0, timeout: float = 5.0):
+        if limit < 1:
+            raise ValueError("Admission limit must be at least 1")
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._in_use = 0
+        # (priority, arrival, waiter) heap, shed waiters stay in it until they are popped
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._waiting = 0
+        self._arrivals = itertools.count()
+        self._hold: Optional[float] = None
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {"queue_full": 0, "evicted": 0, "timeout": 0}
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained, from the average hold time"""
+        hold = self._hold if self._hold is not None else 1.0
+        return max(1, math.ceil(hold * (self._waiting + 1) / self.limit))
+
+    def _enqueue(self, priority: int, loop: Optional[asyncio.AbstractEventLoop]) -> Optional[_Waiter]:
+        """Takes a free slot and returns None, or queues a waiter, or raises Overloaded if the queue is full"""
+        with self._lock:
+            if self._in_use < self.limit and not self._waiting:
+                self._in_use += 1
+                self.admitted += 1
+                return None
+            if self._waiting >= self.queue_size:
+                waiting = [entry for entry in self._queue if entry[2].state == "waiting"]
+                victim = max(waiting, key=lambda entry: entry[:2], default=None)
+                if victim is None or victim[0] <= priority:
+                    self.rejected["queue_full"] += 1
+                    raise Overloaded(self.name, "queue_full", self.retry_after())
+                # The newest of the lowest priority waiters makes room
+                victim[2].state = "evicted"
+                self._waiting -= 1
+                self.rejected["evicted"] += 1
+                victim[2].wake()
+            if len(self._queue) > 2 * self.queue_size + 16:
+                self._queue = [entry for entry in self._queue if entry[2].state == "waiting"]
+                heapq.heapify(self._queue)
+            waiter = _Waiter(priority, loop)
+            heapq.heappush(self._queue, (priority, next(self._arrivals), waiter))
+            self._waiting += 1
+            self.queued += 1
+            return waiter
+
+    def _settle(self, waiter: _Waiter) -> None:
+        """Ends a wait, raises Overloaded unless the waiter was handed a slot"""
+        with self._lock:
+            if waiter.state == "granted":
+                self.admitted += 1
+                return
+            if waiter.state == "waiting":
+                waiter.state = "cancelled"
+                self._waiting -= 1
+                self.rejected["timeout"] += 1
+                reason = "timeout"
+            else:
+                reason = "evicted"
+            retry_after = self.retry_after()
+        raise Overloaded(self.name, reason, retry_after)
+
+    def acquire(self, priority: int = INTERACTIVE) -> None:
+        """Waits for a slot, every successful acquire needs a release"""
+        waiter = self._enqueue(priority, None)
+        if waiter is None:
+            return
+        with timed(self.name, "admission"):
+            waiter.event.wait(self.timeout)
+            self._settle(waiter)
+
+    async def acquire_async(self, priority: int = INTERACTIVE) -> None:
+        """Same as acquire from an event loop, waiting without holding a thread"""
+        waiter = self._enqueue(priority, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        with timed(self.name, "admission"):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # The client went away while queued, a slot handed over meanwhile goes to the next waiter
+                with self._lock:
+                    granted = waiter.state == "granted"
+                    if waiter.state == "waiting":
+                        waiter.state = "cancelled"
+                        self._waiting -= 1
+                if granted:
+                    self.release()
+                raise
+            self._settle(waiter)
+
+    def release(self, held: Optional[float] = None) -> None:
+        """Frees a slot, or hands it to the first waiter. held is the seconds it was held, for retry_after"""
+        with self._lock:
+            if held is not None:
+                self._hold = held if self._hold is None else 0.9 * self._hold + 0.1 * held
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.state == "waiting":
+                    waiter.state = "granted"
+                    self._waiting -= 1
+                    waiter.wake()
+                    return
+            self._in_use -= 1
+
+    @contextmanager
+    def admit(self, priority: int = INTERACTIVE) -> Iterator[None]:
+        """Holds a slot for the enclosed call, calls nested in one that holds it already go straight in"""
+        holding = _holding.get()
+        if self in holding:
+            yield
+            return
+        self.acquire(priority)
+        token = _holding.set(holding + (self,))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _holding.reset(token)
+            self.release(time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def admit_async(self, priority: int = INTERACTIVE) -> AsyncIterator[None]:
+        """Same as admit from an event loop, blocking calls run with run_io inside it don't queue again"""
+        holding = _holding.get()
+        if self in holding:
+            yield
+            return
+        await self.acquire_async(priority)
+        token = _holding.set(holding + (self,))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _holding.reset(token)
+            self.release(time.perf_counter() - started)
+
+    def _releaser(self) -> Callable[[], None]:
+        started = time.perf_counter()
+        released = threading.Event()
+        def release() -> None:
+            if not released.is_set():
+                released.set()
+                self.release(time.perf_counter() - started)
+        return release
+
+    def ticket(self, priority: int = INTERACTIVE) -> Callable[[], None]:
+        """Acquires a slot for work that outlives the call, like a streamed response, returns its release function"""
+        self.acquire(priority)
+        return self._releaser()
+
+    async def ticket_async(self, priority: int = INTERACTIVE) -> Callable[[], None]:
+        await self.acquire_async(priority)
+        return self._releaser()
+
+    def stats(self) -> Dict[str, Any]:
+        rejected = sum(self.rejected.values())
+        return {
+            "limit": self.limit,
+            "in_use": self._in_use,
+            "queued": self._waiting,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "waited": self.queued,
+            "rejected": dict(self.rejected),
+            "rejection_rate": rejected / (self.admitted + rejected) if self.admitted + rejected else 0.0,
+            "hold_seconds": self._hold or 0.0,
+            "retry_after": self.retry_after(),
+        }
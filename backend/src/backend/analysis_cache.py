@@ -0,0 +1,221 @@
+import pickle
+import sqlite3
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+import chess
+import chess.engine
+from backend.cache import LRUCache
+from backend.engine_pool import EnginePool
+from backend.admission import INTERACTIVE
+
+
+class CachedAnalysis(NamedTuple):
+    """An engine result together with the search effort that produced it"""
+    time: Optional[float]
+    depth: int
+    multipv: int
+    infos: List[Dict[str, Any]]
+
+
+class CachedPosition(NamedTuple):
+    """
+    Everything cached for one position: the results no other result is both deeper than and has
+    as many variations as, and the depth each time limit reached when searching this position
+    """
+    entries: Tuple[CachedAnalysis, ...]
+    time_depths: Dict[float, int]
+
+
+class AnalysisCache:
+    """
+    Transposition cache for engine analysis keyed on the normalized position.
+
+    Results live in an in-process LRU tier and, if a path is given, in a SQLite tier
+    that survives restarts. A cached result answers any request that asks for at most
+    the same depth and number of principal variations. A time limited request needs the
+    depth that a search of that time reached on the same position, so once one has run
+    a deeper depth limited result answers it too. A result only replaces one that is at
+    most as deep and has at most as many variations, a deep single variation result and
+    a shallower one with more variations are both kept.
+
+    Parameters:
+    - max_entries (int): number of positions kept in memory
+    - path (str): optional SQLite file for the on-disk tier
+    """
+
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None):
+        self.memory = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_entries ("
+                "position TEXT, time REAL, depth INTEGER, multipv INTEGER, infos BLOB, "
+                "PRIMARY KEY (position, multipv))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_depths ("
+                "position TEXT, time REAL, depth INTEGER, PRIMARY KEY (position, time))"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def position_key(board: chess.Board) -> str:
+        """Normalizes a position: EPD drops the move counters and illegal en passant squares"""
+        return board.epd()
+
+    @staticmethod
+    def cacheable(limit: chess.engine.Limit) -> bool:
+        """Only time and depth limited searches can be compared with each other"""
+        return (limit.time is not None or limit.depth is not None) and limit.nodes is None and limit.mate is None \
+            and limit.white_clock is None and limit.black_clock is None
+
+    @staticmethod
+    def required_depth(position: CachedPosition, limit: chess.engine.Limit) -> Optional[int]:
+        """Depth a cached entry needs to answer the request, None if no search of that time ran on the position"""
+        if limit.depth is not None:
+            return limit.depth
+        depths = [depth for time, depth in position.time_depths.items() if time <= limit.time]
+        return max(depths) if depths else None
+
+    def satisfies(self, position: CachedPosition, entry: CachedAnalysis, limit: chess.engine.Limit,
+                  multipv: int) -> bool:
+        """Checks if a cached entry is at least as deep as the requested search"""
+        if entry.multipv < multipv:
+            return False
+        if limit.depth is None and entry.time is not None and entry.time >= limit.time:
+            return True
+        depth = self.required_depth(position, limit)
+        return depth is not None and entry.depth >= depth
+
+    @staticmethod
+    def dominates(entry: CachedAnalysis, other: CachedAnalysis) -> bool:
+        """An entry makes another redundant if it is at least as deep and has at least as many variations"""
+        return entry.depth >= other.depth and entry.multipv >= other.multipv
+
+    def _load(self, key: str) -> Optional[CachedPosition]:
+        if self._db is None:
+            return None
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT time, depth, multipv, infos FROM analysis_entries WHERE position = ?", (key,)
+            ).fetchall()
+            time_depths = dict(self._db.execute(
+                "SELECT time, depth FROM search_depths WHERE position = ?", (key,)
+            ).fetchall())
+        if not rows and not time_depths:
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        position = CachedPosition(
+            tuple(CachedAnalysis(row[0], row[1], row[2], pickle.loads(row[3])) for row in rows), time_depths
+        )
+        self.memory.put(key, position)
+        return position
+
+    def _position(self, key: str) -> Optional[CachedPosition]:
+        position = self.memory.get(key)
+        return position if position is not None else self._load(key)
+
+    def _store(self, key: str, entry: CachedAnalysis, search_time: Optional[float]) -> None:
+        current = self._position(key) or CachedPosition((), {})
+        entries = current.entries
+        if not any(self.dominates(cached, entry) for cached in entries):
+            entries = tuple(cached for cached in entries if not self.dominates(entry, cached)) + (entry,)
+        time_depths = current.time_depths
+        if search_time is not None:
+            time_depths = dict(time_depths)
+            time_depths[search_time] = max(entry.depth, time_depths.get(search_time, 0))
+        self.memory.put(key, CachedPosition(entries, time_depths))
+        if self._db is None:
+            return
+        # Same rule as in memory, on the rows another process may have written
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO analysis_entries (position, time, depth, multipv, infos) "
+                "SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS ("
+                "SELECT 1 FROM analysis_entries WHERE position = ? AND multipv >= ? AND depth >= ?) "
+                "ON CONFLICT (position, multipv) DO UPDATE SET time = excluded.time, depth = excluded.depth, "
+                "infos = excluded.infos",
+                (key, entry.time, entry.depth, entry.multipv, pickle.dumps(entry.infos), key, entry.multipv, entry.depth),
+            )
+            self._db.execute(
+                "DELETE FROM analysis_entries WHERE position = ? AND multipv < ? AND depth <= ?",
+                (key, entry.multipv, entry.depth),
+            )
+            if search_time is not None:
+                self._db.execute(
+                    "INSERT INTO search_depths (position, time, depth) VALUES (?, ?, ?) "
+                    "ON CONFLICT (position, time) DO UPDATE SET depth = max(depth, excluded.depth)",
+                    (key, search_time, entry.depth),
+                )
+            self._db.commit()
+
+    def _lookup(self, board: chess.Board, limit: chess.engine.Limit, multipv: int) -> Optional[CachedAnalysis]:
+        if not self.cacheable(limit):
+            return None
+        position = self._position(self.position_key(board))
+        if position is None:
+            return None
+        return next((entry for entry in position.entries if self.satisfies(position, entry, limit, multipv)), None)
+
+    def covers(self, board: chess.Board, limit: chess.engine.Limit, multipv: int = 1) -> bool:
+        """Checks if a request would be answered from the cache, without counting it as a hit or miss"""
+        return self._lookup(board, limit, multipv) is not None
+
+    def get(self, board: chess.Board, limit: chess.engine.Limit, multipv: int = 1) -> Optional[List[Dict[str, Any]]]:
+        """Returns the cached principal variations for a position, or None on a miss"""
+        if not self.cacheable(limit):
+            return None
+        entry = self._lookup(board, limit, multipv)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [dict(info, pv=list(info.get("pv", []))) for info in entry.infos[:multipv]]
+
+    def put(self, board: chess.Board, limit: chess.engine.Limit, infos: List[Dict[str, Any]], multipv: int = 1) -> None:
+        """Stores the result of a search, multipv is the number of variations that was asked for"""
+        if not self.cacheable(limit) or not infos:
+            return
+        depth = min(info.get("depth", limit.depth or 0) for info in infos)
+        search_time = limit.time if limit.depth is None else None
+        self._store(self.position_key(board), CachedAnalysis(limit.time, depth, multipv, infos), search_time)
+
+    def analyse(self, pool: EnginePool, board: chess.Board, limit: chess.engine.Limit,
+                multipv: Optional[int] = None,
+                priority: int = INTERACTIVE) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Same contract as engine.analyse: returns an info dict, or a list of them when multipv is given.
+        The engine is only queried when no cached result is deep enough.
+        """
+        infos = self.get(board, limit, multipv or 1)
+        if infos is None:
+            kwargs = {"multipv": multipv} if multipv else {}
+            result = pool.analyse(board, limit, priority, **kwargs)
+            infos = result if multipv else [result]
+            self.put(board, limit, infos, multipv or 1)
+        return infos if multipv else infos[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit, miss and eviction counters for both tiers"""
+        stats = self.memory.stats()
+        # A position found in memory can still be too shallow, so report the answered requests
+        stats["hits"] = self.hits
+        stats["misses"] = self.misses
+        stats["disk_enabled"] = self._db is not None
+        stats["disk_hits"] = self.disk_hits
+        stats["disk_misses"] = self.disk_misses
+        return stats
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -1,61 +1,279 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS  # To handle cross-origin requests
 import requests
 from backend.functions import *
+from backend.engine_pool import EnginePool
+from backend.analysis_cache import AnalysisCache
+from backend.puzzle_index import PuzzleIdIndex
+from backend.clients import firebase_app, openai_client, open_hint_store, open_puzzle_store, open_puzzle_pack
+from backend.puzzle_buckets import RatingBucketIndex, RecentlySeen
+from backend.cache import LRUCache
+from backend.singleflight import SingleFlight, content_key
+from backend.leaderboard import RatingIndex
+from backend.profiles import ProfileLoader
+from backend.provisioning import ProfileVerifier
+from backend.write_behind import WriteBehindQueue
+from backend.attempt_log import AttemptLog
+from backend.mirror import FirebaseMirror
+from backend.http_client import HttpClient
+from backend.tablebase import EndgameTablebase
+from backend.eval_store import EvaluationStore
+from backend.metrics import SlowRequestLog, start_request, finish_request, render as render_metrics
+from backend.batch_analysis import analyse_positions, MAX_BATCH_POSITIONS
+from backend.admission import AdmissionLimiter, Overloaded
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Tuple
-from openai import OpenAI
+import functools
+import logging
 import os
-import pyrebase
+import signal
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Firebase Config Dev Only
-config = {
-  "apiKey": os.getenv("FIREBASE_API_KEY"),
-  "authDomain": os.getenv("FIREBASE_AUTH_DOMAIN"),
-  "databaseURL": os.getenv("DATABASE_URL"),
-  "storageBucket": os.getenv("FIREBASE_STORAGE_BUCKET")
-}
+firebase = firebase_app()
+
+# Shared outbound HTTP session: pooled keep-alive connections, timeouts, retries and a circuit breaker per host.
+# Databases and Auth take the session from the Firebase app, so it must be swapped in before they are created.
+http_client = HttpClient(
+    max_per_host=int(os.getenv("HTTP_MAX_PER_HOST", 32)),
+    connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", 10)),
+    retries=int(os.getenv("HTTP_RETRIES", 2)),
+    failure_threshold=int(os.getenv("HTTP_CIRCUIT_FAILURES", 5)),
+    reset_timeout=float(os.getenv("HTTP_CIRCUIT_RESET", 30))
+)
+firebase.requests = http_client
+
+# External evaluation API behind /query
+STOCKFISH_API_URL = os.getenv("STOCKFISH_API_URL", "https://stockfish.online/api/s/v2.php")
 
-firebase = pyrebase.initialize_app(config)
+# Optional in-memory replica of the listed nodes, kept current by Firebase's realtime stream.
+# Its references are immutable, so unlike pyrebase Databases one can be shared by every thread.
+mirror_nodes = [node.strip() for node in os.getenv("FIREBASE_MIRROR_NODES", "").split(",") if node.strip()]
+mirror = FirebaseMirror(firebase.database, mirror_nodes).start() if mirror_nodes else None
+database = mirror.database if mirror is not None else firebase.database
 
-db = firebase.database()
+db = database()
 auth = firebase.auth()
 
+# Optional local puzzle store filled by backend-import-puzzles, read instead of the Firebase puzzles node
+puzzle_store = open_puzzle_store()
+# Optional memory mapped pack of the store built by backend-pack-puzzles, read instead of the store.
+# The store stays the copy that backend-recalculate-ratings writes to.
+puzzle_pack = open_puzzle_pack()
+local_puzzles = puzzle_pack if puzzle_pack is not None else puzzle_store
+puzzle_db = local_puzzles if local_puzzles is not None else db
+
+# Puzzle id index, refreshed on its own Database instance since pyrebase queries are not thread-safe.
+# The local store is indexed already, so it answers the same membership and random id queries itself.
+if local_puzzles is not None:
+    puzzle_index = local_puzzles
+else:
+    index_db = database()
+    puzzle_index = PuzzleIdIndex(
+        lambda: fetch_puzzle_ids(index_db),
+        ttl=float(os.getenv("PUZZLE_INDEX_TTL", 300))
+    ).start()
+
+# Puzzle ids grouped by rating and theme for skill-matched picks. Firebase can't send only the
+# ratings, so without a local store every refresh downloads the whole puzzles node. The index
+# is only loaded, and then refreshed, once /puzzles/random/rated is first called.
+buckets_db = local_puzzles if local_puzzles is not None else database()
+rating_buckets = RatingBucketIndex(
+    lambda: fetch_puzzle_ratings(buckets_db),
+    ttl=float(os.getenv("PUZZLE_BUCKETS_TTL", 3600)),
+    bucket_width=int(os.getenv("PUZZLE_BUCKET_WIDTH", 50)),
+    themes=os.getenv("PUZZLE_BUCKET_THEMES", "1") == "1"
+)
+recent_puzzles = RecentlySeen(per_user=int(os.getenv("RECENT_PUZZLES_PER_USER", 50)))
+
+# Global leaderboard index, rebuilt on its own Database instance
+leaderboard_db = database()
+rating_index = RatingIndex(
+    lambda: leaderboard_db.child("users").get().val(),
+    rebuild_interval=float(os.getenv("LEADERBOARD_REBUILD_INTERVAL", 600))
+)
+
+# Rating, streak and stat changes, merged in memory and written to Firebase in batches
+write_queue = WriteBehindQueue(
+    database,
+    flush_interval=float(os.getenv("STATS_FLUSH_INTERVAL", 1.0)),
+    max_batch=int(os.getenv("STATS_FLUSH_BATCH", 100))
+).start()
+
+# Optional log of graded attempts, replayed by backend-recalculate-ratings
+attempt_log = AttemptLog(os.getenv("ATTEMPT_LOG_PATH")) if os.getenv("ATTEMPT_LOG_PATH") else None
+
+# Concurrent profile fetches for the community and friends leaderboards
+profile_loader = ProfileLoader(
+    database,
+    max_workers=int(os.getenv("PROFILE_LOADER_WORKERS", 16)),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", 30)),
+    overlay=write_queue.overlay
+)
+
+# Optional read-back of new profiles after sign up, always from Firebase itself
+profile_verifier = ProfileVerifier(firebase.database) if os.getenv("VERIFY_NEW_PROFILES") == "1" else None
+
 # OpenAI API Config
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-openaiclient = OpenAI(
-    api_key = OPENAI_API_KEY
+openaiclient = openai_client()
+# Concurrent OpenAI calls, callers over the limit wait in a bounded queue or are shed with 429/503
+openai_admission = AdmissionLimiter(
+    "openai",
+    int(os.getenv("OPENAI_CONCURRENCY", 16)),
+    queue_size=int(os.getenv("OPENAI_QUEUE_SIZE", 32)),
+    timeout=float(os.getenv("OPENAI_QUEUE_TIMEOUT", 10))
+)
+
+# Stored hints, filled by live requests and by the backend-pregenerate-hints job
+hint_store = open_hint_store()
+
+# Stockfish Config
+ENGINE_POOL_SIZE = int(os.getenv("ENGINE_POOL_SIZE", 2))
+engine_pool = EnginePool(
+    os.getenv("STOCKFISH_PATH", "stockfish"),
+    size=ENGINE_POOL_SIZE,
+    threads=int(os.getenv("ENGINE_THREADS", 1)),
+    hash_mb=int(os.getenv("ENGINE_HASH_MB", 16)),
+    health_interval=float(os.getenv("ENGINE_HEALTH_INTERVAL", 60)),
+    # Interactive analysis queues ahead of batch analysis, a full queue sheds the caller instead of piling up
+    admission=AdmissionLimiter(
+        "engine",
+        ENGINE_POOL_SIZE,
+        queue_size=int(os.getenv("ENGINE_QUEUE_SIZE", 4 * ENGINE_POOL_SIZE)),
+        timeout=float(os.getenv("ENGINE_QUEUE_TIMEOUT", 5))
+    )
+).start()
+# One batch analysis worker per engine
+batch_executor = ThreadPoolExecutor(max_workers=engine_pool.size, thread_name_prefix="batch-analysis")
+analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", 10000)),
+    path=os.getenv("ANALYSIS_CACHE_PATH")
+)
+# Syzygy endgame tables, probed before the engine for positions with few pieces
+tablebase = EndgameTablebase(
+    os.getenv("SYZYGY_PATH"),
+    pv_plies=int(os.getenv("SYZYGY_PV_PLIES", 1))
+) if os.getenv("SYZYGY_PATH") else None
+# Deep analysis of every puzzle position, built by the backend-precompute-evaluations job
+EVAL_STORE_PATH = os.getenv("EVAL_STORE_PATH")
+evaluations = EvaluationStore(EVAL_STORE_PATH) if EVAL_STORE_PATH and os.path.exists(EVAL_STORE_PATH) else None
+
+# Themed hints, deduplicated while in flight and cached by content hash
+theme_flight = SingleFlight(
+    max_size=int(os.getenv("THEME_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("THEME_CACHE_TTL", 86400))
 )
 
+# Expanded puzzle timelines, shared by the hint and best move routes
+timeline_cache = LRUCache(max_size=int(os.getenv("TIMELINE_CACHE_SIZE", 5000)))
+
 # Flask Config
 app = Flask(__name__)
 CORS(app)  # Allow all domains for now (development only)
 
+# Request and upstream latency histograms for /metrics, plus optional traces of sampled slow requests
+slow_requests = SlowRequestLog(
+    threshold=float(os.getenv("SLOW_REQUEST_SECONDS", 1.0)),
+    sample_rate=float(os.getenv("SLOW_REQUEST_SAMPLE", 0))
+)
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = start_request(slow_requests)
+
+@app.after_request
+def record_request_metrics(response: Response) -> Response:
+    # The rule keeps the label count bounded, /puzzles/<puzzle_id>/hints/<int:move_number> instead of every URL
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    finish = functools.partial(finish_request, g.pop("request_metrics", None), route, request.method,
+                               response.status_code, slow_requests)
+    if response.is_streamed:
+        # Timed to the last event or line like the ASGI server does, not to the headers
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+@app.errorhandler(Overloaded)
+def overloaded(error: Overloaded) -> Tuple[Dict[str, Any], int, Dict[str, str]]:
+    """Answers a call shed by admission control, telling the client when to retry"""
+    return jsonify({"error": str(error), "retry_after": error.retry_after}), error.status, \
+        {"Retry-After": str(error.retry_after)}
+
+def wants_event_stream() -> bool:
+    """True if the client asked for server-sent events, with ?stream=1 or an EventSource's Accept header"""
+    return request.args.get("stream") == "1" or "text/event-stream" in request.headers.get("Accept", "")
+
+def event_stream(events) -> Response:
+    # Proxies like nginx buffer responses unless told not to, which would hold the tokens back
+    return Response(stream_with_context(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/puzzles/random/", methods=["GET"])
 def get_random_puzzle() -> Tuple[Dict[str, Any], int]:
     """Returns random puzzle from Firebase realtime database of puzzles"""
     try:
-        puzzle = fetch_random_puzzle(db)
+        puzzle = fetch_random_puzzle(puzzle_db, puzzle_index)
         if validate_puzzle(puzzle):
-            return jsonify(puzzle), 200
+            return jsonify(puzzle.to_dict()), 200
         return jsonify({"error": "Puzzle does not exist"}), 404
-    except:
+    except Exception:
+        logger.exception("Failed to fetch a random puzzle")
         return jsonify({"error": "Server function error"}), 500
 
+@app.route("/puzzles/random/rated", methods=["GET"])
+def get_rated_puzzle() -> Tuple[Dict[str, Any], int]:
+    """Returns a random puzzle close to a rating, skipping the puzzles recently served to the user"""
+    userid = request.args.get("userid")
+    theme = request.args.get("theme")
+    exclude = set(filter(None, request.args.get("exclude", "").split(",")))
+    try:
+        spread = int(request.args.get("range", 100))
+        rating = request.args.get("rating")
+        rating = int(rating) if rating is not None else None
+    except ValueError:
+        return jsonify({"error": "'rating' and 'range' must be integers"}), 400
+    if not 0 <= spread <= 1000:
+        return jsonify({"error": "'range' must be between 0 and 1000"}), 400
+    if rating is None and not userid:
+        return jsonify({"error": "Provide a 'rating' or a 'userid'"}), 400
+
+    try:
+        if rating is None:
+            # Served from the write-behind queue, so only the user's first request reads Firebase
+            rating = write_queue.get(userid).get("rating", 1200)
+        if userid:
+            exclude |= recent_puzzles.get(userid)
+
+        puzzle = fetch_rated_puzzle(puzzle_db, rating_buckets, rating, spread, theme, exclude)
+        if not validate_puzzle(puzzle):
+            return jsonify({"error": "No puzzle in this rating range"}), 404
+        if userid:
+            recent_puzzles.add(userid, puzzle.id)
+        return jsonify(puzzle.to_dict()), 200
+    except KeyError:
+        return jsonify({"error": "User not found"}), 404
+    except Exception as e:
+        return jsonify({"error": f"Failed to fetch rated puzzle: {str(e)}"}), 500
+
 @app.route("/puzzles/<puzzle_id>/best-moves/<int:move_number>", methods=["GET"])
 def get_best_move(puzzle_id: int, move_number: int) -> Tuple[Dict[str, Any], int]:
     """Gets best move based on the puzzle_id and current move_number"""
     try:
         # User Input Error Handling
-        condpuzzle, errpuzzle = validate_puzzle_id(db, puzzle_id)
+        condpuzzle, errpuzzle = validate_puzzle_id(puzzle_db, puzzle_id, puzzle_index)
         if not condpuzzle:
             return jsonify({"error": errpuzzle}), 400
 
-        puzzle = fetch_puzzle(db, puzzle_id)
-        moves = puzzle["Moves"].split(' ')
+        timeline = fetch_timeline(puzzle_db, puzzle_id, timeline_cache)
+        moves = timeline.moves
 
         cond, err = validate_puzzle_move(moves, move_number)
         if not cond:
@@ -63,7 +281,8 @@ def get_best_move(puzzle_id: int, move_number: int) -> Tuple[Dict[str, Any], int
 
         # Success
         return jsonify({"best_move": moves[move_number-1]}), 200
-    except:
+    except Exception:
+        logger.exception("Failed to get best move %s of puzzle %s", move_number, puzzle_id)
         return jsonify({"error": "Server function error"}), 500
 
 @app.route("/puzzles/<puzzle_id>/hints/<int:move_number>", methods=["GET"])
@@ -71,12 +290,19 @@ def gethint(puzzle_id: int, move_number: int, modelversion: str = "gpt-4-turbo")
     """Send the puzzle_id and move_number to OpenAI for explanation."""
     try:
         # User Input Error Handling
-        condpuzzle, errpuzzle = validate_puzzle_id(db, puzzle_id)
+        condpuzzle, errpuzzle = validate_puzzle_id(puzzle_db, puzzle_id, puzzle_index)
         if not condpuzzle:
             return jsonify({"error": errpuzzle}), 400
 
-        puzzle = fetch_puzzle(db, puzzle_id)
-        moves = puzzle["Moves"].split(' ')
+        # Pre-generated or previously served hint, only valid move numbers are ever stored
+        response = hint_store.get(puzzle_id, move_number, modelversion)
+        if response is not None:
+            if wants_event_stream():
+                return event_stream(text_events([response], "hint", "No explanation available."))
+            return jsonify({"hint": response}), 200
+
+        timeline = fetch_timeline(puzzle_db, puzzle_id, timeline_cache)
+        moves = timeline.moves
 
         cond, err = validate_puzzle_move(moves, move_number)
         if not cond:
@@ -84,21 +310,33 @@ def gethint(puzzle_id: int, move_number: int, modelversion: str = "gpt-4-turbo")
 
         # OpenAI API Call Formation
         move = moves[move_number-1]
-        fen = get_fen(puzzle["FEN"], moves, move_number-1)
-        player = get_current_player(fen)
+        fen = timeline.fen(move_number-1)
+        player = timeline.player(move_number-1)
+
+        if wants_event_stream():
+            # Tokens are forwarded as OpenAI produces them, the hint is stored once complete.
+            # The OpenAI slot is held until the stream is closed, not just until the route returns.
+            release = openai_admission.ticket()
+            response = event_stream(text_events(
+                stream_text(openaiclient, hint_request(fen, player, move, modelversion)), "hint",
+                "No explanation available.", lambda hint: hint_store.put(puzzle_id, move_number, modelversion, hint)
+            ))
+            response.call_on_close(release)
+            return response
 
         # OpenAI API Call
-        response = openaiclient.responses.create(
-            model=modelversion,
-            temperature=0.7,
-            max_output_tokens=300,
-            instructions="You are a chess tutor, and you know how to play chess. You are tutoring a student, and you don't want to provide the best move explicitly, but guide the student towards their own discovery of the move. Please be as brief within two lines.",
-            input=f"In the position: {fen} ; the move is for {player}, and the best move is: {move}. Please provide a hint to the student that is not obvious and is not too informative or easy, but reasonable enough."
-        )
-        response = response.output_text if response else "No explanation available."
+        with openai_admission.admit():
+            response = generate_hint(openaiclient, fen, player, move, modelversion)
+        if response:
+            hint_store.put(puzzle_id, move_number, modelversion, response)
+        else:
+            response = "No explanation available."
 
         return jsonify({"hint": response}), 200
-    except:
+    except Overloaded:
+        raise
+    except Exception:
+        logger.exception("Failed to get hint %s of puzzle %s", move_number, puzzle_id)
         return jsonify({"error": "Error fetching explanation."}), 500
     
 @app.route('/sign_up', methods=['POST'])
@@ -142,9 +380,21 @@ def add_profile_info_route():
     username = request.json.get('username')
     country = request.json.get('country')
 
-    response = sign_up_page(db, userUID, name, username, country)
+    response = sign_up_page(db, userUID, name, username, country, profile_verifier)
+    if response[1] == 201:
+        write_queue.invalidate(userUID)
+        rating_index.update(userUID, 1000, {"username": username, "country": country, "streaks": 0})
     return response
 
+@app.route('/add_profile_info/status/<string:userUID>', methods=['GET'])
+def add_profile_info_status_route(userUID):
+    """Returns the background verification status of a new profile"""
+    if profile_verifier is None:
+        return jsonify({"error": "Profile verification is disabled"}), 404
+    status = profile_verifier.status(userUID)
+    if status is None:
+        return jsonify({"error": "No profile verification for this user"}), 404
+    return jsonify(status), 200
 
 @app.route("/query", methods=["POST"])
 def query():
@@ -157,7 +407,10 @@ def query():
 
 
    params = {"fen": fen, "depth": 15}
-   response = requests.get(STOCKFISH_API_URL, params=params)
+   try:
+       response = http_client.get(STOCKFISH_API_URL, params=params)
+   except requests.RequestException as e:
+       return jsonify({"error": f"Stockfish API unavailable: {e}"}), 503
 
 
    if response.status_code == 200:
@@ -200,18 +453,30 @@ def apply_theme(theme: str, modelversion: str = "gpt-4-turbo") -> Tuple[Dict[str
         if not theme.strip():
             return jsonify({"error": "Theme cannot be empty"}), 400
         
-        # Call OpenAI API to apply theme
-        response = openaiclient.responses.create(
-            model=modelversion,
-            temperature=0.7,
-            max_output_tokens=300,
-            instructions=f"You are a creative writer who can rewrite chess hints in different thematic styles while preserving the essential chess guidance.",
-            input=f"Please rewrite this chess hint in a {theme} theme while preserving the chess advice: '{hint}'. Keep it concise, within two lines."
-        )
-        
-        themed_hint = response.output_text if response else "Unable to apply theme to hint."
+        key = content_key(hint, theme, modelversion)
+        if wants_event_stream():
+            # Streams skip the in-flight sharing, a waiter couldn't replay the tokens already sent, but fill the cache
+            cached = theme_flight.cache.get(key)
+            if cached is not None:
+                return event_stream(text_events([cached], "themed_hint", "Unable to apply theme to hint."))
+            release = openai_admission.ticket()
+            response = event_stream(text_events(
+                stream_text(openaiclient, themed_hint_request(hint, theme, modelversion)), "themed_hint",
+                "Unable to apply theme to hint.", lambda themed_hint: theme_flight.cache.put(key, themed_hint)
+            ))
+            response.call_on_close(release)
+            return response
+
+        # Call OpenAI API to apply theme, concurrent identical requests share one call and one admission slot
+        def generate() -> str:
+            with openai_admission.admit():
+                return generate_themed_hint(openaiclient, hint, theme, modelversion)
+        themed_hint = theme_flight.do(key, generate)
+        themed_hint = themed_hint or "Unable to apply theme to hint."
         
         return jsonify({"themed_hint": themed_hint}), 200
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": f"Error applying theme: {str(e)}"}), 500
 
@@ -220,17 +485,28 @@ def apply_theme(theme: str, modelversion: str = "gpt-4-turbo") -> Tuple[Dict[str
 def fetch_leaderboard():
     '''Fetches leaderboard globally'''
     try:
-        leaderboard = global_leaderboard(db)
+        leaderboard = global_leaderboard(db, index=rating_index)
         return jsonify(leaderboard), 200
     except Exception as exp:
         return jsonify({"error": f"Failed to retrieve leaderboard: {exp}"}), 500
 
+@app.route('/leaderboard/global/rank/<string:userid>', methods=['GET'])
+def fetch_global_rank(userid):
+    '''Returns the global leaderboard position of a user'''
+    try:
+        rank = rating_index.rank(userid)
+        if rank is None:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify({"userid": userid, "rank": rank}), 200
+    except Exception as exp:
+        return jsonify({"error": f"Failed to retrieve rank: {exp}"}), 500
+
 # --- COMMUNITY LEADERBOARD ENDPOINT ---
 @app.route('/leaderboard/community/<string:community_name>', methods=['GET'])
 def fetch_community_leaderboard(community_name):
     limit = int(request.args.get("limit", 25))
     try:
-        leaderboard = community_leaderboard(db, community_name, limit)
+        leaderboard = community_leaderboard(db, community_name, limit, profile_loader)
         return jsonify(leaderboard), 200
     except Exception as exp:
         return jsonify({"error": f"Failed to retrieve community leaderboard: {exp}"}), 500
@@ -240,7 +516,7 @@ def fetch_community_leaderboard(community_name):
 def fetch_friends_leaderboard(userid):
     limit = int(request.args.get("limit", 25))
     try:
-        leaderboard = friends_leaderboard(db, userid, limit)
+        leaderboard = friends_leaderboard(db, userid, limit, profile_loader)
         return jsonify(leaderboard), 200
     except Exception as exp:
         return jsonify({"error": f"Failed to retrieve friends leaderboard: {exp}"}), 500
@@ -248,7 +524,7 @@ def fetch_friends_leaderboard(userid):
 @app.route("/puzzles/ids", methods=["GET"])
 def get_puzzle_ids():
     try:
-        ids = fetch_puzzle_ids(db)
+        ids = puzzle_index.ids()
         return jsonify({"puzzle_ids": ids}), 200
     except Exception as e:
         return jsonify({"error": f"Failed to fetch puzzle IDs: {str(e)}"}), 500
@@ -260,8 +536,10 @@ def get_principal_variation_route():
     if not fen:
         return jsonify({"error": "Missing 'fen' in request body"}), 400
     try:
-        pv = get_principal_variation(fen)
+        pv = get_principal_variation(fen, engine_pool, analysis_cache, tablebase, evaluations)
         return jsonify({"principal_variation": [str(move) for move in pv]}), 200
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to get principal variation: {str(e)}"}), 500
 
@@ -272,8 +550,10 @@ def get_score_route():
     if not fen:
         return jsonify({"error": "Missing 'fen' in request body"}), 400
     try:
-        score = get_score(fen)
+        score = get_score(fen, engine_pool, analysis_cache, tablebase, evaluations)
         return jsonify({"score": str(score)}), 200
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to get score: {str(e)}"}), 500
 
@@ -284,11 +564,59 @@ def get_info_route():
     if not fen:
         return jsonify({"error": "Missing 'fen' in request body"}), 400
     try:
-        info = get_info(fen)
+        info = get_info(fen, engine_pool, analysis_cache, tablebase, evaluations)
         return jsonify({"info": str(info)}), 200
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to get engine info: {str(e)}"}), 500
 
+@app.route("/puzzles/analysis/batch", methods=["POST"])
+def analyse_batch_route():
+    """Analyses a list of FENs, or every position of a puzzle, in parallel"""
+    data = request.get_json(silent=True) or {}
+    fens = data.get("fens")
+    puzzle_id = data.get("puzzle_id")
+
+    try:
+        if puzzle_id is not None:
+            condpuzzle, errpuzzle = validate_puzzle_id(puzzle_db, puzzle_id, puzzle_index)
+            if not condpuzzle:
+                return jsonify({"error": errpuzzle}), 400
+            fens = list(fetch_timeline(puzzle_db, puzzle_id, timeline_cache).fens)
+    except Exception as e:
+        return jsonify({"error": f"Failed to expand puzzle: {str(e)}"}), 500
+
+    if not isinstance(fens, list) or not fens or not all(isinstance(fen, str) for fen in fens):
+        return jsonify({"error": "Provide 'fens' as a list of FEN strings or a 'puzzle_id'"}), 400
+    if len(fens) > MAX_BATCH_POSITIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_POSITIONS} positions per batch"}), 400
+
+    multipv = data.get("multipv", 1)
+    time_limit = data.get("time", 0.1)
+    budget = data.get("budget")
+    if not isinstance(multipv, int) or not 1 <= multipv <= 5:
+        return jsonify({"error": "'multipv' must be an integer between 1 and 5"}), 400
+    if not isinstance(time_limit, (int, float)) or not 0 < time_limit <= 5:
+        return jsonify({"error": "'time' must be between 0 and 5 seconds"}), 400
+    if budget is not None and (not isinstance(budget, (int, float)) or budget <= 0):
+        return jsonify({"error": "'budget' must be a positive number of seconds"}), 400
+
+    results = analyse_positions(fens, engine_pool, batch_executor, analysis_cache, multipv, time_limit, budget,
+                                tablebase, evaluations)
+
+    if data.get("stream"):
+        # One JSON object per line, in completion order
+        def generate():
+            for index, result in results:
+                yield app.json.dumps(dict(result, index=index)) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    ordered = [None] * len(fens)
+    for index, result in results:
+        ordered[index] = result
+    return jsonify({"results": ordered}), 200
+
 @app.route("/user/streaks/update", methods=["POST"])
 def update_streaks_route():
     data = request.get_json()
@@ -300,7 +628,8 @@ def update_streaks_route():
         return jsonify({"error": "Missing or invalid parameters"}), 400
 
     try:
-        update_streaks(db, userid, puzzleid, correct)
+        update_streaks(db, userid, puzzleid, correct, rating_index, write_queue)
+        profile_loader.invalidate(userid)
         return jsonify({"message": "Streaks updated"}), 200
     except Exception as e:
         return jsonify({"error": f"Failed to update streaks: {str(e)}"}), 500
@@ -318,9 +647,17 @@ def update_rating():
         if not isinstance(new_rating, int) or new_rating < 0:
             return jsonify({"error": "Rating must be a non-negative integer"}), 400
 
-        db.child("users").child(user_id).update({"rating": new_rating})
-
-        updated_user = db.child("users").child(user_id).get().val()
+        try:
+            # Queued like every other stat change, so a pending solve can't overwrite it
+            write_queue.update(user_id, lambda stats: stats.update(rating=new_rating))
+        except KeyError:
+            # No user node yet, written directly so it is created like it always was
+            db.child("users").child(user_id).update({"rating": new_rating})
+            write_queue.invalidate(user_id)
+
+        updated_user = write_queue.overlay(user_id, db.child("users").child(user_id).get().val())
+        rating_index.update(user_id, new_rating, updated_user)
+        profile_loader.invalidate(user_id)
         return jsonify({
             "message": f"Rating updated to {new_rating}",
             "user": updated_user
@@ -329,8 +666,118 @@ def update_rating():
     except Exception as e:
         return jsonify({"error": f"Failed to update rating: {str(e)}"}), 500
 
+@app.route("/puzzles/<puzzle_id>/attempt", methods=["POST"])
+def submit_attempt_route(puzzle_id: str) -> Tuple[Dict[str, Any], int]:
+    """Grades a full attempt at a puzzle and updates the user's rating, stats and streak in one write"""
+    data = request.get_json(silent=True) or {}
+    userid = data.get("userid")
+    moves = data.get("moves")
+
+    if not userid or not isinstance(moves, list) or not all(isinstance(move, str) for move in moves):
+        return jsonify({"error": "Provide 'userid' and the player's 'moves' as a list of UCI strings"}), 400
+
+    try:
+        condpuzzle, errpuzzle = validate_puzzle_id(puzzle_db, puzzle_id, puzzle_index)
+        if not condpuzzle:
+            return jsonify({"error": errpuzzle}), 400
+
+        timeline = fetch_timeline(puzzle_db, puzzle_id, timeline_cache)
+        if len(moves) > timeline.player_moves:
+            return jsonify({"error": f"The puzzle has only {timeline.player_moves} player moves"}), 400
+
+        correct, correct_moves = timeline.grade(moves)
+        result = record_attempt(db, userid, timeline.rating or DEFAULT_PUZZLE_RATING, correct,
+                                rating_index, write_queue)
+        if attempt_log is not None:
+            attempt_log.append(userid, puzzle_id, correct)
+        profile_loader.invalidate(userid)
+        return jsonify(dict(
+            result,
+            correct=correct,
+            correct_moves=correct_moves,
+            solution=timeline.moves
+        )), 200
+    except KeyError:
+        return jsonify({"error": "User not found"}), 404
+    except Exception as e:
+        return jsonify({"error": f"Failed to submit attempt: {str(e)}"}), 500
+
+@app.route("/user/<string:userid>/stats", methods=["GET"])
+def get_user_stats_route(userid):
+    """Returns the rating, attempt and streak stats of a user, including changes not written yet"""
+    try:
+        return jsonify(write_queue.get(userid)), 200
+    except KeyError:
+        return jsonify({"error": "User not found"}), 404
+    except Exception as e:
+        return jsonify({"error": f"Failed to get user stats: {str(e)}"}), 500
+
+def component_stats() -> Dict[str, Any]:
+    """Counters of the engine pool, caches, indexes and queues"""
+    return {
+        "engine_pool": engine_pool.stats(),
+        "admission": {"engine": engine_pool.admission.stats(), "openai": openai_admission.stats()},
+        "analysis_cache": analysis_cache.stats(),
+        "tablebase": tablebase.stats() if tablebase is not None else None,
+        "evaluations": evaluations.stats() if evaluations is not None else None,
+        "puzzle_index": puzzle_index.stats(),
+        "puzzle_buckets": rating_buckets.stats(),
+        "recent_puzzles": recent_puzzles.stats(),
+        "timeline_cache": timeline_cache.stats(),
+        "hint_store": hint_store.stats(),
+        "theme": theme_flight.stats(),
+        "leaderboard": rating_index.stats(),
+        "profiles": profile_loader.stats(),
+        "stat_writes": write_queue.stats(),
+        "mirror": mirror.stats() if mirror is not None else None,
+        "http": http_client.stats(),
+        "slow_requests": slow_requests.stats()
+    }
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """Returns counters for the engine pool and caches"""
+    return jsonify(component_stats()), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Request and upstream latency histograms and the component counters, in the Prometheus text format"""
+    return Response(render_metrics(component_stats()), mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/slow", methods=["GET"])
+def get_slow_requests():
+    """Returns the sampled slow requests with the time spent in every upstream call"""
+    return jsonify({"slow_requests": slow_requests.traces()}), 200
+
+def close() -> None:
+    """Stops the background threads and closes every engine, store and connection, on any server's shutdown"""
+    # Engine processes run on non-daemon threads, so they must be closed explicitly
+    batch_executor.shutdown(wait=False, cancel_futures=True)
+    engine_pool.close()
+    write_queue.close()
+    if mirror is not None:
+        mirror.stop()
+    analysis_cache.close()
+    if tablebase is not None:
+        tablebase.close()
+    if evaluations is not None:
+        evaluations.close()
+    if puzzle_pack is not None:
+        puzzle_pack.close()
+    hint_store.close()
+    profile_loader.close()
+    if attempt_log is not None:
+        attempt_log.close()
+    if profile_verifier is not None:
+        profile_verifier.close()
+
 def main():
-    app.run(debug=False, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
+    # Turn SIGTERM into a normal exit so pending stat writes are flushed below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        app.run(debug=False, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
+    finally:
+        close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,476 @@
+"""
+ASGI entry point for serving the backend from an event loop.
+
+The I/O-bound routes (engine analysis, hints, themes, leaderboards and random puzzles)
+are handled natively here: OpenAI calls are awaited on the async client, and the
+blocking pyrebase and engine calls are awaited on a dedicated executor so one worker
+can keep hundreds of upstream calls in flight. Every other request, including CORS
+preflights, is passed through to the Flask app unchanged, running on the same executor.
+
+Usage:
+    uv run --extra async backend-asgi
+"""
+import asyncio
+import functools
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from openai import AsyncOpenAI
+from pyrebase.pyrebase import Database
+from backend.functions import *
+from backend.singleflight import content_key
+from backend.metrics import timed, propagate, start_request, finish_request
+from backend.admission import Overloaded
+from backend.clients import thread_database
+from backend.app import (app, close, database, OPENAI_API_KEY, engine_pool, analysis_cache, tablebase, evaluations,
+                         local_puzzles, puzzle_index, timeline_cache, hint_store, theme_flight, rating_index,
+                         profile_loader, slow_requests, openai_admission)
+
+# Executor for the blocking pyrebase and engine calls
+io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASYNC_IO_THREADS", 256)),
+    thread_name_prefix="asgi-io"
+)
+async_openaiclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI request on one shared thread by default, one at a time
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False,
+                                 executor=io_executor)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that serves the Flask requests concurrently on the I/O executor"""
+
+    def __init__(self, wsgi_application: Callable, **kwargs: Any):
+        super().__init__(wsgi_application, **kwargs)
+        self.kwargs = kwargs
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        await ThreadedWsgiInstance(self.wsgi_application, **self.kwargs)(scope, receive, send)
+
+
+wsgi_app = ThreadedWsgiToAsgi(app)
+
+logger = logging.getLogger(__name__)
+_engine_slots: Optional[asyncio.Semaphore] = None
+
+
+# The calling thread's own Database
+thread_db: Callable[[], Database] = thread_database(database)
+
+
+def thread_puzzle_db() -> Any:
+    """Returns the local puzzle pack or store if one is configured, otherwise the calling thread's Database"""
+    return local_puzzles if local_puzzles is not None else thread_db()
+
+
+async def run_io(function: Callable, *args: Any) -> Any:
+    """Awaits a blocking call on the I/O executor"""
+    # The executor doesn't carry the context over, propagate does so the call joins the request's trace
+    return await asyncio.get_running_loop().run_in_executor(io_executor, propagate(functools.partial(function, *args)))
+
+
+async def run_engine(function: Callable, *args: Any) -> Any:
+    """Awaits an engine call, only occupying an executor thread once an engine is free"""
+    global _engine_slots
+    if engine_pool.admission is not None:
+        # The slot is held in the request's context, which run_io carries over, so the pool doesn't queue again
+        async with engine_pool.admission.admit_async():
+            return await run_io(function, *args)
+    if _engine_slots is None:
+        _engine_slots = asyncio.Semaphore(engine_pool.size)
+    async with _engine_slots:
+        return await run_io(function, *args)
+
+
+class AsyncRequest:
+    """The parts of an HTTP request the async handlers need"""
+
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = {key: values[0] for key, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+        self.headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope.get("headers", [])}
+        self.body = body
+
+    def wants_event_stream(self) -> bool:
+        """True if the client asked for server-sent events, with ?stream=1 or an EventSource's Accept header"""
+        return self.args.get("stream") == "1" or "text/event-stream" in self.headers.get("accept", "")
+
+    def get_json(self) -> Any:
+        try:
+            return app.json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+class EventStream:
+    """Returned by a handler in place of a JSON payload to send server-sent events"""
+
+    def __init__(self, events: AsyncIterator[str], on_close: Optional[Callable[[], None]] = None):
+        self.events = events
+        self.on_close = on_close
+
+
+Response = Tuple[Any, int]
+
+
+async def stream_text_async(arguments: Dict[str, Any]) -> AsyncIterator[str]:
+    """Async stream_text: yields the response's text as OpenAI produces it, cancelling closes the upstream stream"""
+    with timed("openai", "responses.stream"):
+        stream = await async_openaiclient.responses.create(stream=True, **arguments)
+        try:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+        finally:
+            await stream.close()
+
+
+async def text_events_async(chunks: AsyncIterator[str], key: str, fallback: str,
+                            on_complete: Callable[[str], Awaitable[Any]] = None) -> AsyncIterator[str]:
+    """Async text_events: "delta" events as the text arrives, then "done" with the whole text or an "error" event"""
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield server_sent_event("delta", {"text": chunk})
+        text = "".join(parts)
+        if text:
+            if on_complete is not None:
+                await on_complete(text)
+        else:
+            text = fallback
+            yield server_sent_event("delta", {"text": text})
+        yield server_sent_event("done", {key: text})
+    except Exception:
+        logger.exception("Streaming %s failed", key)
+        yield server_sent_event("error", {"error": f"Error streaming {key}."})
+    finally:
+        await chunks.aclose()
+
+
+async def replay(texts: Iterable[str]) -> AsyncIterator[str]:
+    """A stored text as a stream, so cache hits are sent the same way as fresh answers"""
+    for text in texts:
+        yield text
+
+
+async def get_random_puzzle(request: AsyncRequest) -> Response:
+    try:
+        puzzle = await run_io(lambda: fetch_random_puzzle(thread_puzzle_db(), puzzle_index))
+        if validate_puzzle(puzzle):
+            return puzzle.to_dict(), 200
+        return {"error": "Puzzle does not exist"}, 404
+    except Exception:
+        logger.exception("Failed to fetch a random puzzle")
+        return {"error": "Server function error"}, 500
+
+
+async def gethint(request: AsyncRequest, puzzle_id: str, move_number: str, modelversion: str = "gpt-4-turbo") -> Response:
+    move_number = int(move_number)
+    try:
+        condpuzzle, errpuzzle = await run_io(lambda: validate_puzzle_id(thread_puzzle_db(), puzzle_id, puzzle_index))
+        if not condpuzzle:
+            return {"error": errpuzzle}, 400
+
+        response = await run_io(hint_store.get, puzzle_id, move_number, modelversion)
+        if response is not None:
+            if request.wants_event_stream():
+                return EventStream(text_events_async(replay([response]), "hint", "No explanation available.")), 200
+            return {"hint": response}, 200
+
+        timeline = await run_io(lambda: fetch_timeline(thread_puzzle_db(), puzzle_id, timeline_cache))
+        moves = timeline.moves
+
+        cond, err = validate_puzzle_move(moves, move_number)
+        if not cond:
+            return {"error": err}, 400
+
+        move = moves[move_number-1]
+        fen = timeline.fen(move_number-1)
+        player = timeline.player(move_number-1)
+
+        if request.wants_event_stream():
+            release = await openai_admission.ticket_async()
+            return EventStream(text_events_async(
+                stream_text_async(hint_request(fen, player, move, modelversion)), "hint", "No explanation available.",
+                lambda hint: run_io(hint_store.put, puzzle_id, move_number, modelversion, hint)
+            ), release), 200
+
+        async with openai_admission.admit_async():
+            with timed("openai", "responses.create"):
+                response = await async_openaiclient.responses.create(**hint_request(fen, player, move, modelversion))
+        response = response.output_text if response else None
+        if response:
+            await run_io(hint_store.put, puzzle_id, move_number, modelversion, response)
+        else:
+            response = "No explanation available."
+
+        return {"hint": response}, 200
+    except Overloaded:
+        raise
+    except Exception:
+        logger.exception("Failed to get hint %s of puzzle %s", move_number, puzzle_id)
+        return {"error": "Error fetching explanation."}, 500
+
+
+async def apply_theme(request: AsyncRequest, theme: str, modelversion: str = "gpt-4-turbo") -> Response:
+    try:
+        request_data = request.get_json()
+        if not request_data or 'hint' not in request_data:
+            return {"error": "Missing 'hint' in request body"}, 400
+
+        hint = request_data['hint']
+
+        if not hint.strip():
+            return {"error": "Hint cannot be empty"}, 400
+        if not theme.strip():
+            return {"error": "Theme cannot be empty"}, 400
+
+        key = content_key(hint, theme, modelversion)
+        if request.wants_event_stream():
+            # Streams skip the in-flight sharing, a waiter couldn't replay the tokens already sent, but fill the cache
+            cached = theme_flight.cache.get(key)
+            if cached is not None:
+                return EventStream(text_events_async(replay([cached]), "themed_hint",
+                                                     "Unable to apply theme to hint.")), 200
+            release = await openai_admission.ticket_async()
+
+            async def store(themed_hint: str) -> None:
+                theme_flight.cache.put(key, themed_hint)
+            return EventStream(text_events_async(stream_text_async(themed_hint_request(hint, theme, modelversion)),
+                                                 "themed_hint", "Unable to apply theme to hint.", store), release), 200
+
+        async def generate() -> Optional[str]:
+            async with openai_admission.admit_async():
+                with timed("openai", "responses.create"):
+                    response = await async_openaiclient.responses.create(
+                        **themed_hint_request(hint, theme, modelversion))
+            return response.output_text if response else None
+
+        themed_hint = await theme_flight.do_async(key, generate)
+        themed_hint = themed_hint or "Unable to apply theme to hint."
+
+        return {"themed_hint": themed_hint}, 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("Failed to apply theme %s", theme)
+        return {"error": f"Error applying theme: {str(e)}"}, 500
+
+
+async def fetch_leaderboard(request: AsyncRequest) -> Response:
+    try:
+        leaderboard = await run_io(lambda: global_leaderboard(thread_db(), index=rating_index))
+        return leaderboard, 200
+    except Exception as exp:
+        logger.exception("Failed to retrieve the global leaderboard")
+        return {"error": f"Failed to retrieve leaderboard: {exp}"}, 500
+
+
+async def fetch_community_leaderboard(request: AsyncRequest, community_name: str) -> Response:
+    try:
+        limit = int(request.args.get("limit", 25))
+        leaderboard = await run_io(lambda: community_leaderboard(thread_db(), community_name, limit, profile_loader))
+        return leaderboard, 200
+    except Exception as exp:
+        logger.exception("Failed to retrieve the leaderboard of community %s", community_name)
+        return {"error": f"Failed to retrieve community leaderboard: {exp}"}, 500
+
+
+async def fetch_friends_leaderboard(request: AsyncRequest, userid: str) -> Response:
+    try:
+        limit = int(request.args.get("limit", 25))
+        leaderboard = await run_io(lambda: friends_leaderboard(thread_db(), userid, limit, profile_loader))
+        return leaderboard, 200
+    except Exception as exp:
+        logger.exception("Failed to retrieve the friends leaderboard of user %s", userid)
+        return {"error": f"Failed to retrieve friends leaderboard: {exp}"}, 500
+
+
+def _engine_route(function: Callable, key: str, error: str, serialize: Callable[[Any], Any]) -> Callable:
+    """Builds a handler for the /puzzles/pv, /puzzles/score and /puzzles/info routes"""
+    async def handler(request: AsyncRequest) -> Response:
+        data = request.get_json() or {}
+        fen = data.get("fen")
+        if not fen:
+            return {"error": "Missing 'fen' in request body"}, 400
+        try:
+            # Tablebase, precomputed and cached positions don't need an engine, so they skip the queue for one
+            board = chess.Board(fen)
+            covered = (tablebase is not None and tablebase.covers(board)) or \
+                (evaluations is not None and board in evaluations) or analysis_cache.covers(board, ANALYSIS_LIMIT)
+            runner = run_io if covered else run_engine
+            result = await runner(function, fen, engine_pool, analysis_cache, tablebase, evaluations)
+            return {key: serialize(result)}, 200
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.exception("%s for %s", error, fen)
+            return {"error": f"{error}: {str(e)}"}, 500
+    return handler
+
+
+ROUTES: List[Tuple[str, Pattern, Callable[..., Awaitable[Response]]]] = [
+    ("GET", re.compile(r"^/puzzles/random/$"), get_random_puzzle),
+    ("GET", re.compile(r"^/puzzles/(?P<puzzle_id>[^/]+)/hints/(?P<move_number>\d+)$"), gethint),
+    ("POST", re.compile(r"^/theme/(?P<theme>[^/]+)$"), apply_theme),
+    ("GET", re.compile(r"^/leaderboard/global$"), fetch_leaderboard),
+    ("GET", re.compile(r"^/leaderboard/community/(?P<community_name>[^/]+)$"), fetch_community_leaderboard),
+    ("GET", re.compile(r"^/leaderboard/friends/(?P<userid>[^/]+)$"), fetch_friends_leaderboard),
+    ("POST", re.compile(r"^/puzzles/pv$"), _engine_route(
+        get_principal_variation, "principal_variation", "Failed to get principal variation",
+        lambda pv: [str(move) for move in pv])),
+    ("POST", re.compile(r"^/puzzles/score$"), _engine_route(get_score, "score", "Failed to get score", str)),
+    ("POST", re.compile(r"^/puzzles/info$"), _engine_route(get_info, "info", "Failed to get engine info", str)),
+]
+
+
+def route_label(pattern: Pattern) -> str:
+    """Turns a route pattern into a Flask-style rule for metric labels, e.g. /puzzles/<puzzle_id>/hints/<move_number>"""
+    return re.sub(r"\(\?P<(\w+)>[^)]*\)", r"<\1>", pattern.pattern.strip("^$"))
+
+
+ROUTE_LABELS: Dict[Pattern, str] = {pattern: route_label(pattern) for _, pattern, _ in ROUTES}
+
+
+def match_route(method: str, path: str) -> Optional[Tuple[Callable[..., Awaitable[Response]], Dict[str, str], str]]:
+    for route_method, pattern, handler in ROUTES:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return handler, match.groupdict(), ROUTE_LABELS[pattern]
+    return None
+
+
+async def read_body(receive: Callable) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send: Callable, payload: Any, status: int, headers: Iterable[Tuple[bytes, bytes]] = ()) -> None:
+    body = app.json.dumps(payload).encode("utf-8") + b"\n"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", b"*"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_events(send: Callable, receive: Callable, stream: EventStream) -> bool:
+    """
+    Sends server-sent events as they are produced, cancelling the stream if the client disconnects
+
+    Returns:
+    - bool: True if every event was sent, False if the client went away first
+    """
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+
+    async def pump() -> None:
+        try:
+            async for event in stream.events:
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            # Cancelled while sending, the generators would otherwise only be closed by the garbage collector
+            await stream.events.aclose()
+
+    async def disconnected() -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    sending = asyncio.ensure_future(pump())
+    watching = asyncio.ensure_future(disconnected())
+    done, _ = await asyncio.wait({sending, watching}, return_when=asyncio.FIRST_COMPLETED)
+    if sending in done:
+        watching.cancel()
+        sending.result()
+        return True
+    # Cancelling unwinds the generators, which close the OpenAI stream so no more tokens are generated
+    sending.cancel()
+    try:
+        await sending
+    except asyncio.CancelledError:
+        pass
+    return False
+
+
+async def asgi_app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    """Serves the native async routes and hands every other request to the Flask app"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await run_io(close)
+                io_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    route = match_route(scope.get("method", ""), scope.get("path", "")) if scope["type"] == "http" else None
+    if route is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    handler, params, label = route
+    state = start_request(slow_requests)
+    request = AsyncRequest(scope, await read_body(receive))
+    try:
+        payload, status = await handler(request, **params)
+    except Overloaded as e:
+        # Shed by admission control, like the Flask app's Overloaded handler
+        status = e.status
+        await send_json(send, {"error": str(e), "retry_after": e.retry_after}, status,
+                        [(b"retry-after", str(e.retry_after).encode())])
+        finish_request(state, label, request.method, status, slow_requests)
+        return
+    if isinstance(payload, EventStream):
+        # Timed to the last event, a disconnect is recorded as 499 like nginx does
+        try:
+            status = 200 if await send_events(send, receive, payload) else 499
+        finally:
+            if payload.on_close is not None:
+                payload.on_close()
+    else:
+        await send_json(send, payload, status)
+    finish_request(state, label, request.method, status, slow_requests)
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("Async serving needs the async extra: uv sync --extra async")
+    uvicorn.run(asgi_app, host="0.0.0.0", port=int(os.getenv("PORT", 5000)), lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
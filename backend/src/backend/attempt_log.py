@@ -0,0 +1,70 @@
+import csv
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+# Columns of the attempt log, one row per graded puzzle attempt
+LOG_COLUMNS = ("timestamp", "userid", "puzzle_id", "correct")
+
+
+class AttemptLog:
+    """
+    Append-only CSV log of graded puzzle attempts, replayed by backend-recalculate-ratings.
+
+    Parameters:
+    - path (str): file the attempts are appended to
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+
+        self.appended = 0
+
+    def append(self, userid: str, puzzle_id: str, correct: bool, timestamp: Optional[float] = None) -> None:
+        row = (f"{timestamp if timestamp is not None else time.time():.3f}", userid, puzzle_id, int(correct))
+        with self._lock:
+            self._writer.writerow(row)
+            # One attempt per write so a crash loses at most the attempt being written
+            self._file.flush()
+            self.appended += 1
+
+    def stats(self) -> Dict[str, object]:
+        return {"path": self.path, "appended": self.appended}
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Attempts(NamedTuple):
+    """An attempt log loaded into flat arrays, users and puzzles are numbered in order of appearance"""
+    timestamps: array
+    users: array
+    puzzles: array
+    correct: array
+    userids: List[str]
+    puzzle_ids: List[str]
+
+
+def _rows(path: str) -> Iterator[List[str]]:
+    with open(path, "r", encoding="utf-8", newline="") as handle:
+        for row in csv.reader(handle):
+            if len(row) == len(LOG_COLUMNS) and row[0] != LOG_COLUMNS[0]:
+                yield row
+
+
+def read_attempts(path: str) -> Attempts:
+    """Loads an attempt log into typed arrays, the ids are replaced by their number while reading"""
+    timestamps, users, puzzles, correct = array("d"), array("i"), array("i"), array("b")
+    user_numbers: Dict[str, int] = {}
+    puzzle_numbers: Dict[str, int] = {}
+    for timestamp, userid, puzzle_id, solved in _rows(path):
+        timestamps.append(float(timestamp))
+        users.append(user_numbers.setdefault(userid, len(user_numbers)))
+        puzzles.append(puzzle_numbers.setdefault(puzzle_id, len(puzzle_numbers)))
+        correct.append(solved == "1")
+    return Attempts(timestamps, users, puzzles, correct, list(user_numbers), list(puzzle_numbers))
@@ -0,0 +1,108 @@
+import time
+from concurrent.futures import Executor, Future, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import chess
+import chess.engine
+from backend.admission import BATCH, Overloaded
+from backend.engine_pool import EnginePool
+from backend.analysis_cache import AnalysisCache
+from backend.tablebase import EndgameTablebase
+from backend.eval_store import EvaluationStore
+
+# Upper bound on the positions one batch request may ask for
+MAX_BATCH_POSITIONS = 256
+
+
+def serialize_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns an engine info dict into JSON, scores are from white's point of view"""
+    score = info.get("score")
+    white = score.white() if score is not None else None
+    return {
+        "score": str(score) if score is not None else None,
+        "cp": white.score() if white is not None else None,
+        "mate": white.mate() if white is not None else None,
+        "depth": info.get("depth"),
+        "pv": [move.uci() for move in info.get("pv", [])],
+        "tablebase": bool(info.get("tablebase")),
+        "precomputed": bool(info.get("precomputed")),
+    }
+
+
+def _analyse_one(fen: str, pool: EnginePool, cache: Optional[AnalysisCache], multipv: int,
+                 time_limit: float, deadline: Optional[float],
+                 tablebase: Optional[EndgameTablebase],
+                 evaluations: Optional[EvaluationStore]) -> Dict[str, Any]:
+    try:
+        board = chess.Board(fen)
+    except ValueError as e:
+        return {"fen": fen, "error": f"Invalid FEN: {e}"}
+
+    # The tablebase knows a single best line, more lines still need the engine
+    if tablebase is not None and multipv == 1:
+        info = tablebase.probe(board)
+        if info is not None:
+            return {"fen": fen, "lines": [serialize_info(info)]}
+    if evaluations is not None:
+        infos = evaluations.get(board, multipv)
+        if infos is not None:
+            return {"fen": fen, "lines": [serialize_info(info) for info in infos]}
+
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {"fen": fen, "error": "Batch time budget exceeded"}
+        time_limit = min(time_limit, remaining)
+
+    limit = chess.engine.Limit(time=time_limit)
+    try:
+        # Batches queue behind single positions, a player is waiting on those
+        if cache is not None:
+            infos = cache.analyse(pool, board, limit, multipv=multipv, priority=BATCH)
+        else:
+            infos = pool.analyse(board, limit, BATCH, multipv=multipv)
+    except Overloaded as e:
+        return {"fen": fen, "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        return {"fen": fen, "error": f"Engine error: {e}"}
+    return {"fen": fen, "lines": [serialize_info(info) for info in infos]}
+
+
+def analyse_positions(fens: List[str], pool: EnginePool, executor: Executor, cache: AnalysisCache = None,
+                      multipv: int = 1, time_limit: float = 0.1,
+                      budget: Optional[float] = None,
+                      tablebase: EndgameTablebase = None,
+                      evaluations: EvaluationStore = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Analyses many positions in parallel on the engine pool
+
+    Parameters:
+    - fens (list): positions to analyse
+    - pool (EnginePool): engines the positions are spread across
+    - executor (Executor): runs one search per worker, should have as many workers as the pool has engines
+    - cache (AnalysisCache): optional cache consulted before searching
+    - multipv (int): number of principal variations per position
+    - time_limit (float): search time per position in seconds
+    - budget (float): optional wall clock budget for the whole batch, later positions get less time
+    - tablebase (EndgameTablebase): optional endgame tables probed before the engine
+    - evaluations (EvaluationStore): optional precomputed analysis looked up before the engine
+
+    Returns:
+    - Iterator[Tuple[int, dict]]: (index into fens, result) in completion order
+    """
+    deadline = None
+    if budget is not None:
+        deadline = time.monotonic() + budget
+        # Share the budget evenly between the positions each engine will search
+        time_limit = min(time_limit, budget * pool.size / max(len(fens), 1))
+    futures: Dict[Future, int] = {
+        executor.submit(_analyse_one, fen, pool, cache, multipv, time_limit, deadline, tablebase,
+                        evaluations): index
+        for index, fen in enumerate(fens)
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # The client went away or the caller stopped early, don't search positions nobody will read
+        for future in futures:
+            future.cancel()
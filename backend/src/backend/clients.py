@@ -0,0 +1,70 @@
+"""
+Clients built from the environment, shared by the app and the batch jobs.
+
+Importing backend.app starts the app's indexes and background threads, so the batch jobs
+build only the clients they need from here.
+"""
+import os
+import threading
+from typing import Any, Callable, Optional, Union
+import pyrebase
+from dotenv import load_dotenv
+from openai import OpenAI
+from backend.hint_store import HintStore
+from backend.puzzle import PuzzlePack
+from backend.puzzle_store import PuzzleStore
+
+load_dotenv()
+
+
+def firebase_app() -> Any:
+    """Initializes the pyrebase app from the FIREBASE_* and DATABASE_URL variables"""
+    return pyrebase.initialize_app({
+        "apiKey": os.getenv("FIREBASE_API_KEY"),
+        "authDomain": os.getenv("FIREBASE_AUTH_DOMAIN"),
+        "databaseURL": os.getenv("DATABASE_URL"),
+        "storageBucket": os.getenv("FIREBASE_STORAGE_BUCKET")
+    })
+
+
+def openai_client() -> OpenAI:
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def open_hint_store() -> HintStore:
+    return HintStore(
+        os.getenv("HINT_STORE_PATH", "hints.sqlite3"),
+        max_variants=int(os.getenv("HINT_VARIANTS", 3)),
+        max_rows=int(os.getenv("HINT_STORE_MAX_ROWS", 500000))
+    )
+
+
+def open_puzzle_store() -> Optional[PuzzleStore]:
+    """The local puzzle store filled by backend-import-puzzles, None if PUZZLE_STORE_PATH is not set"""
+    return PuzzleStore(os.getenv("PUZZLE_STORE_PATH")) if os.getenv("PUZZLE_STORE_PATH") else None
+
+
+def open_puzzle_pack() -> Optional[PuzzlePack]:
+    """The memory mapped pack built by backend-pack-puzzles, None if PUZZLE_PACK_PATH is not set or missing"""
+    path = os.getenv("PUZZLE_PACK_PATH")
+    return PuzzlePack(path) if path and os.path.exists(path) else None
+
+
+def thread_database(database: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Returns a function giving the calling thread a Database of its own, made by database on
+    the thread's first call. pyrebase query builders are not thread-safe, so threads can't share one.
+    """
+    local = threading.local()
+    def get() -> Any:
+        if not hasattr(local, "db"):
+            local.db = database()
+        return local.db
+    return get
+
+
+def puzzle_database(firebase: Any, local_puzzles: Union[PuzzleStore, PuzzlePack, None]) -> Callable[[], Any]:
+    """Returns a function giving the puzzle source: the local pack or store if there is one, otherwise the thread's Database"""
+    if local_puzzles is not None:
+        return lambda: local_puzzles
+    return thread_database(firebase.database)
@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, Iterator, List, Optional
+import chess
+import chess.engine
+from backend.admission import AdmissionLimiter, INTERACTIVE
+from backend.metrics import timed
+
+logger = logging.getLogger(__name__)
+# Returned by _take when the caller has to wait for an engine
+_WAIT = object()
+
+
+class EnginePoolTimeout(TimeoutError):
+    """Raised when no engine could be checked out in time"""
+
+
+class EnginePool:
+    """
+    Keeps a fixed number of long-lived UCI engine processes and hands them out one at a time.
+
+    Engines are started lazily on first checkout, pinged before being handed out and
+    replaced transparently if they crashed or stopped answering. Once started, idle engines
+    are also pinged every health_interval seconds so dead ones are replaced before a caller
+    gets them.
+
+    Parameters:
+    - engine_path (str): path to the UCI engine binary (e.g. stockfish)
+    - size (int): maximum number of engine processes kept alive
+    - threads (int): value for the engine's "Threads" option
+    - hash_mb (int): value for the engine's "Hash" option in megabytes
+    - timeout (float): seconds to wait for the engine handshake and health checks
+    - health_interval (float): seconds between background health checks of the idle engines
+    - admission (AdmissionLimiter): optional bounded priority queue callers wait in for an engine,
+      instead of every caller blocking until the timeout
+    """
+
+    def __init__(self, engine_path: str, size: int = 2, threads: int = 1, hash_mb: int = 16, timeout: float = 10.0,
+                 health_interval: float = 60.0, admission: AdmissionLimiter = None):
+        if size < 1:
+            raise ValueError("Engine pool size must be at least 1")
+        self.engine_path = engine_path
+        self.size = size
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.admission = admission
+
+        # Used as a stack so the most recently used engine (with the warmest hash table) is reused first
+        self._idle: List[chess.engine.SimpleEngine] = []
+        # Notified when an engine is checked in or a slot is freed, so waiters can take it or spawn
+        self._available = threading.Condition()
+        self._alive = 0
+        self._closed = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.checkouts = 0
+        self.restarts = 0
+        self.health_checks = 0
+
+    def _spawn(self) -> chess.engine.SimpleEngine:
+        """Starts a new engine process and applies the configured options"""
+        with timed("engine", "popen_uci"):
+            engine = chess.engine.SimpleEngine.popen_uci(self.engine_path, timeout=self.timeout)
+        options = {name: value for name, value in self.options.items() if name in engine.options}
+        if options:
+            engine.configure(options)
+        return engine
+
+    def _free_slot(self) -> None:
+        with self._available:
+            self._alive -= 1
+            self._available.notify()
+
+    def _discard(self, engine: chess.engine.SimpleEngine) -> None:
+        """Closes an engine and frees its slot in the pool"""
+        try:
+            engine.close()
+        except Exception:
+            pass
+        self._free_slot()
+
+    def _healthy(self, engine: chess.engine.SimpleEngine) -> bool:
+        try:
+            engine.ping()
+            return True
+        except Exception:
+            return False
+
+    def _take(self) -> Any:
+        """Pops an idle engine, or reserves a slot and returns None, or returns _WAIT. Call with _available held"""
+        if self._closed:
+            raise RuntimeError("Engine pool is closed")
+        if self._idle:
+            return self._idle.pop()
+        if self._alive < self.size:
+            self._alive += 1
+            return None
+        return _WAIT
+
+    def checkout(self, timeout: Optional[float] = None) -> chess.engine.SimpleEngine:
+        """Takes an engine out of the pool, starting or restarting one if needed"""
+        with self._available:
+            engine = self._take()
+        if engine is _WAIT:
+            # Time spent waiting for a busy pool, separate from the spawn and search times
+            with timed("engine", "wait"), self._available:
+                deadline = time.monotonic() + timeout if timeout is not None else None
+                while (engine := self._take()) is _WAIT:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise EnginePoolTimeout(f"No engine available after {timeout}s")
+                    self._available.wait(remaining)
+
+        if engine is None:
+            try:
+                engine = self._spawn()
+            except Exception:
+                self._free_slot()
+                raise
+
+        if not self._healthy(engine):
+            # The process crashed or hung since it was last used: replace it in the same slot
+            try:
+                engine.close()
+            except Exception:
+                pass
+            try:
+                engine = self._spawn()
+            except Exception:
+                self._free_slot()
+                raise
+            with self._available:
+                self.restarts += 1
+
+        with self._available:
+            self.checkouts += 1
+        return engine
+
+    def checkin(self, engine: chess.engine.SimpleEngine, broken: bool = False) -> None:
+        """Returns an engine to the pool, or drops it if it is broken or the pool is closed"""
+        with self._available:
+            if not (broken or self._closed):
+                self._idle.append(engine)
+                self._available.notify()
+                return
+        self._discard(engine)
+
+    @contextmanager
+    def engine(self, timeout: Optional[float] = None, priority: int = INTERACTIVE) -> Iterator[chess.engine.SimpleEngine]:
+        """Context manager that checks an engine out and always checks it back in, raises Overloaded when shed"""
+        with self.admission.admit(priority) if self.admission is not None else nullcontext():
+            engine = self.checkout(timeout)
+            broken = False
+            try:
+                yield engine
+            except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+                broken = True
+                raise
+            finally:
+                self.checkin(engine, broken)
+
+    def analyse(self, board: chess.Board, limit: chess.engine.Limit, priority: int = INTERACTIVE, **kwargs: Any) -> Any:
+        """Runs engine.analyse on a pooled engine, retrying once if the engine died mid-search"""
+        try:
+            with self.engine(self.timeout, priority) as engine, timed("engine", "analyse"):
+                return engine.analyse(board, limit, **kwargs)
+        except chess.engine.EngineTerminatedError:
+            with self._available:
+                self.restarts += 1
+            with self.engine(self.timeout, priority) as engine, timed("engine", "analyse"):
+                return engine.analyse(board, limit, **kwargs)
+
+    def health_check(self) -> int:
+        """Pings every idle engine and discards the dead ones, returns how many were discarded"""
+        # Taken out of the pool while pinged, so a caller never gets an engine mid-ping
+        with self._available:
+            idle, self._idle = self._idle, []
+
+        discarded = 0
+        for engine in idle:
+            if self._healthy(engine):
+                self.checkin(engine)
+            else:
+                self._discard(engine)
+                discarded += 1
+        with self._available:
+            self.health_checks += 1
+        return discarded
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.health_interval):
+            try:
+                discarded = self.health_check()
+                if discarded:
+                    logger.warning("Discarded %d dead engines", discarded)
+            except Exception:
+                logger.exception("Engine health check failed")
+
+    def start(self) -> "EnginePool":
+        """Starts the background health checks, a health_interval of 0 turns them off"""
+        if self._thread is None and self.health_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="engine-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns counters describing the pool"""
+        with self._available:
+            return {
+                "size": self.size,
+                "alive": self._alive,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "restarts": self.restarts,
+                "health_checks": self.health_checks,
+            }
+
+    def close(self) -> None:
+        """Shuts down every idle engine, engines still checked out are closed on checkin"""
+        self._stopped.set()
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            # Waiters wake up to the closed pool instead of waiting out their timeout
+            self._available.notify_all()
+        for engine in idle:
+            self._discard(engine)
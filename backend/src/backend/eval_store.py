@@ -0,0 +1,158 @@
+import bisect
+import os
+import struct
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import chess
+import chess.engine
+import chess.polyglot
+from backend.mapped import MappedFile
+from backend.timeline import decode_move, encode_move
+
+MAGIC = b"PEVS"
+VERSION = 1
+# magic, version, multipv the store was built with, number of positions
+HEADER = struct.Struct("<4sHHQ")
+# depth, number of lines
+RECORD = struct.Struct("<BB")
+# mate flag, score in centipawns or moves to mate, pv length
+LINE = struct.Struct("<biB")
+
+
+def position_key(board: chess.Board) -> int:
+    """Polyglot Zobrist hash, like the analysis cache it ignores the move counters"""
+    return chess.polyglot.zobrist_hash(board)
+
+
+def encode_record(infos: List[Dict[str, Any]], max_pv: int = 255) -> bytes:
+    """Packs engine infos, scores are kept from the side to move, moves as 16 bit codes"""
+    lines = [info for info in infos if info.get("score") is not None]
+    parts = [RECORD.pack(min(min((info.get("depth", 0) for info in lines), default=0), 255), len(lines))]
+    for info in lines:
+        score = info["score"].relative
+        pv = info.get("pv", [])[:max_pv]
+        mate = score.is_mate()
+        parts.append(LINE.pack(mate, score.mate() if mate else score.score(), len(pv)))
+        parts.append(array("H", (encode_move(move) for move in pv)).tobytes())
+    return b"".join(parts)
+
+
+def decode_record(record: bytes, turn: chess.Color) -> List[Dict[str, Any]]:
+    """Unpacks a record into engine-like info dicts for a position with turn to move"""
+    depth, count = RECORD.unpack_from(record)
+    offset = RECORD.size
+    infos = []
+    for multipv in range(1, count + 1):
+        mate, value, length = LINE.unpack_from(record, offset)
+        offset += LINE.size
+        moves = array("H")
+        moves.frombytes(record[offset:offset + 2 * length])
+        offset += 2 * length
+        score = chess.engine.Mate(value) if mate else chess.engine.Cp(value)
+        infos.append({
+            "score": chess.engine.PovScore(score, turn),
+            "pv": [decode_move(code) for code in moves],
+            "depth": depth,
+            "multipv": multipv,
+            "precomputed": True,
+        })
+    return infos
+
+
+def write_store(path: str, records: Iterable[Tuple[int, bytes]], multipv: int) -> int:
+    """
+    Writes a store file, replacing any existing file at path only once it is complete
+
+    Parameters:
+    - path (str): file to write
+    - records (Iterable): (position key, encoded record), keys must be unique
+    - multipv (int): number of lines the records were searched with
+
+    Returns:
+    - int: number of positions written
+    """
+    records = sorted(records)
+    keys = array("Q", (key for key, _ in records))
+    offsets = array("Q", [0])
+    for _, record in records:
+        offsets.append(offsets[-1] + len(record))
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as handle:
+        handle.write(HEADER.pack(MAGIC, VERSION, multipv, len(records)))
+        handle.write(keys.tobytes())
+        handle.write(offsets.tobytes())
+        for _, record in records:
+            handle.write(record)
+    os.replace(temp, path)
+    return len(records)
+
+
+class EvaluationStore(MappedFile):
+    """
+    Read-only store of deep engine analysis for every puzzle position, built offline by
+    backend-precompute-evaluations.
+
+    The file holds a sorted array of position hashes, an array of record offsets and the
+    packed records, all in native byte order. It is memory mapped, so a lookup is a binary
+    search over the mapped hashes and decoding one record, and the pages are shared between
+    worker processes.
+
+    Parameters:
+    - path (str): store file
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        magic, version, self.multipv, count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} evaluation store")
+        start = HEADER.size
+        self._keys = self._section(start, 8 * count, "Q")
+        start += 8 * count
+        self._offsets = self._section(start, 8 * (count + 1), "Q")
+        self._records = self._section(start + 8 * (count + 1))
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _find(self, key: int) -> int:
+        index = bisect.bisect_left(self._keys, key)
+        return index if index < len(self._keys) and self._keys[index] == key else -1
+
+    def __contains__(self, board: chess.Board) -> bool:
+        return self._find(position_key(board)) >= 0
+
+    def _record(self, index: int) -> bytes:
+        return self._records[self._offsets[index]:self._offsets[index + 1]].tobytes()
+
+    def get(self, board: chess.Board, multipv: int = 1) -> Optional[List[Dict[str, Any]]]:
+        """Returns the stored lines of a position, or None if it is missing or has fewer than multipv lines"""
+        index = self._find(position_key(board))
+        if index < 0:
+            self.misses += 1
+            return None
+        infos = decode_record(self._record(index), board.turn)
+        if len(infos) < multipv:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return infos[:multipv]
+
+    def records(self) -> Iterator[Tuple[int, bytes]]:
+        """Yields every (position key, encoded record), used to extend an existing store"""
+        for index in range(len(self._keys)):
+            yield self._keys[index], self._record(index)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "positions": len(self),
+            "multipv": self.multipv,
+            "bytes": len(self._map),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
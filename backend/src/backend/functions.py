@@ -1,41 +1,116 @@
 import pyrebase
 from pyrebase.pyrebase import Database, Auth
+import json
+import logging
 import random
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Callable, Iterable, Iterator, Tuple, List
 import time
 import re
 import chess
 import chess.engine
-from datetime import datetime, time, timedelta
+from datetime import date, datetime, time, timedelta
 from flask import jsonify
-
-def fetch_puzzle(db: Database, puzzle_id: str) -> Dict[str, Any]:
-    """Fetches puzzle id from Firebase Database with specified puzzle_id"""
-    return db.child("puzzles").child(puzzle_id).get().val()
-
-def fetch_random_puzzle(db: Database) -> Dict[str, Any]:
-    """Fetches a random puzzle from Firebase Database"""
-    puzzle_ids = fetch_puzzle_ids(db)
-    random_puzzle_id = random.choice(puzzle_ids)
+from backend.engine_pool import EnginePool
+from backend.analysis_cache import AnalysisCache
+from backend.tablebase import EndgameTablebase
+from backend.eval_store import EvaluationStore
+from backend.metrics import timed
+from backend.admission import Overloaded
+from backend.puzzle_index import PuzzleIdIndex
+from backend.timeline import PuzzleTimeline
+from backend.cache import LRUCache
+from backend.leaderboard import RatingIndex
+from backend.profiles import ProfileLoader
+from backend.provisioning import ProfileVerifier
+from backend.puzzle import Puzzle, PuzzlePack
+from backend.puzzle_store import PuzzleStore
+from backend.puzzle_buckets import RatingBucketIndex
+from backend.write_behind import WriteBehindQueue, STAT_FIELDS
+from backend.mirror import MirrorRef
+
+logger = logging.getLogger(__name__)
+
+# Rating assumed for puzzles imported without one
+DEFAULT_PUZZLE_RATING = 1500
+# Local puzzle sources that answer fetch_puzzle, ids, random_id and ratings themselves
+LOCAL_PUZZLES = (PuzzleStore, PuzzlePack)
+
+def fetch_puzzle(db: Database, puzzle_id: str) -> Puzzle:
+    """Fetches puzzle id from Firebase Database, or from a local PuzzleStore or PuzzlePack, with specified puzzle_id"""
+    if isinstance(db, LOCAL_PUZZLES):
+        return db.fetch_puzzle(puzzle_id)
+    puzzle = db.child("puzzles").child(puzzle_id).get().val()
+    return Puzzle.from_dict(puzzle, puzzle_id) if puzzle else None
+
+def fetch_random_puzzle(db: Database, index: PuzzleIdIndex = None) -> Puzzle:
+    """Fetches a random puzzle from Firebase Database, picking the id from the index if one is given"""
+    if index is not None:
+        random_puzzle_id = index.random_id()
+    elif isinstance(db, LOCAL_PUZZLES):
+        random_puzzle_id = db.random_id()
+    else:
+        random_puzzle_id = random.choice(fetch_puzzle_ids(db))
 
     result = fetch_puzzle(db, random_puzzle_id)
-    result['ID'] = random_puzzle_id
+    if result is None:
+        # The index is stale, the puzzle was removed since the last refresh
+        if index is not None:
+            index.notify_changed()
+        return None
+    return result
+
+def fetch_rated_puzzle(db: Database, buckets: RatingBucketIndex, rating: int, spread: int, theme: str = None,
+                       exclude=()) -> Puzzle:
+    """Fetches a random puzzle rated within rating ± spread that is not in exclude, or None if there is none"""
+    puzzle_id = buckets.pick(rating, spread, theme, exclude)
+    if puzzle_id is None:
+        return None
+
+    result = fetch_puzzle(db, puzzle_id)
+    if result is None:
+        buckets.notify_changed()
+        return None
     return result
 
+def fetch_timeline(db: Database, puzzle_id: str, cache: LRUCache = None) -> PuzzleTimeline:
+    """Returns the position timeline of a puzzle, expanding the puzzle only once if a cache is given"""
+    timeline = cache.get(puzzle_id) if cache is not None else None
+    if timeline is None:
+        puzzle = fetch_puzzle(db, puzzle_id)
+        if puzzle is None:
+            return None
+        timeline = PuzzleTimeline.from_puzzle(puzzle.fen, puzzle.uci_moves, puzzle.rating)
+        if cache is not None:
+            cache.put(puzzle_id, timeline)
+    return timeline
+
 def fetch_puzzle_ids(db: Database) -> List[str]:
     """fetches a list of puzzle ids"""
+    if isinstance(db, LOCAL_PUZZLES):
+        return db.ids()
     return list(db.child("puzzles").shallow().get().val())
 
-def validate_puzzle_id(db: Database, puzzle_id: str) -> Tuple[bool, str]:
+def fetch_puzzle_ratings(db: Database) -> Iterable[Tuple[str, int, str]]:
+    """Returns (puzzle_id, rating, themes) for every puzzle, Firebase has to send the whole puzzles node"""
+    if isinstance(db, LOCAL_PUZZLES):
+        return db.ratings()
+    puzzles = db.child("puzzles").get().val() or {}
+    return [
+        (puzzle_id, int(puzzle["Rating"]), puzzle.get("Themes", ""))
+        for puzzle_id, puzzle in puzzles.items()
+        if isinstance(puzzle, dict) and puzzle.get("Rating") not in (None, "")
+    ]
+
+def validate_puzzle_id(db: Database, puzzle_id: str, index: PuzzleIdIndex = None) -> Tuple[bool, str]:
     """Validates if the input arguments from the frontend are valid parameters for a puzzle in the database"""
-    assert type(db) == Database
+    assert isinstance(db, (Database, MirrorRef) + LOCAL_PUZZLES)
 
     if type(puzzle_id) != str:
         return False, "Puzzle ID must be of type string"
     if len(puzzle_id) != 5:
         return False, "Malformed Puzzle ID input"
 
-    puzzle_ids = fetch_puzzle_ids(db)
+    puzzle_ids = index if index is not None else fetch_puzzle_ids(db)
     if puzzle_id not in puzzle_ids:
         return False, "Puzzle ID does not exist in the Database"
 
@@ -51,7 +126,7 @@ def validate_puzzle_move(moves: List[str], move_number: int) -> Tuple[bool, str]
         return False, "Invalid Move Number, must be less than length of puzzle"
     return True, ""
 
-def validate_puzzle(puzzle: Dict[str, Any]) -> bool:
+def validate_puzzle(puzzle: Puzzle) -> bool:
     """Validates if a puzzle is a valid puzzle"""
     if puzzle is None:
         return False
@@ -95,7 +170,7 @@ def sign_up(auth: Auth, email: str, password: str) -> Tuple[Dict[str, Any], str]
         message = f"Error: {e}"
         return None, message
     
-def sign_up_page(db, userid: str, name: str, username: str, country: str) -> Tuple[Dict[str, Any], int]:
+def sign_up_page(db, userid: str, name: str, username: str, country: str, verifier: ProfileVerifier = None) -> Tuple[Dict[str, Any], int]:
     try:
         user_data = {
             "name": name,
@@ -110,10 +185,10 @@ def sign_up_page(db, userid: str, name: str, username: str, country: str) -> Tup
             "last_solved_date": None
         }
 
-        db.child("users").child(userid).set(user_data)
-
-        time.sleep(5)  # Ensure Firebase has time to update
-        user_record = db.child("users").child(userid).get().val()
+        # Firebase answers a set() with the data it stored, so no read back is needed
+        user_record = db.child("users").child(userid).set(user_data)
+        if verifier is not None:
+            verifier.submit(userid)
         if user_record:
             message = f"User created successfully: {user_record['username']}"
             return jsonify({"message": message, "user": user_record}), 201
@@ -178,11 +253,10 @@ def get_fen(fen: str, moves: list, move: int) -> str:
    Returns:
        str: the fen after the moves have been applied
    """
-   temp_fen = fen
+   board = chess.Board(fen)
    for i in range(0, move):
-       current_move = moves[i]
-       temp_fen = update_fen(temp_fen, current_move)
-   return temp_fen
+       board.push(chess.Move.from_uci(moves[i]))
+   return board.fen()
 
 
 def update_fen(fen: str, move: str) -> str:
@@ -209,6 +283,108 @@ def update_fen(fen: str, move: str) -> str:
    board.push(uci_move)
    return board.fen()
 
+def hint_request(fen: str, player: str, move: str, modelversion: str = "gpt-4-turbo") -> Dict[str, Any]:
+    """Builds the OpenAI responses.create arguments for a hint"""
+    return dict(
+        model=modelversion,
+        temperature=0.7,
+        max_output_tokens=300,
+        instructions="You are a chess tutor, and you know how to play chess. You are tutoring a student, and you don't want to provide the best move explicitly, but guide the student towards their own discovery of the move. Please be as brief within two lines.",
+        input=f"In the position: {fen} ; the move is for {player}, and the best move is: {move}. Please provide a hint to the student that is not obvious and is not too informative or easy, but reasonable enough."
+    )
+
+def generate_hint(client, fen: str, player: str, move: str, modelversion: str = "gpt-4-turbo") -> str:
+    """
+    Asks OpenAI for a hint that guides the player towards the best move without giving it away
+
+    Parameters:
+    - client (OpenAI): OpenAI client
+    - fen (str): the position the hint is for
+    - player (str): the side to move
+    - move (str): the best move in UCI format
+    - modelversion (str): the OpenAI model to use
+
+    Returns:
+    - str: the hint, or None if OpenAI returned nothing
+    """
+    with timed("openai", "responses.create"):
+        response = client.responses.create(**hint_request(fen, player, move, modelversion))
+    return response.output_text if response else None
+
+def themed_hint_request(hint: str, theme: str, modelversion: str = "gpt-4-turbo") -> Dict[str, Any]:
+    """Builds the OpenAI responses.create arguments for rewriting a hint in a theme"""
+    return dict(
+        model=modelversion,
+        temperature=0.7,
+        max_output_tokens=300,
+        instructions=f"You are a creative writer who can rewrite chess hints in different thematic styles while preserving the essential chess guidance.",
+        input=f"Please rewrite this chess hint in a {theme} theme while preserving the chess advice: '{hint}'. Keep it concise, within two lines."
+    )
+
+def generate_themed_hint(client, hint: str, theme: str, modelversion: str = "gpt-4-turbo") -> str:
+    """Asks OpenAI to rewrite a hint in a theme, returns None if OpenAI returned nothing"""
+    with timed("openai", "responses.create"):
+        response = client.responses.create(**themed_hint_request(hint, theme, modelversion))
+    return response.output_text if response else None
+
+def stream_text(client, arguments: Dict[str, Any]) -> Iterator[str]:
+    """
+    Streams an OpenAI response, yielding its text as the model produces it
+
+    Parameters:
+    - client (OpenAI): OpenAI client
+    - arguments (dict): responses.create arguments, from hint_request or themed_hint_request
+
+    Returns:
+    - Iterator: text deltas, closing the iterator closes the upstream stream so no more tokens are generated
+    """
+    with timed("openai", "responses.stream"):
+        stream = client.responses.create(stream=True, **arguments)
+        try:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+        finally:
+            stream.close()
+
+def server_sent_event(event: str, payload: Dict[str, Any]) -> str:
+    """Formats one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def text_events(chunks: Iterable[str], key: str, fallback: str, on_complete: Callable[[str], None] = None) -> Iterator[str]:
+    """
+    Turns streamed text into server-sent events: a "delta" event per chunk, then a "done" event
+    with the whole text under key, the same body the JSON route returns. A failure once the
+    stream has started can't change the status code, so it is sent as an "error" event.
+
+    Parameters:
+    - chunks (Iterable): the text, e.g. from stream_text
+    - key (str): field of the "done" payload, "hint" or "themed_hint"
+    - fallback (str): text sent when the stream produced nothing
+    - on_complete (Callable): called with the whole text once the stream finished, to store it
+    """
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield server_sent_event("delta", {"text": chunk})
+        text = "".join(parts)
+        if text:
+            if on_complete is not None:
+                on_complete(text)
+        else:
+            text = fallback
+            yield server_sent_event("delta", {"text": text})
+        yield server_sent_event("done", {key: text})
+    except Exception:
+        logger.exception("Streaming %s failed", key)
+        yield server_sent_event("error", {"error": f"Error streaming {key}."})
+    finally:
+        # Runs when the client disconnects too, closing the upstream stream right away
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
 def get_current_player(fen: str) -> str:
     """ 
     Gets the current player of a game defined by an input fen string
@@ -223,88 +399,141 @@ def get_current_player(fen: str) -> str:
 
     return "white" if board.turn else "black"
 
-def get_principal_variation(fen: str, engine_path: str) -> list:
+# Search the analysis routes run when no tablebase, stored evaluation or cached result answers them
+ANALYSIS_LIMIT = chess.engine.Limit(time=0.1)
+
+def _analyse(board: chess.Board, pool: EnginePool, cache: AnalysisCache = None,
+             tablebase: EndgameTablebase = None, evaluations: EvaluationStore = None) -> dict:
+    """runs the standard search for a board, answering from the tablebase, stored evaluations or cache when possible"""
+    if tablebase is not None:
+        info = tablebase.probe(board)
+        if info is not None:
+            return info
+    if evaluations is not None:
+        infos = evaluations.get(board)
+        if infos is not None:
+            return infos[0]
+    if cache is None:
+        return pool.analyse(board, ANALYSIS_LIMIT)
+    return cache.analyse(pool, board, ANALYSIS_LIMIT)
+
+def get_principal_variation(fen: str, pool: EnginePool, cache: AnalysisCache = None,
+                            tablebase: EndgameTablebase = None, evaluations: EvaluationStore = None) -> list:
     """returns a list of best moves"""
     board = chess.Board(fen)
     try:
-        with chess.engine.SimpleEngine.popen_uci(engine_path) as engine:
-            info = engine.analyse(board, chess.engine.Limit(time=0.1))
-            return info.get("pv", [])
+        info = _analyse(board, pool, cache, tablebase, evaluations)
+        return info.get("pv", [])
+    except Overloaded:
+        # Shed by admission control, the route answers 429 or 503
+        raise
     except Exception as e:
         return [f"Engine error: {e}"]
     
     
-def get_score(fen: str, engine_path: str) -> str:
+def get_score(fen: str, pool: EnginePool, cache: AnalysisCache = None,
+              tablebase: EndgameTablebase = None, evaluations: EvaluationStore = None) -> str:
     """returns a score object"""
     board = chess.Board(fen)
     try:
-        with chess.engine.SimpleEngine.popen_uci(engine_path) as engine:
-            info = engine.analyse(board, chess.engine.Limit(time=0.1))
-            return info["score"]
+        info = _analyse(board, pool, cache, tablebase, evaluations)
+        return info["score"]
+    except Overloaded:
+        raise
     except Exception as e:
         return f"Engine error: {e}"
 
-def get_info(fen: str, engine_path: str) -> dict:
+def get_info(fen: str, pool: EnginePool, cache: AnalysisCache = None,
+             tablebase: EndgameTablebase = None, evaluations: EvaluationStore = None) -> dict:
     """gets all the board info"""
     board = chess.Board(fen)
     try:
-        with chess.engine.SimpleEngine.popen_uci(engine_path) as engine:
-            return engine.analyse(board, chess.engine.Limit(time=0.1))
+        return _analyse(board, pool, cache, tablebase, evaluations)
+    except Overloaded:
+        raise
     except Exception as e:
         return {"error": f"Engine error: {e}"}
 
-def update_streaks(db: Database, userid: str, puzzleid: str, correct: bool) -> None:
-    """Updates the streaks of a user"""
-    user_ref = db.child("users").child(userid)
-    user_data = user_ref.get().val()   
-    
+def _parse_date(value: Any) -> date:
+    """Reads a date stored as an ISO string, returns None for anything else"""
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def apply_streak(stats: Dict[str, Any], correct: bool, today: date = None) -> int:
+    """Applies one attempt to a user's streak in place and returns the streak"""
+    streaks = stats.get("streaks") or 0
     if not correct:
-        return   
-    
-    current_date = datetime.now().date()
-    streaks = user_data.get("streaks")
-    last_solved_date = user_data.get("last_solved_date")   
-    
+        return streaks
+
+    current_date = today or datetime.now().date()
+    last_solved_date = _parse_date(stats.get("last_solved_date"))
+
     if last_solved_date == current_date:
-        return
+        return streaks
     if last_solved_date and last_solved_date + timedelta(days=1) == current_date:
         streaks += 1
     else:
-        streaks = 1   
-
-    user_ref.update({
-        "streaks": streaks,
-        "last_solved_date": current_date
-    })
+        streaks = 1
+
+    # Stored as an ISO string, date objects are not JSON serializable
+    stats["streaks"] = streaks
+    stats["last_solved_date"] = current_date.isoformat()
+    return streaks
+
+def update_streaks(db: Database, userid: str, puzzleid: str, correct: bool, index: RatingIndex = None,
+                   writes: WriteBehindQueue = None) -> None:
+    """Updates the streaks of a user, through the write-behind queue if one is given"""
+    if writes is not None:
+        streaks = writes.update(userid, lambda stats: apply_streak(stats, correct))
+    else:
+        user_ref = db.child("users").child(userid)
+        user_data = user_ref.get().val()
+        last_solved_date = user_data.get("last_solved_date")
+        streaks = apply_streak(user_data, correct)
+        if user_data.get("last_solved_date") == last_solved_date:
+            return
+        user_ref.update({
+            "streaks": streaks,
+            "last_solved_date": user_data["last_solved_date"]
+        })
+    if index is not None:
+        index.update_profile(userid, streaks=streaks)
 
-def update_rating(db, user_id: str, puzzle_rating: int, correct: bool) -> dict:
-    '''Updates the rating of a user'''
-    user_ref = db.child("users").child(user_id)
-    user_data = user_ref.get().val()
-
-    # Defaults
-    current_rating = user_data.get("rating", 1200)
-    attempted = user_data.get("attempted", 0)
-    solved = user_data.get("solved", 0)
+def k_factor(attempted: int) -> int:
+    '''Dynamic K-factor, decreases as experience grows'''
+    return 32 if attempted < 30 else 16
 
+def rating_change(current_rating: int, puzzle_rating: int, attempted: int, correct: bool) -> Tuple[int, float]:
+    '''Returns the new rating of a user and the change after one attempt'''
     # Compute expected score using Elo formula
     expected_score = 1 / (1 + 10 ** ((puzzle_rating - current_rating) / 400))
     actual_score = 1.0 if correct else 0.0
 
-    # Dynamic K-factor (optional: decrease as experience grows)
-    k = 32 if attempted < 30 else 16
+    k = k_factor(attempted)
 
     # New rating
     new_rating = current_rating + k * (actual_score - expected_score)
-    new_rating = round(new_rating)
+    return round(new_rating), round(k * (actual_score - expected_score), 2)
+
+def apply_rating(stats: Dict[str, Any], puzzle_rating: int, correct: bool) -> dict:
+    '''Applies one attempt to a user's rating, attempted and solved counts in place'''
+    # Defaults
+    current_rating = stats.get("rating", 1200)
+    attempted = stats.get("attempted", 0)
+    solved = stats.get("solved", 0)
+
+    new_rating, delta = rating_change(current_rating, puzzle_rating, attempted, correct)
 
     # Update stats
     attempted += 1
     if correct:
         solved += 1
 
-    # Write back to Firebase
-    user_ref.update({
+    stats.update({
         "rating": new_rating,
         "attempted": attempted,
         "solved": solved
@@ -314,11 +543,59 @@ def update_rating(db, user_id: str, puzzle_rating: int, correct: bool) -> dict:
         "new_rating": new_rating,
         "attempted": attempted,
         "solved": solved,
-        "delta": round(k * (actual_score - expected_score), 2)
+        "delta": delta
     }
 
-def global_leaderboard(db, limit=25):
+def update_rating(db, user_id: str, puzzle_rating: int, correct: bool, index: RatingIndex = None,
+                  writes: WriteBehindQueue = None) -> dict:
+    '''Updates the rating of a user, through the write-behind queue if one is given'''
+    if writes is not None:
+        result = writes.update(user_id, lambda stats: apply_rating(stats, puzzle_rating, correct))
+        if index is not None:
+            index.update(user_id, result["new_rating"])
+        return result
+
+    user_ref = db.child("users").child(user_id)
+    user_data = user_ref.get().val()
+    result = apply_rating(user_data, puzzle_rating, correct)
+
+    # Write back to Firebase
+    user_ref.update({
+        "rating": result["new_rating"],
+        "attempted": result["attempted"],
+        "solved": result["solved"]
+    })
+    if index is not None:
+        index.update(user_id, result["new_rating"], user_data)
+
+    return result
+
+def record_attempt(db, userid: str, puzzle_rating: int, correct: bool, index: RatingIndex = None,
+                   writes: WriteBehindQueue = None) -> dict:
+    '''Applies the rating, stat and streak changes of one puzzle attempt in a single write'''
+    def apply(stats: Dict[str, Any]) -> dict:
+        result = apply_rating(stats, puzzle_rating, correct)
+        result["streaks"] = apply_streak(stats, correct)
+        return result
+
+    if writes is not None:
+        result = writes.update(userid, apply)
+    else:
+        user_ref = db.child("users").child(userid)
+        user_data = user_ref.get().val()
+        result = apply(user_data)
+        user_ref.update({field: user_data[field] for field in STAT_FIELDS if field in user_data})
+
+    if index is not None:
+        index.update(userid, result["new_rating"])
+        index.update_profile(userid, streaks=result["streaks"])
+    return result
+
+def global_leaderboard(db, limit=25, index: RatingIndex = None):
     '''Returns a global leaderboard of players'''
+    if index is not None:
+        return index.top(limit)
+
     # Get all users from Firebase
     users_data = db.child("users").get().val()
     
@@ -346,31 +623,45 @@ def global_leaderboard(db, limit=25):
 
     return leaderboard
 
-def community_leaderboard(db: Database, community_name: str, limit: int = 25) -> List[Dict[str, Any]]:
+def _leaderboard_from_profiles(profiles: Dict[str, Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    '''Builds a sorted leaderboard from {userid: profile}'''
+    leaderboard = []
+    for uid, user_data in profiles.items():
+        leaderboard.append({
+            "userid": uid,
+            "username": user_data.get("username", "Unknown"),
+            "rating": user_data.get("rating", 0),
+            "country": user_data.get("country", "N/A"),
+            "streaks": user_data.get("streaks", 0)
+        })
+
+    sorted_leaderboard = sorted(leaderboard, key=lambda x: x["rating"], reverse=True)
+    return sorted_leaderboard[:limit]
+
+def _load_profiles(db: Database, userids, loader: ProfileLoader = None) -> Dict[str, Dict[str, Any]]:
+    '''Fetches the profiles of existing users, in bulk if a loader is given'''
+    if loader is not None:
+        return loader.load(userids)
+
+    profiles = {}
+    for uid in userids:
+        user_data = db.child("users").child(uid).get().val()
+        if user_data:
+            profiles[uid] = user_data
+    return profiles
+
+def community_leaderboard(db: Database, community_name: str, limit: int = 25, loader: ProfileLoader = None) -> List[Dict[str, Any]]:
     '''Returns a community leaderboard'''
     try:
         members = db.child("communities").child(community_name).child("members").get().val()
         if not members:
             return []
 
-        leaderboard = []
-        for uid in members:
-            user_data = db.child("users").child(uid).get().val()
-            if user_data:
-                leaderboard.append({
-                    "userid": uid,
-                    "username": user_data.get("username", "Unknown"),
-                    "rating": user_data.get("rating", 0),
-                    "country": user_data.get("country", "N/A"),
-                    "streaks": user_data.get("streaks", 0)
-                })
-
-        sorted_leaderboard = sorted(leaderboard, key=lambda x: x["rating"], reverse=True)
-        return sorted_leaderboard[:limit]
+        return _leaderboard_from_profiles(_load_profiles(db, members, loader), limit)
     except Exception as e:
         return [{"error": f"Failed to get community leaderboard: {e}"}]
 
-def friends_leaderboard(db: Database, userid: str, limit: int = 25) -> List[Dict[str, Any]]:
+def friends_leaderboard(db: Database, userid: str, limit: int = 25, loader: ProfileLoader = None) -> List[Dict[str, Any]]:
     '''Returns a friends leaderboard'''
     try:
         user = db.child("users").child(userid).get().val()
@@ -378,20 +669,6 @@ def friends_leaderboard(db: Database, userid: str, limit: int = 25) -> List[Dict
             return []
 
         friends_dict = user.get("friends", {})
-        leaderboard = []
-
-        for friend_id in friends_dict:
-            friend_data = db.child("users").child(friend_id).get().val()
-            if friend_data:
-                leaderboard.append({
-                    "userid": friend_id,
-                    "username": friend_data.get("username", "Unknown"),
-                    "rating": friend_data.get("rating", 0),
-                    "country": friend_data.get("country", "N/A"),
-                    "streaks": friend_data.get("streaks", 0)
-                })
-
-        sorted_leaderboard = sorted(leaderboard, key=lambda x: x["rating"], reverse=True)
-        return sorted_leaderboard[:limit]
+        return _leaderboard_from_profiles(_load_profiles(db, friends_dict, loader), limit)
     except Exception as e:
-        return [{"error": f"Failed to get friends leaderboard: {e}"}]
\ No newline at end of file
+        return [{"error": f"Failed to get friends leaderboard: {e}"}]
@@ -0,0 +1,131 @@
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class HintStore:
+    """
+    Persistent store of generated hints keyed by (puzzle_id, move_number, model).
+
+    Several variants are kept per key so users don't all see the same text. When the
+    store grows past max_rows the least recently served hints are evicted. Reads only note
+    when a hint was served, the times are written in one transaction every touch_interval
+    seconds, by the next write or before evicting.
+
+    Parameters:
+    - path (str): SQLite file the hints are stored in
+    - max_variants (int): number of variants kept per key
+    - max_rows (int): total number of hints kept before evicting
+    - touch_interval (float): seconds between writes of the served times
+    """
+
+    def __init__(self, path: str, max_variants: int = 3, max_rows: int = 500000, touch_interval: float = 30.0):
+        self.path = path
+        self.max_variants = max_variants
+        self.max_rows = max_rows
+        self.touch_interval = touch_interval
+        # (puzzle_id, move_number, model, variant) -> last served time, not written yet
+        self._touched: Dict[Tuple[str, int, str, int], float] = {}
+        self._touched_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hints ("
+            "puzzle_id TEXT, move_number INTEGER, model TEXT, variant INTEGER, hint TEXT, "
+            "created_at REAL, last_used REAL, "
+            "PRIMARY KEY (puzzle_id, move_number, model, variant))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS hints_last_used ON hints (last_used)")
+        self._db.commit()
+        self._rows = self._db.execute("SELECT COUNT(*) FROM hints").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, puzzle_id: str, move_number: int, model: str) -> Optional[str]:
+        """Returns one stored variant at random, or None if nothing is stored for the key"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT variant, hint FROM hints WHERE puzzle_id = ? AND move_number = ? AND model = ?",
+                (puzzle_id, move_number, model),
+            ).fetchall()
+            if not rows:
+                self.misses += 1
+                return None
+            variant, hint = random.choice(rows)
+            self._touched[(puzzle_id, move_number, model, variant)] = time.time()
+            if time.monotonic() - self._touched_at >= self.touch_interval:
+                self._write_touched()
+                self._db.commit()
+            self.hits += 1
+            return hint
+
+    def _write_touched(self) -> None:
+        """Writes the pending served times, caller holds the lock and commits"""
+        if self._touched:
+            self._db.executemany(
+                "UPDATE hints SET last_used = ? WHERE puzzle_id = ? AND move_number = ? AND model = ? AND variant = ?",
+                ((used, *key) for key, used in self._touched.items()),
+            )
+            self._touched.clear()
+        self._touched_at = time.monotonic()
+
+    def variants(self, puzzle_id: str, move_number: int, model: str) -> int:
+        """Returns how many variants are stored for the key"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM hints WHERE puzzle_id = ? AND move_number = ? AND model = ?",
+                (puzzle_id, move_number, model),
+            ).fetchone()[0]
+
+    def put(self, puzzle_id: str, move_number: int, model: str, hint: str) -> None:
+        """Adds a variant for the key, replacing the oldest one once max_variants are stored"""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT variant, created_at FROM hints WHERE puzzle_id = ? AND move_number = ? AND model = ?",
+                (puzzle_id, move_number, model),
+            ).fetchall()
+            if len(rows) < self.max_variants:
+                used = {variant for variant, _ in rows}
+                variant = next(i for i in range(self.max_variants) if i not in used)
+                self._rows += 1
+            else:
+                variant = min(rows, key=lambda row: row[1])[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO hints (puzzle_id, move_number, model, variant, hint, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (puzzle_id, move_number, model, variant, hint, now, now),
+            )
+            self._touched.pop((puzzle_id, move_number, model, variant), None)
+            self._write_touched()
+            if self._rows > self.max_rows:
+                self._evict(self._rows - self.max_rows)
+            self._db.commit()
+
+    def _evict(self, count: int) -> None:
+        """Deletes the count least recently served hints, caller holds the lock"""
+        deleted = self._db.execute(
+            "DELETE FROM hints WHERE rowid IN (SELECT rowid FROM hints ORDER BY last_used LIMIT ?)", (count,)
+        ).rowcount
+        self._rows -= deleted
+        self.evictions += deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows": self._rows,
+            "max_rows": self.max_rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
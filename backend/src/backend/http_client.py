@@ -0,0 +1,194 @@
+import threading
+import time
+from typing import Any, Dict, Tuple
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from backend.metrics import timed
+
+# Methods that are safe to send again, Firebase set and update are idempotent but push is not
+RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"})
+# The pyrebase call behind each REST method, used as the operation label of Firebase calls
+FIREBASE_OPERATIONS = {"GET": "get", "PUT": "set", "PATCH": "update", "POST": "push", "DELETE": "remove"}
+
+
+def upstream_name(host: str) -> str:
+    """Metric label for a host, Firebase hosts are grouped so the label stays the same across projects"""
+    hostname = host.split(":")[0]
+    if hostname.endswith((".firebaseio.com", ".firebasedatabase.app")):
+        return "firebase"
+    if hostname.endswith(".googleapis.com"):
+        return "firebase_auth"
+    return hostname
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a host that kept failing, until its reset timeout has passed"""
+
+
+class HostBusyError(requests.exceptions.ConnectionError):
+    """Raised when every connection slot for a host stayed taken for the whole connect timeout"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after failure_threshold consecutive failures.
+
+    Once open, calls fail immediately for reset_timeout seconds, then one trial call is let
+    through: success closes the circuit again, failure reopens it for another reset_timeout.
+
+    Parameters:
+    - failure_threshold (int): consecutive failures that open the circuit
+    - reset_timeout (float): seconds the circuit stays open before a trial call
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Returns whether a call may go ahead, a half-open circuit admits a single trial call"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial = False
+
+    def cancel(self) -> None:
+        """Gives back a trial call that was allowed but never made"""
+        with self._lock:
+            if self.state == "half_open":
+                self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class _Host:
+    __slots__ = ("slots", "breaker", "requests", "errors")
+
+    def __init__(self, max_per_host: int, failure_threshold: int, reset_timeout: float):
+        self.slots = threading.BoundedSemaphore(max_per_host)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.requests = 0
+        self.errors = 0
+
+
+class HttpClient(requests.Session):
+    """
+    Shared session for outbound HTTP calls, a drop-in requests.Session.
+
+    Connections are pooled and kept alive per host, and every request gets a connect and
+    read timeout unless it passes its own. Idempotent requests are retried with exponential
+    backoff on connection errors and 5xx answers. At most max_per_host requests run against
+    one host at a time, and a circuit breaker per host fails fast while the host is down, so
+    a slow upstream can't tie up every worker thread.
+
+    Parameters:
+    - max_per_host (int): concurrent requests and pooled connections per host
+    - connect_timeout (float): seconds to establish a connection, also the longest wait for a free slot
+    - read_timeout (float): seconds to wait for each chunk of the response
+    - retries (int): retries per idempotent request
+    - backoff (float): backoff factor between retries, in seconds
+    - failure_threshold (int): consecutive failures that open a host's circuit
+    - reset_timeout (float): seconds a host's circuit stays open
+    """
+
+    def __init__(self, max_per_host: int = 32, connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 retries: int = 2, backoff: float = 0.2, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        super().__init__()
+        self.max_per_host = max_per_host
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_per_host, max_retries=retry)
+        for scheme in ("http://", "https://"):
+            self.mount(scheme, adapter)
+        self._hosts: Dict[str, _Host] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url: str) -> Tuple[str, _Host]:
+        name = urlsplit(url).netloc
+        host = self._hosts.get(name)
+        if host is None:
+            with self._lock:
+                host = self._hosts.setdefault(
+                    name, _Host(self.max_per_host, self.failure_threshold, self.reset_timeout)
+                )
+        return name, host
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        name, host = self._host(url)
+        if not host.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {name} after repeated failures")
+        if not host.slots.acquire(timeout=self.timeout[0]):
+            # Our own callers saturated the slots, that says nothing about the host's health
+            host.breaker.cancel()
+            raise HostBusyError(f"All {self.max_per_host} connections to {name} are busy")
+        upstream = upstream_name(name)
+        method = method.upper()
+        operation = FIREBASE_OPERATIONS.get(method, method.lower()) if upstream == "firebase" else method.lower()
+        try:
+            host.requests += 1
+            with timed(upstream, operation) as call:
+                try:
+                    response = super().request(method, url, *args, **kwargs)
+                except Exception:
+                    host.errors += 1
+                    host.breaker.record_failure()
+                    raise
+                if response.status_code >= 500:
+                    call.outcome = "error"
+                    host.errors += 1
+                    host.breaker.record_failure()
+                else:
+                    host.breaker.record_success()
+            return response
+        finally:
+            host.slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: dict(host.breaker.stats(), requests=host.requests, errors=host.errors)
+            for name, host in list(self._hosts.items())
+        }
@@ -0,0 +1,65 @@
+"""
+Streams the Lichess puzzle dump into the local puzzle store.
+
+Usage:
+    uv run backend-import-puzzles lichess_db_puzzle.csv.zst --store puzzles.sqlite3
+
+The dump is read in chunks and validated on a pool of worker processes, with a bounded
+number of chunks in flight, so memory stays constant whatever the size of the dump.
+"""
+import argparse
+import os
+import resource
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from backend.puzzle_store import PuzzleStore, parse_rows, read_chunks
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Import the Lichess puzzle dump into a local puzzle store")
+    parser.add_argument("csv", help="path to lichess_db_puzzle.csv or lichess_db_puzzle.csv.zst")
+    parser.add_argument("--store", default=os.getenv("PUZZLE_STORE_PATH", "puzzles.sqlite3"), help="SQLite file to write")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows parsed and written per chunk")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes validating solutions")
+    parser.add_argument("--no-validate", action="store_true", help="skip replaying the solutions with python-chess")
+    parser.add_argument("--benchmark", action="store_true", help="report throughput and memory after every chunk")
+    args = parser.parse_args(argv)
+
+    store = PuzzleStore(args.store, bulk_load=True)
+
+    started = time.perf_counter()
+    imported, rejected, chunks = 0, 0, 0
+
+    def write(result) -> None:
+        nonlocal imported, rejected, chunks
+        rows, chunk_rejected = result
+        store.write_rows(rows)
+        imported += len(rows)
+        rejected += chunk_rejected
+        chunks += 1
+        if args.benchmark or chunks % 100 == 0:
+            elapsed = time.perf_counter() - started
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{imported} imported, {rejected} rejected, {imported / elapsed:.0f} rows/s, peak RSS {peak_mb:.0f} MB")
+
+    validate = not args.no_validate
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # At most two chunks per worker are parsed or waiting to be written at any time
+        pending = deque()
+        for chunk in read_chunks(args.csv, args.chunk_size):
+            pending.append(executor.submit(parse_rows, chunk, validate))
+            if len(pending) >= args.workers * 2:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Done: {imported} puzzles imported, {rejected} rejected in {elapsed:.1f}s "
+          f"({imported / max(elapsed, 1e-9):.0f} rows/s, peak RSS {peak_mb:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
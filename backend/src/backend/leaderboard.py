@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sortedcontainers import SortedList
+
+logger = logging.getLogger(__name__)
+
+
+class RatingIndex:
+    """
+    Sorted index of user ratings for the global leaderboard.
+
+    Users are kept in a SortedList of (-rating, userid), so the top K is a slice, and finding
+    the rank of a user or moving them to a new rating takes logarithmic time. Rating writes
+    update the index in place, and the whole index is rebuilt from Firebase every
+    rebuild_interval seconds in the background to repair any drift from writes that bypassed it.
+
+    Parameters:
+    - loader (Callable): returns the users node as {userid: user_info}
+    - rebuild_interval (float): seconds between background rebuilds, None to disable
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, Dict[str, Any]]], rebuild_interval: Optional[float] = 600.0):
+        self.loader = loader
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._keys: SortedList = SortedList()
+        self._ratings: Dict[str, int] = {}
+        # (username, country, streaks) per user, only what the leaderboard returns
+        self._profiles: Dict[str, Tuple[str, str, int]] = {}
+        self._built_at: Optional[float] = None
+        self._pending: Optional[Dict[str, tuple]] = None
+
+        self.rebuilds = 0
+        self.updates = 0
+
+    @staticmethod
+    def _rating(user_info: Dict[str, Any]) -> int:
+        """The user's rating, 0 if it is missing or not a number like a null written by hand"""
+        rating = user_info.get("rating")
+        return rating if isinstance(rating, (int, float)) and not isinstance(rating, bool) else 0
+
+    @staticmethod
+    def _profile(user_info: Dict[str, Any]) -> Tuple[str, str, int]:
+        return (
+            user_info.get("username", "Unknown"),
+            user_info.get("country", "N/A"),
+            user_info.get("streaks", 0),
+        )
+
+    def rebuild(self) -> None:
+        """Reloads every user and replaces the index in one step"""
+        with self._rebuild_lock:
+            with self._lock:
+                # Updates that land while Firebase is being read are replayed on top of the snapshot
+                self._pending = {}
+            try:
+                users = self.loader() or {}
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            ratings = {}
+            profiles = {}
+            for userid, user_info in users.items():
+                if not isinstance(user_info, dict):
+                    continue
+                ratings[userid] = self._rating(user_info)
+                profiles[userid] = self._profile(user_info)
+            keys = SortedList((-rating, userid) for userid, rating in ratings.items())
+            with self._lock:
+                self._keys, self._ratings, self._profiles = keys, ratings, profiles
+                self._built_at = time.monotonic()
+                pending, self._pending = self._pending, None
+                for userid, (rating, user_info) in pending.items():
+                    self._apply(userid, rating, user_info)
+            self.rebuilds += 1
+
+    def _rebuild_in_background(self) -> None:
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild rating index")
+
+    def _ensure_fresh(self) -> None:
+        if self._built_at is None:
+            self.rebuild()
+        elif self.rebuild_interval is not None and time.monotonic() - self._built_at > self.rebuild_interval:
+            if not self._rebuild_lock.locked():
+                # Push the deadline forward so only one request triggers the rebuild
+                self._built_at = time.monotonic()
+                threading.Thread(target=self._rebuild_in_background, name="rating-index", daemon=True).start()
+
+    def _apply(self, userid: str, rating: int, user_info: Optional[Dict[str, Any]]) -> None:
+        """Moves a user to a new rating, caller holds the lock"""
+        old_rating = self._ratings.get(userid)
+        if old_rating is not None:
+            self._keys.discard((-old_rating, userid))
+        self._keys.add((-rating, userid))
+        self._ratings[userid] = rating
+        if user_info is not None:
+            self._profiles[userid] = self._profile(user_info)
+        elif userid not in self._profiles:
+            self._profiles[userid] = self._profile({})
+
+    def update(self, userid: str, rating: int, user_info: Dict[str, Any] = None) -> None:
+        """Moves a user to their new rating, adding them if they are new"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending[userid] = (rating, user_info)
+            if self._built_at is not None:
+                self._apply(userid, rating, user_info)
+            self.updates += 1
+
+    def update_profile(self, userid: str, **fields: Any) -> None:
+        """Updates the username, country or streaks shown for a user"""
+        with self._lock:
+            if userid not in self._profiles:
+                return
+            username, country, streaks = self._profiles[userid]
+            self._profiles[userid] = (
+                fields.get("username", username),
+                fields.get("country", country),
+                fields.get("streaks", streaks),
+            )
+
+    def _entry(self, userid: str) -> Dict[str, Any]:
+        username, country, streaks = self._profiles[userid]
+        return {
+            "userid": userid,
+            "username": username,
+            "rating": self._ratings[userid],
+            "country": country,
+            "streaks": streaks
+        }
+
+    def top(self, limit: int = 25) -> List[Dict[str, Any]]:
+        """Returns the limit highest rated users in leaderboard format"""
+        self._ensure_fresh()
+        with self._lock:
+            return [self._entry(userid) for _, userid in self._keys.islice(0, limit)]
+
+    def rank(self, userid: str) -> Optional[int]:
+        """Returns the 1-based leaderboard position of a user, or None if the user is unknown"""
+        self._ensure_fresh()
+        with self._lock:
+            rating = self._ratings.get(userid)
+            if rating is None:
+                return None
+            return self._keys.bisect_left((-rating, userid)) + 1
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._keys),
+            "built": self._built_at is not None,
+            "rebuilds": self.rebuilds,
+            "updates": self.updates,
+        }
@@ -0,0 +1,36 @@
+import mmap
+from typing import List, Optional
+
+
+class MappedFile:
+    """
+    Base of the read-only files that are memory mapped and read through views cast in place.
+
+    Subclasses cut their columns out of the map with _section. A map can't be closed while a
+    view points into it, so close releases every section first.
+
+    Parameters:
+    - path (str): file to map
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._sections: List[memoryview] = []
+
+    def _section(self, start: int, length: Optional[int] = None, code: str = "B") -> memoryview:
+        """The length bytes from start, or the rest of the file, as an array of the given typecode"""
+        view = memoryview(self._map)
+        end = len(view) if length is None else start + length
+        section = view[start:end].cast(code)
+        view.release()
+        self._sections.append(section)
+        return section
+
+    def close(self) -> None:
+        for section in self._sections:
+            section.release()
+        self._sections.clear()
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,238 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cache hit to a slow OpenAI answer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    Prometheus histogram with a fixed set of labels.
+
+    Parameters:
+    - name (str): metric name
+    - help (str): description shown by Prometheus
+    - labels (Sequence): label names, every observation gives a value for each
+    - buckets (Sequence): upper bounds in seconds, +Inf is added
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [count per bucket (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: Any) -> None:
+        key = tuple(str(label) for label in label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in sorted(self._series.items())]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REQUESTS = Histogram(
+    "backend_request_duration_seconds", "Time spent serving a request", ("route", "method", "status")
+)
+UPSTREAM = Histogram(
+    "backend_upstream_duration_seconds", "Time spent in one call to Firebase, OpenAI, the engine or another upstream",
+    ("upstream", "operation", "outcome")
+)
+
+
+class Trace:
+    """The upstream calls made while serving one request"""
+    __slots__ = ("calls",)
+
+    def __init__(self):
+        self.calls: List[Tuple[str, str, str, float]] = []
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+class Call:
+    """Handed out by timed(), set outcome for failures that don't raise, like a 5xx answer"""
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+
+@contextmanager
+def timed(upstream: str, operation: str) -> Iterator[Call]:
+    """Times the enclosed upstream call, an exception counts as an error outcome and is re-raised"""
+    started = time.perf_counter()
+    call = Call()
+    try:
+        yield call
+    except (GeneratorExit, asyncio.CancelledError):
+        # A stream closed early because its client went away
+        call.outcome = "cancelled"
+        raise
+    except BaseException:
+        call.outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        UPSTREAM.observe(elapsed, upstream, operation, call.outcome)
+        trace = _trace.get()
+        if trace is not None:
+            trace.calls.append((upstream, operation, call.outcome, elapsed))
+
+
+def propagate(function: Callable) -> Callable:
+    """Runs function in a copy of the caller's context, so calls made on worker threads join the request's trace"""
+    context = contextvars.copy_context()
+    def run(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(function, *args, **kwargs)
+    return run
+
+
+class SlowRequestLog:
+    """
+    Keeps a sample of slow requests with the upstream calls they made.
+
+    Parameters:
+    - threshold (float): seconds from which a request counts as slow
+    - sample_rate (float): share of slow requests kept, 0 turns tracing off
+    - size (int): traces kept, oldest are dropped first
+    """
+
+    def __init__(self, threshold: float = 1.0, sample_rate: float = 0.0, size: int = 100):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._traces: deque = deque(maxlen=size)
+        self.slow = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self) -> Optional[contextvars.Token]:
+        """Begins collecting upstream calls for the current request"""
+        return _trace.set(Trace()) if self.enabled else None
+
+    def finish(self, token: Optional[contextvars.Token], route: str, method: str, status: int, elapsed: float) -> None:
+        if token is None:
+            return
+        trace = _trace.get()
+        _trace.reset(token)
+        if trace is None or elapsed < self.threshold:
+            return
+        self.slow += 1
+        if random.random() >= self.sample_rate:
+            return
+        calls = [
+            {"upstream": upstream, "operation": operation, "outcome": outcome, "seconds": round(seconds, 6)}
+            for upstream, operation, outcome, seconds in list(trace.calls)
+        ]
+        upstream_seconds = sum(call["seconds"] for call in calls)
+        entry = {
+            "at": time.time(),
+            "route": route,
+            "method": method,
+            "status": status,
+            "seconds": round(elapsed, 6),
+            "upstream_seconds": round(upstream_seconds, 6),
+            # Calls made in parallel overlap, so this is a lower bound on the time spent in Python
+            "other_seconds": round(max(elapsed - upstream_seconds, 0.0), 6),
+            "calls": calls,
+        }
+        self._traces.append(entry)
+        logger.warning("Slow request %s %s took %.3fs, %.3fs in %d upstream calls",
+                       method, route, elapsed, upstream_seconds, len(calls))
+
+    def traces(self) -> List[Dict[str, Any]]:
+        return list(self._traces)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"threshold": self.threshold, "sample_rate": self.sample_rate, "slow": self.slow,
+                "kept": len(self._traces)}
+
+
+def start_request(slow_log: SlowRequestLog = None) -> Tuple[float, Optional[contextvars.Token]]:
+    """Call when a request starts, returns the state finish_request needs"""
+    return time.perf_counter(), slow_log.start() if slow_log is not None else None
+
+
+def finish_request(state: Optional[Tuple[float, Optional[contextvars.Token]]], route: str, method: str, status: int,
+                   slow_log: SlowRequestLog = None) -> None:
+    """Records the duration of a request started with start_request, and its trace if it was slow"""
+    if state is None:
+        return
+    started, token = state
+    elapsed = time.perf_counter() - started
+    REQUESTS.observe(elapsed, route, method, status)
+    if slow_log is not None:
+        slow_log.finish(token, route, method, status, elapsed)
+
+
+def _flatten(prefix: Tuple[str, ...], value: Any, out: List[Tuple[Tuple[str, ...], float]]) -> None:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(prefix + (str(key),), item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out.append((prefix, float(value)))
+
+
+def render(stats: Dict[str, Any] = None) -> str:
+    """
+    Prometheus text exposition of the request and upstream histograms
+
+    Parameters:
+    - stats (dict): optional component stats like the /stats route returns, exported as
+      backend_component_stat{component, stat} gauges with nested keys joined by dots
+
+    Returns:
+    - str: the metrics page
+    """
+    lines = REQUESTS.render() + UPSTREAM.render()
+    if stats:
+        values: List[Tuple[Tuple[str, ...], float]] = []
+        _flatten((), stats, values)
+        lines.append("# HELP backend_component_stat Counters and sizes reported by the backend's components")
+        lines.append("# TYPE backend_component_stat gauge")
+        for path, value in values:
+            lines.append(f"backend_component_stat{_labels(('component', 'stat'), (path[0], '.'.join(path[1:])))} {value}")
+    return "\n".join(lines) + "\n"
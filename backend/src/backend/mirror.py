@@ -0,0 +1,380 @@
+import copy
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from pyrebase.pyrebase import ClosableSSEClient, Database, KeepAuthSession
+from backend.clients import thread_database
+
+logger = logging.getLogger(__name__)
+
+Path = Tuple[str, ...]
+
+
+def split_path(*parts: Any) -> Path:
+    """Turns child() arguments or a stream path like "/a/b" into a tuple of keys"""
+    return tuple(key for part in parts for key in str(part).split("/") if key)
+
+
+def _child(container: Any, key: str) -> Any:
+    if isinstance(container, dict):
+        return container.get(key)
+    if isinstance(container, list) and key.isdigit() and int(key) < len(container):
+        return container[int(key)]
+    return None
+
+
+def _assign(container: Any, key: str, value: Any) -> Any:
+    """Sets container[key] and returns the container, which is replaced by a dict if a list can't hold the key"""
+    if isinstance(container, list):
+        if key.isdigit() and int(key) < len(container):
+            container[int(key)] = value
+            return container
+        if key.isdigit() and int(key) == len(container):
+            container.append(value)
+            return container
+        container = {str(index): item for index, item in enumerate(container)}
+    container[key] = value
+    return container
+
+
+def _delete(container: Any, key: str) -> None:
+    if isinstance(container, dict):
+        container.pop(key, None)
+    elif isinstance(container, list) and key.isdigit() and int(key) < len(container):
+        if int(key) == len(container) - 1:
+            container.pop()
+        else:
+            container[int(key)] = None
+
+
+def _size(value: Any) -> int:
+    """Approximate memory held by a JSON tree, containers and their keys and values"""
+    total = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            total += sum(sys.getsizeof(key) for key in item)
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return total
+
+
+class _Response:
+    """Stands in for a pyrebase response, the app only ever reads val()"""
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def val(self) -> Any:
+        return self.value
+
+
+class _NodeClient(ClosableSSEClient):
+    """
+    pyrebase's SSE client, reporting every connect so a dropped stream is noticed at once.
+
+    The client reconnects on its own when the connection drops, so the reconnect is the first
+    sign of it. It does so right away rather than after pyrebase's 3s default, a failed connect
+    raises and the mirror's own backoff takes over.
+    """
+
+    def __init__(self, url: str, build_headers: Callable[[], Dict[str, str]], on_connect: Callable[[], None]):
+        self.on_connect = on_connect
+        super().__init__(url, session=KeepAuthSession(), build_headers=build_headers, retry=0)
+
+    def _connect(self) -> None:
+        self.on_connect()
+        super()._connect()
+
+
+class FirebaseMirror:
+    """
+    In-memory replica of selected Firebase nodes, kept current by the realtime stream API.
+
+    Every node is streamed on its own connection. The first event of a stream is a put of the
+    whole node, which is the snapshot, later put and patch events are applied in place and a
+    reconnect starts over with a new snapshot. Reads of a mirrored node are answered from
+    memory once its snapshot arrived, anything else falls through to Firebase, and so do the
+    reads of a node whose stream dropped, until the new snapshot arrives. Writes made
+    through the mirror go to Firebase and are applied locally at once, the echo from the
+    stream then measures the replication lag.
+
+    Parameters:
+    - database (Callable): returns a new pyrebase Database, used by the streams and for pass-through calls
+    - nodes (Iterable): top level nodes to mirror, e.g. ("users", "communities")
+    - memory_interval (float): seconds the memory estimate is reused, measuring walks the whole tree
+    """
+
+    def __init__(self, database: Callable[[], Database], nodes: Iterable[str], memory_interval: float = 60.0):
+        self.database_factory = database
+        self.nodes = tuple(nodes)
+        self.memory_interval = memory_interval
+        self._data: Dict[str, Any] = {}
+        self._ready: Dict[str, threading.Event] = {node: threading.Event() for node in self.nodes}
+        self._lock = threading.Lock()
+        self._db = thread_database(database)
+        self._threads: List[threading.Thread] = []
+        self._clients: Dict[str, _NodeClient] = {}
+        self._stopped = False
+        # Paths written through the mirror and when, until the stream echoes them back
+        self._echoes: Dict[Path, float] = {}
+        self._memory: Tuple[float, int] = (0.0, 0)
+
+        self.events = 0
+        self.snapshots = 0
+        self.stream_errors = 0
+        self.local_reads = 0
+        self.remote_reads = 0
+        self.last_event: Optional[float] = None
+        self.snapshot_at: Dict[str, float] = {}
+        self.lag_last: Optional[float] = None
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.lag_samples = 0
+
+    def start(self) -> "FirebaseMirror":
+        """Opens one stream per node in daemon threads"""
+        for node in self.nodes:
+            thread = threading.Thread(target=self._run, args=(node,), name=f"mirror-{node}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        """Stops applying events and closes the streams, which ends the threads reading them"""
+        self._stopped = True
+        for client in list(self._clients.values()):
+            try:
+                client.close()
+            except Exception:
+                # The connection is already gone, a stream still connecting stops at its first event
+                pass
+
+    def _stream(self, node: str) -> None:
+        """Streams a node until the connection fails or is closed, on the calling thread"""
+        database = self.database_factory()
+        client = _NodeClient(database.child(node).build_request_url(None), database.build_headers,
+                             self._ready[node].clear)
+        self._clients[node] = client
+        handle = self._handler(node)
+        for message in client:
+            if message:
+                data = json.loads(message.data)
+                data["event"] = message.event
+                handle(data)
+
+    def _run(self, node: str) -> None:
+        backoff = 1.0
+        while not self._stopped:
+            try:
+                self._stream(node)
+                backoff = 1.0
+            except Exception:
+                if self._stopped:
+                    return
+                self.stream_errors += 1
+                logger.exception("Firebase stream for %s failed, reconnecting in %.0fs", node, backoff)
+            finally:
+                # The copy stops receiving changes, reads go to Firebase until the next snapshot
+                self._ready[node].clear()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def _handler(self, node: str) -> Callable[[Dict[str, Any]], None]:
+        def handle(message: Dict[str, Any]) -> None:
+            if self._stopped:
+                raise RuntimeError("Mirror stopped")
+            event = message.get("event")
+            path = split_path(message.get("path", "/"))
+            data = message.get("data")
+            if event == "put":
+                changes = [(path, data)]
+            elif event == "patch" and isinstance(data, dict):
+                changes = [(path + split_path(key), value) for key, value in data.items()]
+            else:
+                return
+            now = time.monotonic()
+            with self._lock:
+                for change_path, value in changes:
+                    self._apply((node,) + change_path, value)
+                    self._record_echo((node,) + change_path, now)
+                if event == "put" and not path:
+                    self.snapshots += 1
+                    self.snapshot_at[node] = time.time()
+                self.events += 1
+                self.last_event = time.time()
+            self._ready[node].set()
+        return handle
+
+    def _apply(self, path: Path, value: Any) -> None:
+        """Puts value at path, None deletes, caller holds the lock"""
+        # (container, key) pairs from the root down, each key is looked up in its container
+        chain = [(self._data, path[0])]
+        for key in path[1:]:
+            child = _child(*chain[-1])
+            if not isinstance(child, (dict, list)):
+                if value is None:
+                    return
+                child = {}
+                self._link(chain, len(chain) - 1, child)
+            chain.append((child, key))
+        if value is not None:
+            self._link(chain, len(chain) - 1, value)
+            return
+        _delete(*chain[-1])
+        # Firebase drops nodes that become empty
+        while len(chain) > 1 and not chain[-1][0]:
+            chain.pop()
+            _delete(*chain[-1])
+
+    def _link(self, chain: List[Tuple[Any, str]], index: int, value: Any) -> None:
+        """Sets chain[index] to value, relinking a list that had to become a dict to hold the key"""
+        container, key = chain[index]
+        updated = _assign(container, key, value)
+        if updated is not container:
+            chain[index] = (updated, key)
+            self._link(chain, index - 1, updated)
+
+    def _record_echo(self, path: Path, now: float) -> None:
+        written = self._echoes.pop(path, None)
+        if written is not None:
+            lag = now - written
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_total += lag
+            self.lag_samples += 1
+
+    def ready(self, node: str) -> bool:
+        event = self._ready.get(node)
+        return event is not None and event.is_set()
+
+    def wait_ready(self, timeout: float = 30.0) -> bool:
+        """Blocks until every node has its snapshot, returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        return all(event.wait(max(deadline - time.monotonic(), 0)) for event in self._ready.values())
+
+    def read(self, path: Path, shallow: bool = False) -> Any:
+        """Returns a copy of the value at a mirrored path, or {key: True} for a shallow read"""
+        with self._lock:
+            value = self._data.get(path[0])
+            for key in path[1:]:
+                value = _child(value, key)
+            self.local_reads += 1
+            if shallow and isinstance(value, dict):
+                return {key: True for key in value}
+            if shallow and isinstance(value, list):
+                return {str(index): True for index in range(len(value))}
+            return copy.deepcopy(value)
+
+    def apply_local(self, path: Path, value: Any, patch: bool = False) -> None:
+        """Applies a write that was just sent to Firebase, so the next read sees it before the echo arrives"""
+        if not path or path[0] not in self.nodes:
+            if not path and patch and isinstance(value, dict):
+                # Multi-path update on the root
+                for key, item in value.items():
+                    self.apply_local(split_path(key), item)
+            return
+        now = time.monotonic()
+        changes = [(path + split_path(key), item) for key, item in value.items()] if patch else [(path, value)]
+        with self._lock:
+            for change_path, item in changes:
+                if change_path[0] not in self.nodes:
+                    continue
+                self._apply(change_path, item)
+                if len(self._echoes) < 10000:
+                    self._echoes[change_path] = now
+
+    def database(self) -> "MirrorRef":
+        """Returns a Database-like reference to the root, it is immutable so threads can share it"""
+        return MirrorRef(self, ())
+
+    def memory(self) -> int:
+        """Approximate bytes held by the mirrored data, recomputed at most every memory_interval seconds"""
+        measured_at, size = self._memory
+        if time.monotonic() - measured_at > self.memory_interval:
+            with self._lock:
+                size = _size(self._data)
+            self._memory = (time.monotonic(), size)
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "nodes": {
+                node: {
+                    "ready": self.ready(node),
+                    "snapshot_age": now - self.snapshot_at[node] if node in self.snapshot_at else None,
+                }
+                for node in self.nodes
+            },
+            "events": self.events,
+            "snapshots": self.snapshots,
+            "stream_errors": self.stream_errors,
+            "seconds_since_event": now - self.last_event if self.last_event is not None else None,
+            "local_reads": self.local_reads,
+            "remote_reads": self.remote_reads,
+            "lag_last": self.lag_last,
+            "lag_max": self.lag_max,
+            "lag_avg": self.lag_total / self.lag_samples if self.lag_samples else None,
+            "memory_bytes": self.memory(),
+        }
+
+
+class MirrorRef:
+    """
+    Database-like query builder over a FirebaseMirror.
+
+    Supports the child, shallow, get, set, update, push and remove calls the app makes.
+    Every call returns a new reference instead of mutating this one.
+    """
+
+    __slots__ = ("mirror", "path", "is_shallow")
+
+    def __init__(self, mirror: FirebaseMirror, path: Path, shallow: bool = False):
+        self.mirror = mirror
+        self.path = path
+        self.is_shallow = shallow
+
+    def child(self, *args: Any) -> "MirrorRef":
+        return MirrorRef(self.mirror, self.path + split_path(*args), self.is_shallow)
+
+    def shallow(self) -> "MirrorRef":
+        return MirrorRef(self.mirror, self.path, True)
+
+    def _remote(self) -> Database:
+        database = self.mirror._db()
+        return database.child(*self.path) if self.path else database
+
+    def get(self, token: str = None) -> Any:
+        if self.path and self.mirror.ready(self.path[0]):
+            return _Response(self.mirror.read(self.path, self.is_shallow))
+        self.mirror.remote_reads += 1
+        query = self._remote()
+        return (query.shallow() if self.is_shallow else query).get(token)
+
+    def set(self, data: Any, token: str = None) -> Any:
+        result = self._remote().set(data, token)
+        self.mirror.apply_local(self.path, data)
+        return result
+
+    def update(self, data: Dict[str, Any], token: str = None) -> Any:
+        result = self._remote().update(data, token)
+        self.mirror.apply_local(self.path, data, patch=True)
+        return result
+
+    def push(self, data: Any, token: str = None) -> Any:
+        result = self._remote().push(data, token)
+        self.mirror.apply_local(self.path + (result["name"],), data)
+        return result
+
+    def remove(self, token: str = None) -> Any:
+        result = self._remote().remove(token)
+        self.mirror.apply_local(self.path, None)
+        return result
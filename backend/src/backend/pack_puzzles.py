@@ -0,0 +1,43 @@
+"""
+Packs the local puzzle store into a memory mapped puzzle pack.
+
+Usage:
+    uv run backend-pack-puzzles --store puzzles.sqlite3 --pack puzzles.pack
+
+Every puzzle is parsed once here, positions and solution lines are stored pre-packed,
+so serving a puzzle from the pack never parses a FEN or a move list again.
+"""
+import argparse
+import os
+import resource
+import time
+from typing import List
+from backend.puzzle import PuzzlePack, write_pack
+from backend.puzzle_store import PuzzleStore
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pack the local puzzle store into a memory mapped file")
+    parser.add_argument("--store", default=os.getenv("PUZZLE_STORE_PATH", "puzzles.sqlite3"), help="SQLite store to read")
+    parser.add_argument("--pack", default=os.getenv("PUZZLE_PACK_PATH", "puzzles.pack"), help="pack file to write")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.store):
+        raise SystemExit(f"{args.store} does not exist, import the puzzle dump with backend-import-puzzles first")
+    store = PuzzleStore(args.store)
+    stored = len(store)
+
+    started = time.perf_counter()
+    written = write_pack(args.pack, store.puzzles())
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    pack = PuzzlePack(args.pack)
+    size = pack.stats()["bytes"]
+    pack.close()
+    print(f"Done: {written} of {stored} puzzles packed in {elapsed:.1f}s, {size / max(written, 1):.0f} bytes per puzzle, "
+          f"{size / 2 ** 20:.1f} MB (peak RSS {peak_mb:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Batch job that analyses every position of every puzzle and writes the evaluation store.
+
+Usage:
+    uv run backend-precompute-evaluations --store evaluations.bin --depth 24 --multipv 3
+
+The puzzle set is fixed, so every position the analysis routes can be asked about is known
+in advance. Positions are deduplicated by hash and searched on a pool of engine processes,
+one per core by default. Running it again with the same store only searches the positions
+that are new or were stored shallower than --depth.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+import chess
+import chess.engine
+from backend.clients import firebase_app, open_puzzle_pack, open_puzzle_store, puzzle_database
+from backend.engine_pool import EnginePool
+from backend.eval_store import EvaluationStore, RECORD, encode_record, position_key, write_store
+from backend.functions import fetch_puzzle_ids, fetch_timeline
+from backend.pregenerate_hints import with_retry
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Precompute deep engine analysis for every puzzle position")
+    parser.add_argument("--store", default=os.getenv("EVAL_STORE_PATH", "evaluations.bin"), help="store file to write")
+    parser.add_argument("--depth", type=int, default=24, help="search depth per position")
+    parser.add_argument("--multipv", type=int, default=3, help="lines stored per position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="engine processes searching in parallel")
+    parser.add_argument("--hash", type=int, default=64, help="hash table per engine in megabytes")
+    parser.add_argument("--retries", type=int, default=3, help="retries per Firebase call")
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N puzzles")
+    args = parser.parse_args(argv)
+
+    # Same configuration as the app, without starting its indexes and background threads
+    database = puzzle_database(firebase_app(), open_puzzle_pack() or open_puzzle_store())
+
+    started = time.perf_counter()
+    records: Dict[int, bytes] = {}
+    if os.path.exists(args.store):
+        existing = EvaluationStore(args.store)
+        if existing.multipv >= args.multipv:
+            # Records start with their depth, keep the ones that are deep enough
+            records = {key: record for key, record in existing.records() if RECORD.unpack_from(record)[0] >= args.depth}
+        existing.close()
+        print(f"Keeping {len(records)} positions from {args.store}")
+
+    puzzle_ids = with_retry(lambda: fetch_puzzle_ids(database()), args.retries)
+    if args.limit is not None:
+        puzzle_ids = puzzle_ids[:args.limit]
+
+    # One board per distinct position, transpositions between puzzles are searched once
+    positions: Dict[int, chess.Board] = {}
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        timelines = executor.map(lambda puzzle_id: with_retry(lambda: fetch_timeline(database(), puzzle_id),
+                                                              args.retries), puzzle_ids)
+        for timeline in timelines:
+            if timeline is None:
+                continue
+            for fen in timeline.fens:
+                board = chess.Board(fen)
+                key = position_key(board)
+                if key not in records and key not in positions and not board.is_game_over():
+                    positions[key] = board
+    print(f"{len(puzzle_ids)} puzzles, {len(positions)} positions to search")
+
+    pool = EnginePool(os.getenv("STOCKFISH_PATH", "stockfish"), size=args.workers, threads=1, hash_mb=args.hash,
+                      timeout=30.0)
+    limit = chess.engine.Limit(depth=args.depth)
+    searched, failed = 0, 0
+    # One thread per engine, the searches themselves run in the engine processes
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        futures = {
+            executor.submit(pool.analyse, board, limit, multipv=args.multipv): key
+            for key, board in positions.items()
+        }
+        for future in as_completed(futures):
+            try:
+                records[futures[future]] = encode_record(future.result())
+                searched += 1
+            except Exception as e:
+                failed += 1
+                print(f"Position {positions[futures[future]].fen()} failed: {e}")
+            if (searched + failed) % 1000 == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{searched + failed}/{len(positions)} positions, {searched / elapsed:.1f}/s")
+    except KeyboardInterrupt:
+        print("Interrupted, writing the positions searched so far")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        pool.close()
+        written = write_store(args.store, records.items(), args.multipv)
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {searched} positions searched, {failed} failed, {written} in {args.store} "
+          f"({os.path.getsize(args.store) / 2 ** 20:.1f} MB) in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Batch job that walks the puzzle set and fills the hint store ahead of time.
+
+Usage:
+    uv run backend-pregenerate-hints --variants 3 --concurrency 8
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Tuple
+from backend.clients import firebase_app, openai_client, open_hint_store, open_puzzle_pack, open_puzzle_store, \
+    puzzle_database
+from backend.functions import fetch_puzzle_ids, fetch_timeline, generate_hint
+from backend.hint_store import HintStore
+
+
+def with_retry(call: Callable, retries: int = 3, backoff: float = 1.0):
+    """Calls call(), retrying with exponential backoff and jitter on any exception"""
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+
+
+def pregenerate_puzzle(database: Callable, client, store: HintStore, puzzle_id: str, model: str,
+                       variants: int, all_moves: bool, retries: int) -> Tuple[int, int]:
+    """
+    Generates the missing hint variants for every move of one puzzle
+
+    Returns:
+    - Tuple[int, int]: number of hints generated and number of hints that failed
+    """
+    timeline = with_retry(lambda: fetch_timeline(database(), puzzle_id), retries)
+    if timeline is None:
+        return 0, 0
+
+    generated, failed = 0, 0
+    for ply, move in enumerate(timeline.moves):
+        # The first move of a puzzle is the opponent's, the player answers on every other ply
+        if not all_moves and ply % 2 == 0:
+            continue
+        move_number = ply + 1
+        missing = variants - store.variants(puzzle_id, move_number, model)
+        for _ in range(max(missing, 0)):
+            try:
+                hint = with_retry(
+                    lambda: generate_hint(client, timeline.fen(ply), timeline.player(ply), move, model), retries
+                )
+            except Exception:
+                failed += 1
+                continue
+            if hint:
+                store.put(puzzle_id, move_number, model, hint)
+                generated += 1
+    return generated, failed
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pre-generate OpenAI hints for every puzzle")
+    parser.add_argument("--model", default="gpt-4-turbo", help="OpenAI model the hints are generated with")
+    parser.add_argument("--variants", type=int, default=None, help="hint variants per move (default HINT_VARIANTS)")
+    parser.add_argument("--concurrency", type=int, default=4, help="puzzles processed in parallel")
+    parser.add_argument("--retries", type=int, default=3, help="retries per Firebase or OpenAI call")
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N puzzles")
+    parser.add_argument("--all-moves", action="store_true", help="also generate hints for the opponent's moves")
+    args = parser.parse_args(argv)
+
+    # Same configuration as the app, without starting its indexes and background threads
+    hint_store = open_hint_store()
+    openaiclient = openai_client()
+    local_puzzles = open_puzzle_pack() or open_puzzle_store()
+    database = puzzle_database(firebase_app(), local_puzzles)
+
+    variants = args.variants or hint_store.max_variants
+
+    puzzle_ids = with_retry(lambda: fetch_puzzle_ids(database()), args.retries)
+    if args.limit is not None:
+        puzzle_ids = puzzle_ids[:args.limit]
+
+    started = time.perf_counter()
+    generated, failed, done = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {
+            executor.submit(pregenerate_puzzle, database, openaiclient, hint_store, puzzle_id, args.model,
+                            variants, args.all_moves, args.retries): puzzle_id
+            for puzzle_id in puzzle_ids
+        }
+        for future in as_completed(futures):
+            done += 1
+            try:
+                puzzle_generated, puzzle_failed = future.result()
+                generated += puzzle_generated
+                failed += puzzle_failed
+            except Exception as e:
+                failed += 1
+                print(f"Puzzle {futures[future]} failed: {e}")
+            if done % 100 == 0:
+                print(f"{done}/{len(puzzle_ids)} puzzles, {generated} hints generated, {failed} failed")
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {done} puzzles, {generated} hints generated, {failed} failed in {elapsed:.1f}s")
+    hint_store.close()
+
+
+if __name__ == "__main__":
+    main()
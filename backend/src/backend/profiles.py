@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+from pyrebase.pyrebase import Database
+from backend.cache import LRUCache
+from backend.clients import thread_database
+from backend.metrics import propagate
+
+# The only user fields the leaderboards return
+LEADERBOARD_FIELDS = ("username", "rating", "country", "streaks")
+
+# Cached marker for users that don't exist, so they aren't fetched again until the ttl expires
+_MISSING = {}
+
+
+class ProfileLoader:
+    """
+    Bulk loader for the leaderboard fields of many users at once.
+
+    Ids are deduplicated, served from a short-lived shared cache where possible, and the
+    rest are fetched concurrently on a bounded thread pool. Firebase's REST API can't
+    select fields, so each profile is trimmed to LEADERBOARD_FIELDS before it is cached.
+
+    Parameters:
+    - database (Callable): returns a new pyrebase Database, one is created per worker thread
+    - max_workers (int): maximum number of concurrent Firebase requests
+    - ttl (float): seconds a profile stays cached
+    - max_size (int): number of profiles kept in the cache
+    - overlay (Callable): optional (userid, profile) -> profile applied on every load, for changes not written yet
+    """
+
+    def __init__(self, database: Callable[[], Database], max_workers: int = 16, ttl: float = 30.0, max_size: int = 10000,
+                 overlay: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None):
+        self.database = database
+        self._db = thread_database(database)
+        self.overlay = overlay
+        self.cache = LRUCache(max_size, ttl)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="profile-loader")
+
+        self.fetches = 0
+
+    def _fetch(self, userid: str) -> Dict[str, Any]:
+        user_data = self._db().child("users").child(userid).get().val()
+        self.fetches += 1
+        if not user_data:
+            return _MISSING
+        return {field: user_data[field] for field in LEADERBOARD_FIELDS if field in user_data}
+
+    def load(self, userids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Returns {userid: profile} for every id that belongs to an existing user"""
+        profiles = {}
+        missing = []
+        for userid in dict.fromkeys(userids):
+            profile = self.cache.get(userid)
+            if profile is None:
+                missing.append(userid)
+            elif profile is not _MISSING:
+                profiles[userid] = profile
+
+        for userid, profile in zip(missing, self._executor.map(propagate(self._fetch), missing)):
+            self.cache.put(userid, profile)
+            if profile is not _MISSING:
+                profiles[userid] = profile
+
+        if self.overlay is not None:
+            profiles = {userid: self.overlay(userid, profile) for userid, profile in profiles.items()}
+        return profiles
+
+    def invalidate(self, userid: str) -> None:
+        """Drops a cached profile after the user was written to"""
+        self.cache.pop(userid)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats()
+        stats["fetches"] = self.fetches
+        return stats
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from pyrebase.pyrebase import Database
+from backend.cache import LRUCache
+from backend.clients import thread_database
+
+
+class ProfileVerifier:
+    """
+    Background job that reads new profiles back from Firebase after sign up.
+
+    The sign up route answers from the write response right away and this job confirms
+    the record is readable, retrying a few times. The result can be polled per user.
+
+    Parameters:
+    - database (Callable): returns a new pyrebase Database, one is created per worker thread
+    - attempts (int): reads tried before the profile is reported as failed
+    - delay (float): seconds between reads
+    """
+
+    def __init__(self, database: Callable[[], Database], attempts: int = 5, delay: float = 1.0, max_workers: int = 4):
+        self.database = database
+        self._db = thread_database(database)
+        self.attempts = attempts
+        self.delay = delay
+        self.statuses = LRUCache(max_size=10000, ttl=3600)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="profile-verifier")
+
+    def _verify(self, userid: str) -> None:
+        for attempt in range(self.attempts):
+            try:
+                if self._db().child("users").child(userid).get().val():
+                    self.statuses.put(userid, {"status": "verified", "attempts": attempt + 1})
+                    return
+            except Exception as e:
+                self.statuses.put(userid, {"status": "pending", "attempts": attempt + 1, "error": str(e)})
+            time.sleep(self.delay)
+        self.statuses.put(userid, {"status": "failed", "attempts": self.attempts})
+
+    def submit(self, userid: str) -> None:
+        """Queues a read-back of the user's profile"""
+        self.statuses.put(userid, {"status": "pending", "attempts": 0})
+        self._executor.submit(self._verify, userid)
+
+    def status(self, userid: str) -> Optional[Dict[str, Any]]:
+        """Returns the verification status of a user, or None if the user was never submitted"""
+        return self.statuses.get(userid)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
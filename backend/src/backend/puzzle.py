@@ -0,0 +1,390 @@
+import bisect
+import os
+import random
+import struct
+import sys
+from array import array
+from itertools import zip_longest
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import chess
+from backend.mapped import MappedFile
+from backend.timeline import decode_move, encode_move
+
+# Occupied squares, flags (bit 0 white to move, bits 1-4 castling rights), en passant square (64 for none),
+# halfmove clock and fullmove number, followed by a nibble per occupied square: piece type, colour in bit 3
+POSITION = struct.Struct("<QBBBH")
+CASTLING_SQUARES = (chess.H1, chess.A1, chess.H8, chess.A8)
+
+
+def encode_position(board: chess.Board) -> bytes:
+    """Packs a position into 13 bytes plus half a byte per piece, at most 29 bytes"""
+    flags = int(board.turn)
+    for bit, square in enumerate(CASTLING_SQUARES):
+        if board.castling_rights & chess.BB_SQUARES[square]:
+            flags |= 2 << bit
+    nibbles = [
+        board.piece_type_at(square) | (bool(board.occupied_co[chess.WHITE] & chess.BB_SQUARES[square]) << 3)
+        for square in chess.scan_forward(board.occupied)
+    ]
+    packed = bytes(low | (high << 4) for low, high in zip_longest(nibbles[0::2], nibbles[1::2], fillvalue=0))
+    ep_square = board.ep_square if board.ep_square is not None else 64
+    return POSITION.pack(board.occupied, flags, ep_square, min(board.halfmove_clock, 255),
+                         board.fullmove_number) + packed
+
+
+def position_fen(data: bytes) -> str:
+    """The FEN of a position packed by encode_position, written directly without building a board"""
+    occupied, flags, ep_square, halfmove_clock, fullmove_number = POSITION.unpack_from(data)
+    symbols = {}
+    for index, square in enumerate(chess.scan_forward(occupied)):
+        nibble = (data[POSITION.size + index // 2] >> (4 * (index % 2))) & 0xF
+        symbol = chess.PIECE_SYMBOLS[nibble & 0x7]
+        symbols[square] = symbol.upper() if nibble & 0x8 else symbol
+    ranks = []
+    for rank in range(7, -1, -1):
+        row, empty = [], 0
+        for square in range(rank * 8, rank * 8 + 8):
+            symbol = symbols.get(square)
+            if symbol is None:
+                empty += 1
+                continue
+            if empty:
+                row.append(str(empty))
+                empty = 0
+            row.append(symbol)
+        if empty:
+            row.append(str(empty))
+        ranks.append("".join(row))
+    castling = "".join(right for bit, right in enumerate("KQkq") if flags & (2 << bit)) or "-"
+    ep = chess.SQUARE_NAMES[ep_square] if ep_square < 64 else "-"
+    return f"{'/'.join(ranks)} {'w' if flags & 1 else 'b'} {castling} {ep} {halfmove_clock} {fullmove_number}"
+
+
+def decode_position(data: bytes) -> chess.Board:
+    """Unpacks a position packed by encode_position"""
+    return chess.Board(position_fen(data))
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _text(value: Any) -> Optional[str]:
+    # Theme and opening combinations repeat across puzzles, interning keeps one copy of each
+    return sys.intern(value) if isinstance(value, str) else None
+
+
+class Puzzle:
+    """
+    A puzzle held in a fraction of the memory of its Firebase dict.
+
+    The starting position is packed by encode_position and the solution line is an array of
+    16 bit move codes from timeline.encode_move, so nothing is parsed again per request.
+    Indexing with the Firebase keys ("FEN", "Moves", "Rating", ..., "ID") works like on the
+    dict, and to_dict returns the dict for jsonify.
+    """
+
+    __slots__ = ("id", "position", "moves", "rating", "rating_deviation", "popularity", "nb_plays", "themes",
+                 "game_url", "opening_tags")
+
+    def __init__(self, puzzle_id: Optional[str], position: bytes, moves: array, rating: Optional[int] = None,
+                 rating_deviation: Optional[int] = None, popularity: Optional[int] = None,
+                 nb_plays: Optional[int] = None, themes: Optional[str] = None, game_url: Optional[str] = None,
+                 opening_tags: Optional[str] = None):
+        self.id = puzzle_id
+        self.position = position
+        self.moves = moves
+        self.rating = rating
+        self.rating_deviation = rating_deviation
+        self.popularity = popularity
+        self.nb_plays = nb_plays
+        self.themes = themes
+        self.game_url = game_url
+        self.opening_tags = opening_tags
+
+    @classmethod
+    def from_fields(cls, puzzle_id: Optional[str], fen: str, moves: str, rating: Any = None,
+                    rating_deviation: Any = None, popularity: Any = None, nb_plays: Any = None,
+                    themes: Optional[str] = None, game_url: Optional[str] = None,
+                    opening_tags: Optional[str] = None) -> "Puzzle":
+        """Builds a puzzle from the columns of the Lichess dump, in the order of puzzle_store.CSV_COLUMNS"""
+        codes = array("H", (encode_move(chess.Move.from_uci(move)) for move in moves.split()))
+        return cls(puzzle_id, encode_position(chess.Board(fen)), codes, _to_int(rating), _to_int(rating_deviation),
+                   _to_int(popularity), _to_int(nb_plays), _text(themes), game_url, _text(opening_tags))
+
+    @classmethod
+    def from_dict(cls, puzzle: Dict[str, Any], puzzle_id: Optional[str] = None) -> "Puzzle":
+        """Builds a puzzle from a node of the Firebase puzzles tree"""
+        return cls.from_fields(
+            puzzle_id, puzzle["FEN"], puzzle["Moves"], puzzle.get("Rating"), puzzle.get("RatingDeviation"),
+            puzzle.get("Popularity"), puzzle.get("NbPlays"), puzzle.get("Themes"), puzzle.get("GameUrl"),
+            puzzle.get("OpeningTags")
+        )
+
+    def board(self) -> chess.Board:
+        """The starting position, the opponent moves first"""
+        return decode_position(self.position)
+
+    @property
+    def fen(self) -> str:
+        return position_fen(self.position)
+
+    @property
+    def uci_moves(self) -> List[str]:
+        """The solution line in UCI, what puzzle["Moves"].split(" ") used to return"""
+        return [decode_move(code).uci() for code in self.moves]
+
+    @property
+    def theme_list(self) -> List[str]:
+        return self.themes.split() if self.themes else []
+
+    def __getitem__(self, key: str) -> Any:
+        getter = _FIELDS.get(key)
+        if getter is None:
+            raise KeyError(key)
+        return getter(self)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        getter = _FIELDS.get(key)
+        if getter is None:
+            return default
+        value = getter(self)
+        return default if value is None else value
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELDS and (key != "ID" or self.id is not None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The puzzle in the shape of the Firebase puzzles node, with its "ID" if it is known"""
+        puzzle = {key: getter(self) for key, getter in _FIELDS.items()}
+        if self.id is None:
+            del puzzle["ID"]
+        return puzzle
+
+    def __repr__(self) -> str:
+        return f"Puzzle(id={self.id!r}, rating={self.rating!r}, moves={len(self.moves)})"
+
+
+# Firebase key to value, shared by __getitem__, get and to_dict
+_FIELDS: Dict[str, Callable[[Puzzle], Any]] = {
+    "ID": attrgetter("id"),
+    "FEN": attrgetter("fen"),
+    "Moves": lambda puzzle: " ".join(puzzle.uci_moves),
+    "Rating": attrgetter("rating"),
+    "RatingDeviation": attrgetter("rating_deviation"),
+    "Popularity": attrgetter("popularity"),
+    "NbPlays": attrgetter("nb_plays"),
+    "Themes": attrgetter("themes"),
+    "GameUrl": attrgetter("game_url"),
+    "OpeningTags": attrgetter("opening_tags"),
+}
+
+
+PACK_MAGIC = b"PZPK"
+PACK_VERSION = 1
+# Lichess puzzle ids, validate_puzzle_id only accepts this length
+ID_WIDTH = 5
+# magic, version, number of sections, number of puzzles
+PACK_HEADER = struct.Struct("<4sHHQ")
+# Column name and array typecode in file order, *_offsets columns have one entry more than there are puzzles
+SECTIONS = (
+    ("ids", "B"),
+    ("rating", "h"),
+    ("rating_deviation", "h"),
+    ("popularity", "b"),
+    ("nb_plays", "i"),
+    ("themes", "I"),
+    ("opening_tags", "I"),
+    ("position_offsets", "I"),
+    ("positions", "B"),
+    ("move_offsets", "I"),
+    ("moves", "H"),
+    ("url_offsets", "I"),
+    ("urls", "B"),
+    ("string_offsets", "I"),
+    ("strings", "B"),
+)
+# Stored in place of a missing number, the smallest value of the column's type
+MISSING = {"h": -2 ** 15, "b": -2 ** 7, "i": -2 ** 31}
+INT_COLUMNS = (("rating", "h"), ("rating_deviation", "h"), ("popularity", "b"), ("nb_plays", "i"))
+
+
+def write_pack(path: str, puzzles: Iterable[Puzzle]) -> int:
+    """
+    Writes a puzzle pack, replacing any existing file at path only once it is complete
+
+    Parameters:
+    - path (str): file to write
+    - puzzles (Iterable): puzzles sorted by id, ids that aren't ID_WIDTH ASCII characters are skipped
+
+    Returns:
+    - int: number of puzzles written
+    """
+    columns = {name: array(code) for name, code in SECTIONS}
+    for name in ("position_offsets", "move_offsets", "url_offsets", "string_offsets"):
+        columns[name].append(0)
+    # Theme and opening combinations are stored once, string 0 is the empty string
+    strings: Dict[str, int] = {"": 0}
+    columns["string_offsets"].append(0)
+
+    def string_index(text: Optional[str]) -> int:
+        index = strings.get(text or "")
+        if index is None:
+            index = strings[text] = len(strings)
+            columns["strings"].frombytes(text.encode("utf-8"))
+            columns["string_offsets"].append(len(columns["strings"]))
+        return index
+
+    previous = b""
+    for puzzle in puzzles:
+        key = puzzle.id.encode("utf-8") if puzzle.id else b""
+        if len(key) != ID_WIDTH or not key.isascii():
+            continue
+        if key <= previous:
+            raise ValueError(f"Puzzles must be sorted by id without duplicates, {puzzle.id} came after {previous!r}")
+        previous = key
+        columns["ids"].frombytes(key)
+        for name, code in INT_COLUMNS:
+            value = getattr(puzzle, name)
+            columns[name].append(value if value is not None and value > MISSING[code] else MISSING[code])
+        columns["themes"].append(string_index(puzzle.themes))
+        columns["opening_tags"].append(string_index(puzzle.opening_tags))
+        columns["positions"].frombytes(puzzle.position)
+        columns["position_offsets"].append(len(columns["positions"]))
+        columns["moves"].extend(puzzle.moves)
+        columns["move_offsets"].append(len(columns["moves"]))
+        columns["urls"].frombytes((puzzle.game_url or "").encode("utf-8"))
+        columns["url_offsets"].append(len(columns["urls"]))
+
+    count = len(columns["ids"]) // ID_WIDTH
+    sections = [columns[name].tobytes() for name, _ in SECTIONS]
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as handle:
+        handle.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(sections), count))
+        handle.write(array("Q", (len(section) for section in sections)).tobytes())
+        for section in sections:
+            # Every column starts 8 byte aligned so it can be cast in place
+            handle.write(b"\0" * (-handle.tell() % 8))
+            handle.write(section)
+    os.replace(temp, path)
+    return count
+
+
+class _IdColumn:
+    """The fixed width id column as a sequence of bytes, for bisect"""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+
+    def __len__(self) -> int:
+        return len(self.view) // ID_WIDTH
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.view[index * ID_WIDTH:(index + 1) * ID_WIDTH].tobytes()
+
+
+class PuzzlePack(MappedFile):
+    """
+    Read-only pack of the whole puzzle set, built by backend-pack-puzzles.
+
+    Every field is a column in the file: fixed width arrays for the ids, ratings and counters,
+    offset arrays into blobs for the packed positions, moves and game URLs, and a table of the
+    distinct theme and opening strings. The file is memory mapped and the columns are cast in
+    place, so opening it reads nothing, millions of puzzles cost only the pages that are touched,
+    and those pages are shared between worker processes. A Puzzle is only built for the puzzle
+    being served.
+
+    It stands in for the PuzzleStore wherever a local puzzle source is accepted.
+
+    Parameters:
+    - path (str): pack file
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        magic, version, sections, count = PACK_HEADER.unpack_from(self._map)
+        if magic != PACK_MAGIC or version != PACK_VERSION or sections != len(SECTIONS):
+            self.close()
+            raise ValueError(f"{path} is not a version {PACK_VERSION} puzzle pack")
+        lengths = struct.unpack_from(f"<{sections}Q", self._map, PACK_HEADER.size)
+        start = PACK_HEADER.size + 8 * sections
+        self._columns: Dict[str, memoryview] = {}
+        for (name, code), length in zip(SECTIONS, lengths):
+            start += -start % 8
+            self._columns[name] = self._section(start, length, code)
+            start += length
+        self._ids = _IdColumn(self._columns["ids"])
+        self.count = count
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _find(self, puzzle_id: str) -> int:
+        key = puzzle_id.encode("utf-8") if isinstance(puzzle_id, str) else b""
+        if len(key) != ID_WIDTH:
+            return -1
+        index = bisect.bisect_left(self._ids, key)
+        return index if index < self.count and self._ids[index] == key else -1
+
+    def __contains__(self, puzzle_id: str) -> bool:
+        return self._find(puzzle_id) >= 0
+
+    def _string(self, index: int) -> str:
+        offsets = self._columns["string_offsets"]
+        return sys.intern(self._columns["strings"][offsets[index]:offsets[index + 1]].tobytes().decode("utf-8"))
+
+    def _int(self, name: str, index: int) -> Optional[int]:
+        value = self._columns[name][index]
+        return None if value == MISSING[self._columns[name].format] else value
+
+    def puzzle(self, index: int) -> Puzzle:
+        """Builds the Puzzle at a position of the pack, copying only its own bytes"""
+        columns = self._columns
+        positions, moves, urls = columns["position_offsets"], columns["move_offsets"], columns["url_offsets"]
+        return Puzzle(
+            self._ids[index].decode("ascii"),
+            columns["positions"][positions[index]:positions[index + 1]].tobytes(),
+            array("H", columns["moves"][moves[index]:moves[index + 1]]),
+            self._int("rating", index), self._int("rating_deviation", index), self._int("popularity", index),
+            self._int("nb_plays", index), self._string(columns["themes"][index]),
+            columns["urls"][urls[index]:urls[index + 1]].tobytes().decode("utf-8"),
+            self._string(columns["opening_tags"][index]),
+        )
+
+    def fetch_puzzle(self, puzzle_id: str) -> Optional[Puzzle]:
+        index = self._find(puzzle_id)
+        if index < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.puzzle(index)
+
+    def ids(self) -> List[str]:
+        return [self._ids[index].decode("ascii") for index in range(self.count)]
+
+    def random_id(self) -> str:
+        if not self.count:
+            raise IndexError("Puzzle pack is empty")
+        return self._ids[random.randrange(self.count)].decode("ascii")
+
+    def ratings(self) -> Iterator[Tuple[str, int, str]]:
+        """Yields (puzzle_id, rating, themes) for every rated puzzle, for the rating bucket index"""
+        for index in range(self.count):
+            rating = self._int("rating", index)
+            if rating is not None:
+                yield self._ids[index].decode("ascii"), rating, self._string(self._columns["themes"][index])
+
+    def puzzles(self) -> Iterator[Puzzle]:
+        for index in range(self.count):
+            yield self.puzzle(index)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "puzzles": self.count, "bytes": len(self._map), "hits": self.hits,
+                "misses": self.misses}
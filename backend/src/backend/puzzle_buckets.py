@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Any, Callable, Collection, Dict, Iterable, List, Optional, Set, Tuple
+from backend.cache import LRUCache
+from backend.puzzle_index import PuzzleIdIndex
+
+
+class RatingBucketIndex(PuzzleIdIndex):
+    """
+    Puzzle id index grouped by rating, for picking puzzles close to a player's rating.
+
+    Puzzles are grouped into buckets of bucket_width rating points, and optionally by theme
+    and rating, each bucket an array of positions into the id list. A pick chooses a bucket
+    in range by size and a random position in it, so it never scans the puzzle set.
+    Background refreshes work like PuzzleIdIndex, but the first pick starts them, since
+    without a local store every load downloads the whole puzzle set from Firebase.
+
+    Parameters:
+    - loader (Callable): returns (puzzle_id, rating, themes) for every puzzle, e.g. lambda: fetch_puzzle_ratings(db)
+    - ttl (float): seconds between background refreshes
+    - bucket_width (int): rating points per bucket
+    - themes (bool): also group every bucket by theme
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Tuple[str, int, str]]], ttl: float = 3600.0,
+                 bucket_width: int = 50, themes: bool = True):
+        super().__init__(loader, ttl)
+        self.bucket_width = bucket_width
+        self.themes = themes
+        # (ids, id set, ratings, {bucket: positions}, {(theme, bucket): positions})
+        self._snapshot = ([], frozenset(), array("H"), {}, {})
+
+        self.picks = 0
+        self.misses = 0
+
+    def refresh(self) -> None:
+        """Reloads every puzzle rating and swaps the snapshot in one step"""
+        ids: List[str] = []
+        ratings = array("H")
+        buckets: Dict[int, array] = {}
+        theme_buckets: Dict[Tuple[str, int], array] = {}
+        for puzzle_id, rating, themes in self.loader() or []:
+            if rating is None:
+                continue
+            rating = min(max(int(rating), 0), 0xFFFF)
+            position = len(ids)
+            ids.append(puzzle_id)
+            ratings.append(rating)
+            bucket = rating // self.bucket_width
+            buckets.setdefault(bucket, array("I")).append(position)
+            if self.themes:
+                for theme in (themes or "").split():
+                    theme_buckets.setdefault((theme, bucket), array("I")).append(position)
+        self._snapshot = (ids, frozenset(ids), ratings, buckets, theme_buckets)
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        self._loaded.set()
+
+    def _current(self, timeout: float = 30.0) -> tuple:
+        if self._thread is None:
+            self.start()
+        return super()._current(timeout)
+
+    def pick(self, rating: int, spread: int, theme: Optional[str] = None, exclude: Collection[str] = (),
+             attempts: int = 32) -> Optional[str]:
+        """
+        Returns a random puzzle id rated within rating ± spread
+
+        Parameters:
+        - rating (int): target rating
+        - spread (int): maximum distance from the target rating
+        - theme (str): optional theme the puzzle must have, needs themes=True
+        - exclude (Collection): ids that must not be returned, e.g. recently seen puzzles
+        - attempts (int): random draws before falling back to filtering the buckets in range
+
+        Returns:
+        - str: a puzzle id, or None if no puzzle matches
+        """
+        ids, _, ratings, buckets, theme_buckets = self._current()
+        low, high = rating - spread, rating + spread
+        keys = range(max(low, 0) // self.bucket_width, max(high, 0) // self.bucket_width + 1)
+        if theme is None:
+            candidates = [buckets[key] for key in keys if key in buckets]
+        else:
+            candidates = [theme_buckets[(theme, key)] for key in keys if (theme, key) in theme_buckets]
+        total = sum(len(bucket) for bucket in candidates)
+        self.picks += 1
+
+        # Draws that land outside the range in the edge buckets, or on an excluded id, are retried
+        for _ in range(attempts if total else 0):
+            offset = random.randrange(total)
+            for bucket in candidates:
+                if offset < len(bucket):
+                    position = bucket[offset]
+                    break
+                offset -= len(bucket)
+            if low <= ratings[position] <= high and ids[position] not in exclude:
+                return ids[position]
+
+        matches = [position for bucket in candidates for position in bucket
+                   if low <= ratings[position] <= high and ids[position] not in exclude]
+        if not matches:
+            self.misses += 1
+            return None
+        return ids[random.choice(matches)]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "buckets": len(self._snapshot[3]),
+            "theme_buckets": len(self._snapshot[4]),
+            "picks": self.picks,
+            "misses": self.misses,
+        })
+        return stats
+
+
+class RecentlySeen:
+    """
+    The last puzzles served to each user, so rated picks don't repeat them.
+
+    Parameters:
+    - per_user (int): puzzle ids remembered per user
+    - max_users (int): users remembered, least recently active are forgotten first
+    """
+
+    def __init__(self, per_user: int = 50, max_users: int = 100000):
+        self.per_user = per_user
+        self._users = LRUCache(max_users)
+        self._lock = threading.Lock()
+
+    def get(self, userid: str) -> Set[str]:
+        with self._lock:
+            seen = self._users.get(userid)
+            return set(seen) if seen is not None else set()
+
+    def add(self, userid: str, puzzle_id: str) -> None:
+        with self._lock:
+            seen = self._users.get(userid)
+            if seen is None:
+                seen = deque(maxlen=self.per_user)
+                self._users.put(userid, seen)
+            seen.append(puzzle_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._users.stats()
@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+import logging
+from typing import Callable, Dict, Any, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PuzzleIdIndex:
+    """
+    Process-local index of puzzle ids, refreshed in the background.
+
+    Membership checks use a hash set and random picks index into a list, so both are O(1).
+    The first read waits for the initial load, every later read uses the current snapshot
+    while a background thread reloads it every ttl seconds or when notify_changed is called.
+
+    Parameters:
+    - loader (Callable): returns every puzzle id, e.g. lambda: fetch_puzzle_ids(db)
+    - ttl (float): seconds between background refreshes
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[str]], ttl: float = 300.0):
+        self.loader = loader
+        self.ttl = ttl
+        # (list, set) swapped as a single reference so readers never see a half-built snapshot
+        self._snapshot = ([], frozenset())
+        self._loaded = threading.Event()
+        self._changed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_refresh: Optional[float] = None
+
+    def refresh(self) -> None:
+        """Reloads every id and swaps the snapshot in one step"""
+        ids = list(self.loader() or [])
+        self._snapshot = (ids, frozenset(ids))
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        self._loaded.set()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            try:
+                self.refresh()
+            except Exception:
+                self.refresh_errors += 1
+                logger.exception("Failed to refresh puzzle id index")
+            self._changed.wait(self.ttl)
+            self._changed.clear()
+
+    def start(self) -> "PuzzleIdIndex":
+        """Starts the background refresh thread, the first load happens immediately"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="puzzle-id-index", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._changed.set()
+
+    def notify_changed(self) -> None:
+        """Asks the background thread to reload now instead of waiting for the ttl"""
+        self._changed.set()
+
+    def _current(self, timeout: float = 30.0) -> tuple:
+        if not self._loaded.is_set():
+            if self._thread is None:
+                self.refresh()
+            elif not self._loaded.wait(timeout):
+                raise TimeoutError("Puzzle id index is not loaded yet")
+        return self._snapshot
+
+    def __contains__(self, puzzle_id: str) -> bool:
+        return puzzle_id in self._current()[1]
+
+    def __len__(self) -> int:
+        return len(self._current()[0])
+
+    def random_id(self) -> str:
+        """Returns a uniformly random puzzle id"""
+        return random.choice(self._current()[0])
+
+    def ids(self) -> List[str]:
+        """Returns a copy of every known puzzle id"""
+        return list(self._current()[0])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._snapshot[0]),
+            "loaded": self._loaded.is_set(),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_refresh": self.last_refresh,
+        }
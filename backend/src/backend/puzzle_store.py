@@ -0,0 +1,230 @@
+import csv
+import io
+import random
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import chess
+from backend.puzzle import Puzzle
+
+# Columns of the Lichess puzzle dump, also the keys of a puzzle in Firebase
+CSV_COLUMNS = ("PuzzleId", "FEN", "Moves", "Rating", "RatingDeviation", "Popularity", "NbPlays", "Themes",
+               "GameUrl", "OpeningTags")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS puzzles (
+    puzzle_id TEXT NOT NULL UNIQUE,
+    fen TEXT NOT NULL,
+    moves TEXT NOT NULL,
+    rating INTEGER,
+    rating_deviation INTEGER,
+    popularity INTEGER,
+    nb_plays INTEGER,
+    themes TEXT,
+    game_url TEXT,
+    opening_tags TEXT
+);
+CREATE TABLE IF NOT EXISTS puzzle_themes (
+    theme TEXT NOT NULL,
+    puzzle_id TEXT NOT NULL
+);
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS puzzles_rating ON puzzles (rating);
+CREATE INDEX IF NOT EXISTS puzzle_themes_theme ON puzzle_themes (theme, puzzle_id);
+CREATE INDEX IF NOT EXISTS puzzle_themes_puzzle ON puzzle_themes (puzzle_id);
+"""
+
+
+def validate_solution(fen: str, moves: str) -> bool:
+    """Checks that the FEN parses and every move of the solution line is legal"""
+    try:
+        board = chess.Board(fen)
+        for uci in moves.split():
+            move = chess.Move.from_uci(uci)
+            if not board.is_legal(move):
+                return False
+            board.push(move)
+    except ValueError:
+        return False
+    return bool(moves)
+
+
+def _to_int(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rows(rows: Iterable[List[str]], validate: bool = True) -> Tuple[List[tuple], int]:
+    """
+    Turns CSV rows into store rows
+
+    Returns:
+    - Tuple[list, int]: the valid rows and the number of rejected rows
+    """
+    parsed = []
+    rejected = 0
+    for row in rows:
+        if row[:1] == ["PuzzleId"]:
+            continue
+        if len(row) < 3:
+            rejected += 1
+            continue
+        row = list(row) + [""] * (len(CSV_COLUMNS) - len(row))
+        puzzle_id, fen, moves = row[0], row[1], row[2]
+        if validate and not validate_solution(fen, moves):
+            rejected += 1
+            continue
+        parsed.append((puzzle_id, fen, moves, _to_int(row[3]), _to_int(row[4]), _to_int(row[5]), _to_int(row[6]),
+                       row[7], row[8], row[9]))
+    return parsed, rejected
+
+
+def open_csv(path: str) -> io.TextIOBase:
+    """Opens a puzzle dump as text, streaming through zstandard for .zst files"""
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Reading .zst dumps needs the import extra: uv sync --extra import")
+        raw = open(path, "rb")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def read_chunks(path: str, chunk_size: int) -> Iterator[List[List[str]]]:
+    """Yields the CSV rows of a dump in lists of at most chunk_size rows"""
+    with open_csv(path) as handle:
+        chunk = []
+        for row in csv.reader(handle):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class PuzzleStore:
+    """
+    Local SQLite copy of the puzzle set, indexed by puzzle id, rating and theme.
+
+    It can stand in for Firebase in fetch_puzzle, fetch_puzzle_ids and fetch_random_puzzle,
+    and for the PuzzleIdIndex in validate_puzzle_id. Every thread reads on its own connection.
+
+    Parameters:
+    - path (str): SQLite file the puzzles are stored in
+    - bulk_load (bool): writes don't wait for the disk, for an import that is simply rerun after a power loss
+    """
+
+    def __init__(self, path: str, bulk_load: bool = False):
+        self.path = path
+        self.bulk_load = bulk_load
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA + _INDEXES)
+        connection.commit()
+        self._max_rowid = connection.execute("SELECT MAX(rowid) FROM puzzles").fetchone()[0] or 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "connection"):
+            self._local.connection = sqlite3.connect(self.path)
+            if self.bulk_load:
+                # Safe if the process crashes, an OS crash or power loss can corrupt the file
+                self._local.connection.execute("PRAGMA synchronous=OFF")
+        return self._local.connection
+
+    def fetch_puzzle(self, puzzle_id: str) -> Optional[Puzzle]:
+        """Returns the puzzle, or None"""
+        row = self._connection().execute(
+            "SELECT puzzle_id, fen, moves, rating, rating_deviation, popularity, nb_plays, themes, game_url, "
+            "opening_tags FROM puzzles WHERE puzzle_id = ?", (puzzle_id,)
+        ).fetchone()
+        return Puzzle.from_fields(*row) if row else None
+
+    def puzzles(self) -> Iterator[Puzzle]:
+        """Yields every puzzle sorted by id for write_pack, skipping rows imported with --no-validate that don't parse"""
+        # A connection of its own, the cursor stays open while the caller iterates
+        connection = sqlite3.connect(self.path)
+        try:
+            for row in connection.execute(
+                "SELECT puzzle_id, fen, moves, rating, rating_deviation, popularity, nb_plays, themes, game_url, "
+                "opening_tags FROM puzzles ORDER BY puzzle_id"
+            ):
+                try:
+                    puzzle = Puzzle.from_fields(*row)
+                except ValueError:
+                    continue
+                yield puzzle
+        finally:
+            connection.close()
+
+    def __contains__(self, puzzle_id: str) -> bool:
+        return self._connection().execute(
+            "SELECT 1 FROM puzzles WHERE puzzle_id = ?", (puzzle_id,)
+        ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM puzzles").fetchone()[0]
+
+    def ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT puzzle_id FROM puzzles ORDER BY rowid")]
+
+    def random_id(self) -> str:
+        """Picks a random puzzle by rowid, rowids are dense after a bulk import"""
+        connection = self._connection()
+        for _ in range(16):
+            row = connection.execute(
+                "SELECT puzzle_id FROM puzzles WHERE rowid = ?", (random.randint(1, max(self._max_rowid, 1)),)
+            ).fetchone()
+            if row:
+                return row[0]
+        row = connection.execute("SELECT puzzle_id FROM puzzles ORDER BY RANDOM() LIMIT 1").fetchone()
+        if row is None:
+            raise IndexError("Puzzle store is empty")
+        return row[0]
+
+    def ratings(self) -> Iterator[Tuple[str, int, str]]:
+        """Yields (puzzle_id, rating, themes) for every puzzle, for the rating bucket index"""
+        return iter(self._connection().execute("SELECT puzzle_id, rating, themes FROM puzzles ORDER BY rowid"))
+
+    def ids_by_theme(self, theme: str) -> List[str]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT puzzle_id FROM puzzle_themes WHERE theme = ?", (theme,)
+        )]
+
+    def ids_by_rating(self, low: int, high: int) -> List[str]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT puzzle_id FROM puzzles WHERE rating BETWEEN ? AND ?", (low, high)
+        )]
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        """Inserts or replaces parsed rows in one transaction"""
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM puzzle_themes WHERE puzzle_id = ?", ((row[0],) for row in rows))
+            connection.executemany(
+                "INSERT OR REPLACE INTO puzzles (puzzle_id, fen, moves, rating, rating_deviation, popularity, "
+                "nb_plays, themes, game_url, opening_tags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            connection.executemany(
+                "INSERT INTO puzzle_themes (theme, puzzle_id) VALUES (?, ?)",
+                ((theme, row[0]) for row in rows for theme in (row[7] or "").split())
+            )
+        self._max_rowid = connection.execute("SELECT MAX(rowid) FROM puzzles").fetchone()[0] or 0
+
+    def update_ratings(self, ratings: Iterable[Tuple[str, int, Optional[int]]]) -> None:
+        """Sets (puzzle_id, rating, rating_deviation) in one transaction, a None deviation is left unchanged"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "UPDATE puzzles SET rating = ?, rating_deviation = COALESCE(?, rating_deviation) WHERE puzzle_id = ?",
+                ((rating, deviation, puzzle_id) for puzzle_id, rating, deviation in ratings)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "max_rowid": self._max_rowid}
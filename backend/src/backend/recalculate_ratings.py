@@ -0,0 +1,263 @@
+"""
+Batch job that replays the attempt log to recompute every user rating and calibrate puzzle ratings.
+
+Usage:
+    uv run --extra ratings backend-recalculate-ratings attempts.csv --system glicko2 --dry-run
+
+Attempts are grouped into rounds by how many earlier attempts the same user made, so round r
+holds every user's r-th attempt. A user appears at most once per round, so each round is a
+handful of array operations, and every user's attempts are still replayed in order. Puzzles
+attempted several times in one round get the summed change, like one Glicko-2 rating period.
+
+Run it while the app is stopped, the app caches user stats and would write its cached
+ratings back over the recomputed ones.
+"""
+import argparse
+import time
+from typing import Dict, Iterable, List, Tuple
+from backend.attempt_log import read_attempts
+from backend.clients import firebase_app, open_puzzle_store
+from backend.functions import DEFAULT_PUZZLE_RATING, fetch_puzzle_ratings, k_factor
+
+try:
+    import numpy as np
+except ImportError:
+    raise SystemExit("Recalculating ratings needs the ratings extra: uv sync --extra ratings")
+
+# Glicko-2 works on a scale where 1500 is 0 and 173.7178 rating points are 1
+GLICKO_SCALE = 173.7178
+
+
+def rounds(users: np.ndarray, timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Orders attempts into rounds, round r holds every user's r-th attempt
+
+    Returns:
+    - Tuple[ndarray, ndarray]: attempt indexes sorted by round, and the offsets where every round starts and ends
+    """
+    by_user = np.lexsort((timestamps, users))
+    sorted_users = users[by_user]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    counts = np.diff(np.r_[starts, len(users)])
+    occurrence = np.arange(len(users)) - np.repeat(starts, counts)
+    order = by_user[np.argsort(occurrence, kind="stable")]
+    bounds = np.r_[0, np.cumsum(np.bincount(occurrence))]
+    return order, bounds
+
+
+def replay_elo(users: np.ndarray, puzzles: np.ndarray, scores: np.ndarray, order: np.ndarray,
+               bounds: np.ndarray, user_ratings: np.ndarray, puzzle_ratings: np.ndarray,
+               puzzle_k: float = 0.0) -> None:
+    """Replays every round with the live Elo formula, updating the rating arrays in place"""
+    for number in range(len(bounds) - 1):
+        attempts = order[bounds[number]:bounds[number + 1]]
+        u, p, s = users[attempts], puzzles[attempts], scores[attempts]
+        expected = 1 / (1 + 10 ** ((puzzle_ratings[p] - user_ratings[u]) / 400))
+        # Every user in round r had attempted r puzzles before, so the K-factor is the same for all of them
+        user_ratings[u] = np.round(user_ratings[u] + k_factor(number) * (s - expected))
+        if puzzle_k:
+            np.add.at(puzzle_ratings, p, puzzle_k * (expected - s))
+
+
+def _g(phi: np.ndarray) -> np.ndarray:
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+
+def glicko2_update(mu: np.ndarray, phi: np.ndarray, sigma: np.ndarray, v_inverse: np.ndarray,
+                   score_sum: np.ndarray, tau: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    One Glicko-2 rating period for many players at once, on the Glicko-2 scale
+
+    Parameters:
+    - mu, phi, sigma (ndarray): rating, deviation and volatility of every player
+    - v_inverse (ndarray): sum of g(phi_j)^2 E (1 - E) over each player's games
+    - score_sum (ndarray): sum of g(phi_j) (s - E) over each player's games
+    - tau (float): system constant limiting how fast volatility changes
+
+    Returns:
+    - Tuple[ndarray, ndarray, ndarray]: the new mu, phi and sigma
+    """
+    v = 1 / v_inverse
+    delta = v * score_sum
+    a = np.log(sigma ** 2)
+
+    def f(x: np.ndarray) -> np.ndarray:
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    # Bracket the new volatility, then narrow it down with the Illinois algorithm for every player at once
+    large = delta ** 2 > phi ** 2 + v
+    A = a
+    B = np.where(large, np.log(np.where(large, delta ** 2 - phi ** 2 - v, 1)), a - tau)
+    below = ~large & (f(B) < 0)
+    k = 1
+    while below.any():
+        k += 1
+        B = np.where(below, a - k * tau, B)
+        below &= f(B) < 0
+
+    fA, fB = f(A), f(B)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(100):
+            active = np.abs(B - A) > 1e-6
+            if not active.any():
+                break
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            crossed = fC * fB < 0
+            A = np.where(active & crossed, B, A)
+            fA = np.where(active, np.where(crossed, fB, fA / 2), fA)
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+
+    new_sigma = np.exp(A / 2)
+    phi_star = np.sqrt(phi ** 2 + new_sigma ** 2)
+    new_phi = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+    return mu + new_phi ** 2 * score_sum, new_phi, new_sigma
+
+
+def replay_glicko2(users: np.ndarray, puzzles: np.ndarray, scores: np.ndarray, order: np.ndarray,
+                   bounds: np.ndarray, user_state: Tuple[np.ndarray, ...], puzzle_state: Tuple[np.ndarray, ...],
+                   tau: float = 0.5, calibrate: bool = True) -> None:
+    """Replays every round as one Glicko-2 rating period, updating the (mu, phi, sigma) arrays in place"""
+    user_mu, user_phi, user_sigma = user_state
+    puzzle_mu, puzzle_phi, puzzle_sigma = puzzle_state
+    for number in range(len(bounds) - 1):
+        attempts = order[bounds[number]:bounds[number + 1]]
+        u, p, s = users[attempts], puzzles[attempts], scores[attempts]
+        mu_u, phi_u, mu_p, phi_p = user_mu[u], user_phi[u], puzzle_mu[p], puzzle_phi[p]
+
+        # Users play one game per round, against the puzzle
+        g_p = _g(phi_p)
+        expected_u = 1 / (1 + np.exp(-g_p * (mu_u - mu_p)))
+        new_user = glicko2_update(mu_u, phi_u, user_sigma[u], g_p ** 2 * expected_u * (1 - expected_u),
+                                  g_p * (s - expected_u), tau)
+
+        if calibrate:
+            # Puzzles play every attempt made on them this round, so their sums are accumulated first
+            g_u = _g(phi_u)
+            expected_p = 1 / (1 + np.exp(-g_u * (mu_p - mu_u)))
+            played, games = np.unique(p, return_inverse=True)
+            v_inverse = np.bincount(games, weights=g_u ** 2 * expected_p * (1 - expected_p), minlength=len(played))
+            score_sum = np.bincount(games, weights=g_u * ((1 - s) - expected_p), minlength=len(played))
+            puzzle_mu[played], puzzle_phi[played], puzzle_sigma[played] = glicko2_update(
+                puzzle_mu[played], puzzle_phi[played], puzzle_sigma[played], v_inverse, score_sum, tau
+            )
+
+        user_mu[u], user_phi[u], user_sigma[u] = new_user
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_back(database, paths: Dict[str, object], batch_size: int) -> None:
+    """Writes {path: value} as multi-path updates of at most batch_size paths each"""
+    for chunk in _chunks(list(paths.items()), batch_size):
+        database.update(dict(chunk))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Recompute user and puzzle ratings from the attempt log")
+    parser.add_argument("log", help="attempt log written by the app, see ATTEMPT_LOG_PATH")
+    parser.add_argument("--system", choices=("elo", "glicko2"), default="elo", help="rating system to replay")
+    parser.add_argument("--initial-rating", type=float, default=1000, help="rating every user starts from")
+    parser.add_argument("--puzzle-k", type=float, default=8, help="Elo K-factor for puzzle ratings, 0 keeps them fixed")
+    parser.add_argument("--initial-rd", type=float, default=350, help="Glicko-2 rating deviation of new users")
+    parser.add_argument("--puzzle-rd", type=float, default=100, help="Glicko-2 rating deviation puzzles start from")
+    parser.add_argument("--volatility", type=float, default=0.06, help="Glicko-2 initial volatility")
+    parser.add_argument("--tau", type=float, default=0.5, help="Glicko-2 system constant")
+    parser.add_argument("--keep-puzzle-ratings", action="store_true", help="only recompute user ratings")
+    parser.add_argument("--batch-size", type=int, default=5000, help="paths per Firebase multi-path update")
+    parser.add_argument("--dry-run", action="store_true", help="print a summary instead of writing the ratings")
+    args = parser.parse_args(argv)
+
+    # Same configuration as the app, without starting its indexes and background threads
+    firebase = firebase_app()
+    puzzle_store = open_puzzle_store()
+
+    started = time.perf_counter()
+    log = read_attempts(args.log)
+    if not log.userids:
+        print(f"No attempts in {args.log}, nothing to recalculate")
+        return
+    users = np.frombuffer(log.users, dtype=np.int32)
+    puzzles = np.frombuffer(log.puzzles, dtype=np.int32)
+    scores = np.frombuffer(log.correct, dtype=np.int8).astype(np.float64)
+    order, bounds = rounds(users, np.frombuffer(log.timestamps, dtype=np.float64))
+    loaded = time.perf_counter()
+    print(f"Loaded {len(users)} attempts by {len(log.userids)} users on {len(log.puzzle_ids)} puzzles "
+          f"in {loaded - started:.1f}s, {len(bounds) - 1} rounds")
+
+    ratings_db = puzzle_store if puzzle_store is not None else firebase.database()
+    known = {puzzle_id: rating for puzzle_id, rating, _ in fetch_puzzle_ratings(ratings_db)}
+    initial_puzzle_ratings = np.array([known.get(puzzle_id) or DEFAULT_PUZZLE_RATING for puzzle_id in log.puzzle_ids],
+                                      dtype=np.float64)
+    puzzle_ratings = initial_puzzle_ratings.copy()
+    calibrate = not args.keep_puzzle_ratings
+
+    user_fields: Dict[str, np.ndarray] = {}
+    puzzle_fields: Dict[str, np.ndarray] = {}
+    if args.system == "elo":
+        user_ratings = np.full(len(log.userids), args.initial_rating)
+        replay_elo(users, puzzles, scores, order, bounds, user_ratings, puzzle_ratings,
+                   args.puzzle_k if calibrate else 0.0)
+        user_fields["rating"] = user_ratings
+        puzzle_fields["Rating"] = puzzle_ratings
+    else:
+        user_state = (
+            np.full(len(log.userids), (args.initial_rating - 1500) / GLICKO_SCALE),
+            np.full(len(log.userids), args.initial_rd / GLICKO_SCALE),
+            np.full(len(log.userids), args.volatility),
+        )
+        puzzle_state = (
+            (puzzle_ratings - 1500) / GLICKO_SCALE,
+            np.full(len(log.puzzle_ids), args.puzzle_rd / GLICKO_SCALE),
+            np.full(len(log.puzzle_ids), args.volatility),
+        )
+        replay_glicko2(users, puzzles, scores, order, bounds, user_state, puzzle_state, args.tau, calibrate)
+        user_fields["rating"] = user_state[0] * GLICKO_SCALE + 1500
+        user_fields["rating_deviation"] = user_state[1] * GLICKO_SCALE
+        user_fields["volatility"] = user_state[2]
+        puzzle_fields["Rating"] = puzzle_state[0] * GLICKO_SCALE + 1500
+        puzzle_fields["RatingDeviation"] = puzzle_state[1] * GLICKO_SCALE
+    replayed = time.perf_counter()
+    print(f"Replayed {args.system} in {replayed - loaded:.1f}s")
+
+    user_ratings = user_fields["rating"]
+    print(f"User ratings: mean {user_ratings.mean():.0f}, min {user_ratings.min():.0f}, max {user_ratings.max():.0f}")
+    if calibrate:
+        shift = puzzle_fields["Rating"] - initial_puzzle_ratings
+        print(f"Puzzle ratings moved by {np.abs(shift).mean():.1f} points on average")
+    if args.dry_run:
+        return
+
+    # Ratings are stored as integers like the live updates write them, volatility keeps its precision
+    def stored(field: str, values: np.ndarray) -> List:
+        return values.tolist() if field == "volatility" else np.round(values).astype(int).tolist()
+
+    paths = {}
+    for field, values in user_fields.items():
+        for userid, value in zip(log.userids, stored(field, values)):
+            paths[f"users/{userid}/{field}"] = value
+    write_back(firebase.database(), paths, args.batch_size)
+    print(f"Wrote {len(log.userids)} user ratings")
+
+    if calibrate:
+        columns = {name: stored(name, values) for name, values in puzzle_fields.items()}
+        if puzzle_store is not None:
+            deviations = columns.get("RatingDeviation", [None] * len(log.puzzle_ids))
+            puzzle_store.update_ratings(zip(log.puzzle_ids, columns["Rating"], deviations))
+        else:
+            paths = {}
+            for field, values in columns.items():
+                for puzzle_id, value in zip(log.puzzle_ids, values):
+                    paths[f"puzzles/{puzzle_id}/{field}"] = value
+            write_back(firebase.database(), paths, args.batch_size)
+        print(f"Wrote {len(log.puzzle_ids)} puzzle ratings")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from backend.cache import LRUCache
+
+
+def content_key(*parts: str) -> str:
+    """Hashes the parts into a fixed size key, so long texts don't bloat the cache"""
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8")
+        # length prefix so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls for the same key and caches completed results.
+
+    The first caller for a key runs the function, every caller that arrives while it is
+    running waits for that result instead of starting its own call. Results are then
+    served from an LRU cache with a ttl. Errors are shared with the waiting callers but
+    never cached.
+
+    Parameters:
+    - max_size (int): number of results kept in the cache
+    - ttl (float): seconds a result stays cached
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600.0):
+        self.cache = LRUCache(max_size, ttl)
+        self._calls: Dict[Hashable, _Call] = {}
+        # Calls made from the event loop in async serving mode, only touched from the loop thread
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """Returns function() for key, sharing in-flight calls and cached results"""
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            if call.result is not None:
+                self.cache.put(key, call.result)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> Any:
+        """Same as do for coroutines: returns await function(), sharing in-flight calls and cached results"""
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        task = self._async_calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # The call runs as its own task so a disconnecting caller doesn't cancel it for the others
+            task = self._async_calls[key] = asyncio.ensure_future(self._run_async(key, function))
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.calls += 1
+        return await asyncio.shield(task)
+
+    async def _run_async(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await function()
+            if result is not None:
+                self.cache.put(key, result)
+            return result
+        finally:
+            del self._async_calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns how many upstream calls were made and how many were saved"""
+        cache = self.cache.stats()
+        return {
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "cache_hits": cache["hits"],
+            "calls_saved": self.coalesced + cache["hits"],
+            "in_flight": len(self._calls) + len(self._async_calls),
+            "cache": cache,
+        }
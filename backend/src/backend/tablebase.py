@@ -0,0 +1,129 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import chess
+import chess.engine
+import chess.syzygy
+
+# Score given to a tablebase win, less the distance to zeroing so faster wins rank higher.
+# Well above any material evaluation and well below mate scores, like engines report TB wins.
+TABLEBASE_WIN = 20000
+
+
+class EndgameTablebase:
+    """
+    Syzygy endgame tablebase probed ahead of the engine.
+
+    Positions with few enough pieces and no castling rights are answered exactly from the
+    tables, WDL (win/draw/loss under the 50-move rule) and DTZ (distance to the next capture
+    or pawn move), in the same info dict shape the engine returns. The tables are opened once
+    and python-chess memory maps them, so the handle is kept for the lifetime of the process.
+    Positions the tables don't cover return None and go to the engine as before.
+
+    Parameters:
+    - paths (str): directories holding .rtbw and .rtbz files, separated by os.pathsep
+    - pv_plies (int): length of the best line followed through the tables, 1 for the best move only
+    """
+
+    def __init__(self, paths: str, pv_plies: int = 1):
+        self.pv_plies = max(pv_plies, 1)
+        self._tablebase = chess.syzygy.Tablebase()
+        self.files = sum(self._tablebase.add_directory(path) for path in paths.split(os.pathsep) if path)
+        # "KQvKR" covers 4 pieces
+        self.max_pieces = max((len(name) - 1 for name in self._tablebase.wdl), default=0)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def covers(self, board: chess.Board) -> bool:
+        """Whether the tables can hold the position, Syzygy has no positions with castling rights"""
+        return chess.popcount(board.occupied) <= self.max_pieces and not board.castling_rights
+
+    def _probe(self, board: chess.Board) -> Tuple[int, int]:
+        return self._tablebase.probe_wdl(board), self._tablebase.probe_dtz(board)
+
+    def _best_move(self, board: chess.Board) -> Optional[chess.Move]:
+        """Wins by the shortest DTZ, preferring captures and pawn moves, loses by the longest"""
+        best, best_key = None, None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    return move
+                wdl, dtz = self._probe(board)
+            finally:
+                board.pop()
+            # wdl and dtz are from the opponent's side after the move
+            if wdl < 0:
+                key = (-wdl, zeroing, -abs(dtz))
+            else:
+                key = (-wdl, False, abs(dtz))
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+        return best
+
+    def probe(self, board: chess.Board) -> Optional[Dict[str, Any]]:
+        """
+        Looks a position up in the tables
+
+        Parameters:
+        - board (chess.Board): the position, left unchanged
+
+        Returns:
+        - dict: engine-like info with score, pv, wdl, dtz and tablebase=True, or None if not covered
+        """
+        if not self.covers(board) or board.is_game_over():
+            return None
+        turn = board.turn
+        board = board.copy(stack=False)
+        try:
+            # The tables' file handles are shared
+            with self._lock:
+                wdl, dtz = self._probe(board)
+                pv: List[chess.Move] = []
+                while len(pv) < self.pv_plies and not board.is_game_over():
+                    move = self._best_move(board)
+                    if move is None:
+                        break
+                    pv.append(move)
+                    board.push(move)
+        except (KeyError, IndexError, OSError):
+            # A missing table raises chess.syzygy.MissingTableError, a KeyError
+            self.misses += 1
+            return None
+        except Exception:
+            self.errors += 1
+            return None
+        self.hits += 1
+
+        if wdl == 2:
+            cp = TABLEBASE_WIN - abs(dtz)
+        elif wdl == -2:
+            cp = -(TABLEBASE_WIN - abs(dtz))
+        else:
+            # Cursed wins and blessed losses are draws under the 50-move rule
+            cp = 0
+        return {
+            "score": chess.engine.PovScore(chess.engine.Cp(cp), turn),
+            "pv": pv,
+            "depth": 0,
+            "wdl": wdl,
+            "dtz": dtz,
+            "tablebase": True,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": self.files,
+            "max_pieces": self.max_pieces,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._tablebase.close()
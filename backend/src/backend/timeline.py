@@ -0,0 +1,94 @@
+from array import array
+from typing import List, Optional, Tuple
+import chess
+
+
+def encode_move(move: chess.Move) -> int:
+    """Packs a move into 16 bits: from square, to square and promotion piece type"""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code: int) -> chess.Move:
+    """Unpacks a move packed by encode_move"""
+    promotion = (code >> 12) & 0x7
+    return chess.Move(code & 0x3F, (code >> 6) & 0x3F, promotion or None)
+
+
+class PuzzleTimeline:
+    """
+    A puzzle expanded once into every position along its solution line.
+
+    Ply 0 is the starting position and ply i is the position after the first i moves,
+    so every lookup is a plain index into a tuple. The first move is the opponent's,
+    the player answers on every odd ply.
+    """
+
+    __slots__ = ("moves", "fens", "turns", "legal_moves", "rating")
+
+    def __init__(self, moves: List[str], fens: Tuple[str, ...], turns: bytes, legal_moves: Tuple[array, ...],
+                 rating: Optional[int] = None):
+        self.moves = moves
+        self.fens = fens
+        self.turns = turns
+        self.legal_moves = legal_moves
+        self.rating = rating
+
+    @classmethod
+    def from_puzzle(cls, fen: str, moves: List[str], rating: Optional[int] = None) -> "PuzzleTimeline":
+        """Replays the moves on a single board, recording every position on the way"""
+        board = chess.Board(fen)
+        fens = [board.fen()]
+        turns = bytearray([board.turn])
+        legal_moves = [array("H", map(encode_move, board.legal_moves))]
+        for move in moves:
+            board.push(chess.Move.from_uci(move))
+            fens.append(board.fen())
+            turns.append(board.turn)
+            legal_moves.append(array("H", map(encode_move, board.legal_moves)))
+        return cls(list(moves), tuple(fens), bytes(turns), tuple(legal_moves), rating)
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def fen(self, ply: int) -> str:
+        """Returns the FEN after the first ply moves"""
+        return self.fens[ply]
+
+    def player(self, ply: int) -> str:
+        """Returns the side to move after the first ply moves"""
+        return "white" if self.turns[ply] else "black"
+
+    def is_legal(self, ply: int, move: str) -> bool:
+        """Checks if a UCI move is legal in the position after the first ply moves"""
+        try:
+            code = encode_move(chess.Move.from_uci(move))
+        except ValueError:
+            return False
+        return code in self.legal_moves[ply]
+
+    @property
+    def player_moves(self) -> int:
+        """Number of moves the player has to find"""
+        return len(self.moves) // 2
+
+    def grade(self, player_moves: List[str]) -> Tuple[bool, int]:
+        """
+        Checks the player's moves against the solution, the opponent's replies are implied
+
+        Returns:
+        - Tuple[bool, int]: whether the puzzle was solved and how many of the player's moves were correct
+        """
+        for number, move in enumerate(player_moves):
+            ply = 2 * number + 1
+            if ply >= len(self.moves):
+                return False, number
+            if move == self.moves[ply]:
+                continue
+            # Any mate on the last move solves the puzzle too, as on Lichess
+            if ply == len(self.moves) - 1 and self.is_legal(ply, move):
+                board = chess.Board(self.fens[ply])
+                board.push_uci(move)
+                if board.is_checkmate():
+                    return True, number + 1
+            return False, number
+        return len(player_moves) == self.player_moves, len(player_moves)
@@ -0,0 +1,252 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Set
+from pyrebase.pyrebase import Database
+from backend.cache import LRUCache
+from backend.clients import thread_database
+
+logger = logging.getLogger(__name__)
+
+# User fields written by the solve flow
+STAT_FIELDS = ("rating", "attempted", "solved", "streaks", "last_solved_date")
+
+
+class WriteBehindQueue:
+    """
+    Write-behind buffer for the stats a user's puzzle attempts change.
+
+    Every change is applied to an in-memory copy of the user's stats under one lock, so
+    concurrent attempts by the same user can't overwrite each other, and only the changed
+    fields are remembered. The pending fields of all users are written together as one
+    multi-path update every flush_interval seconds, as soon as max_batch users have
+    pending changes, and on close. A failed flush keeps its changes pending for the next.
+    From the second failed flush in a row the batch is written user by user, so one path
+    Firebase rejects can't hold back everyone else, and a user whose write failed
+    max_failures times is dropped with an error log.
+
+    Parameters:
+    - database (Callable): returns a new pyrebase Database, one is created per thread
+    - flush_interval (float): seconds between flushes
+    - max_batch (int): number of users with pending changes that triggers an early flush
+    - ttl (float): seconds the stats of users without pending changes stay cached
+    - max_size (int): number of users without pending changes kept in the cache
+    - max_failures (int): failed writes of a user's changes before they are dropped
+    """
+
+    def __init__(self, database: Callable[[], Database], flush_interval: float = 1.0, max_batch: int = 100,
+                 ttl: float = 300.0, max_size: int = 10000, max_failures: int = 3):
+        self.database = database
+        self._db = thread_database(database)
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_failures = max_failures
+        self._clean = LRUCache(max_size, ttl)
+        # Stats of users with changes that are pending or being flushed, these are never evicted
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Dict[str, Set[str]] = {}
+        # Failed writes per user and failed flushes in a row, reset by a successful write
+        self._strikes: Dict[str, int] = {}
+        self._failed_flushes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.loads = 0
+        self.updates = 0
+        self.flushes = 0
+        self.flushed_users = 0
+        self.failures = 0
+        self.dropped_users = 0
+
+    def _cached(self, userid: str) -> Optional[Dict[str, Any]]:
+        """Returns the known stats of a user, caller holds the lock"""
+        stats = self._stats.get(userid)
+        return stats if stats is not None else self._clean.get(userid)
+
+    def _fetch(self, userid: str) -> Dict[str, Any]:
+        user_data = self._db().child("users").child(userid).get().val()
+        self.loads += 1
+        if not user_data:
+            raise KeyError(f"User {userid} does not exist")
+        return {field: user_data[field] for field in STAT_FIELDS if field in user_data}
+
+    def update(self, userid: str, change: Callable[[Dict[str, Any]], Any]) -> Any:
+        """
+        Applies change to the user's stats and queues the fields it modified
+
+        Parameters:
+        - userid (str): user the change applies to
+        - change (Callable): modifies the stats dict in place, runs under the lock so it must not block
+
+        Returns:
+        - Any: whatever change returned
+        """
+        while True:
+            with self._lock:
+                current = self._cached(userid)
+                if current is not None:
+                    updated = dict(current)
+                    result = change(updated)
+                    changed = {field for field in STAT_FIELDS
+                               if field in updated and updated[field] != current.get(field)}
+                    if changed:
+                        self._stats[userid] = updated
+                        self._clean.pop(userid)
+                        self._dirty.setdefault(userid, set()).update(changed)
+                        if len(self._dirty) >= self.max_batch:
+                            self._wake.set()
+                    self.updates += 1
+                    return result
+
+            # First change for this user, read their stats outside the lock
+            stats = self._fetch(userid)
+            with self._lock:
+                if self._cached(userid) is None:
+                    self._clean.put(userid, stats)
+
+    def get(self, userid: str) -> Dict[str, Any]:
+        """Returns the user's stats including changes that are not written yet"""
+        with self._lock:
+            stats = self._cached(userid)
+            if stats is not None:
+                return dict(stats)
+        stats = self._fetch(userid)
+        with self._lock:
+            if self._cached(userid) is None:
+                self._clean.put(userid, stats)
+            return dict(self._cached(userid))
+
+    def overlay(self, userid: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns user_data read from Firebase with the user's unwritten stats applied"""
+        with self._lock:
+            stats = self._stats.get(userid)
+            if stats is None:
+                return user_data
+            return dict(user_data, **stats)
+
+    def invalidate(self, userid: str) -> None:
+        """Forgets the cached stats of a user whose node was written outside the queue"""
+        with self._lock:
+            self._clean.pop(userid)
+
+    def _write(self, dirty: Dict[str, Set[str]]) -> None:
+        """Writes the given fields of the given users in one multi-path update"""
+        with self._lock:
+            data = {
+                f"users/{userid}/{field}": self._stats[userid][field]
+                for userid, fields in dirty.items() for field in fields
+            }
+        self._db().update(data)
+
+    def _requeue(self, dirty: Dict[str, Set[str]]) -> None:
+        with self._lock:
+            for userid, fields in dirty.items():
+                self._dirty.setdefault(userid, set()).update(fields)
+
+    def _write_each(self, dirty: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
+        """Writes every user on their own, returns the users whose write failed"""
+        failed = {}
+        for userid, fields in dirty.items():
+            try:
+                self._write({userid: fields})
+            except Exception:
+                logger.exception("Failed to write the stats of user %s", userid)
+                failed[userid] = fields
+        return failed
+
+    def _strike(self, failed: Dict[str, Set[str]]) -> None:
+        """Requeues the users whose write failed, dropping the ones that failed max_failures times"""
+        with self._lock:
+            for userid, fields in failed.items():
+                strikes = self._strikes.get(userid, 0) + 1
+                if strikes < self.max_failures:
+                    self._strikes[userid] = strikes
+                    self._dirty.setdefault(userid, set()).update(fields)
+                    continue
+                self._strikes.pop(userid, None)
+                self._dirty.pop(userid, None)
+                stats = self._stats.pop(userid, None)
+                self.dropped_users += 1
+                logger.error("Dropping the stats of user %s after %d failed writes: %s", userid, strikes, stats)
+
+    def flush(self) -> int:
+        """Writes every pending change in one multi-path update and returns the number of users written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                dirty, self._dirty = self._dirty, {}
+            failed = {}
+            try:
+                self._write(dirty)
+            except Exception:
+                self.failures += 1
+                self._failed_flushes += 1
+                # A single failure may be transient, a repeated one may be a path Firebase rejects
+                if len(dirty) == 1 or self._failed_flushes < 2:
+                    self._requeue(dirty)
+                    raise
+                failed = self._write_each(dirty)
+                if len(failed) == len(dirty):
+                    # Nobody could be written, Firebase is failing rather than one user's path
+                    self._requeue(dirty)
+                    raise
+            self._failed_flushes = 0
+            written = [userid for userid in dirty if userid not in failed]
+            with self._lock:
+                for userid in written:
+                    self._strikes.pop(userid, None)
+                    # Users changed again during the write stay pending with their newer stats
+                    if userid not in self._dirty:
+                        self._clean.put(userid, self._stats.pop(userid))
+            self._strike(failed)
+            self.flushes += 1
+            self.flushed_users += len(written)
+            return len(written)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush user stats")
+
+    def start(self) -> "WriteBehindQueue":
+        """Starts the background flusher"""
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, attempts: int = 3) -> None:
+        """Stops the flusher and writes whatever is still pending"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        for attempt in range(attempts):
+            try:
+                self.flush()
+                return
+            except Exception:
+                logger.exception("Failed to flush user stats on shutdown (attempt %d/%d)", attempt + 1, attempts)
+        with self._lock:
+            if self._dirty:
+                logger.error("Dropping unwritten stats of %d users", len(self._dirty))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._dirty)
+        return {
+            "pending_users": pending,
+            "loads": self.loads,
+            "updates": self.updates,
+            "flushes": self.flushes,
+            "flushed_users": self.flushed_users,
+            "failures": self.failures,
+            "dropped_users": self.dropped_users,
+            "cache": self._clean.stats(),
+        }
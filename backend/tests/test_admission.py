@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+import pytest
+from backend.admission import BATCH, INTERACTIVE, AdmissionLimiter, Overloaded
+
+
+def wait_for_queue(limiter: AdmissionLimiter, waiting: int) -> None:
+    deadline = time.monotonic() + 2
+    while limiter.stats()["queued"] != waiting:
+        assert time.monotonic() < deadline, "waiters never queued"
+        time.sleep(0.001)
+
+
+def start_waiter(limiter: AdmissionLimiter, priority: int, outcomes: list) -> threading.Thread:
+    def run() -> None:
+        try:
+            limiter.acquire(priority)
+        except Overloaded as e:
+            outcomes.append((priority, e.reason))
+            return
+        outcomes.append((priority, "admitted"))
+        limiter.release()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_full_queue_sheds_with_429():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=1, timeout=5)
+    limiter.acquire()
+    outcomes = []
+    waiter = start_waiter(limiter, INTERACTIVE, outcomes)
+    wait_for_queue(limiter, 1)
+
+    with pytest.raises(Overloaded) as shed:
+        limiter.acquire(INTERACTIVE)
+    assert shed.value.reason == "queue_full"
+    assert shed.value.status == 429
+    assert shed.value.retry_after >= 1
+
+    limiter.release()
+    waiter.join()
+    assert outcomes == [(INTERACTIVE, "admitted")]
+    assert limiter.stats()["in_use"] == 0
+
+
+def test_interactive_waiters_go_before_batch():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=4, timeout=5)
+    limiter.acquire()
+    outcomes = []
+    threads = [start_waiter(limiter, BATCH, outcomes)]
+    wait_for_queue(limiter, 1)
+    threads.append(start_waiter(limiter, BATCH, outcomes))
+    wait_for_queue(limiter, 2)
+    threads.append(start_waiter(limiter, INTERACTIVE, outcomes))
+    wait_for_queue(limiter, 3)
+
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert outcomes == [(INTERACTIVE, "admitted"), (BATCH, "admitted"), (BATCH, "admitted")]
+    assert limiter.stats()["in_use"] == 0
+
+
+def test_interactive_caller_evicts_a_batch_waiter_from_a_full_queue():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=1, timeout=5)
+    limiter.acquire()
+    outcomes = []
+    batch = start_waiter(limiter, BATCH, outcomes)
+    wait_for_queue(limiter, 1)
+    interactive = start_waiter(limiter, INTERACTIVE, outcomes)
+    batch.join()
+    assert outcomes == [(BATCH, "evicted")]
+
+    # A batch caller can't evict the interactive one in turn
+    with pytest.raises(Overloaded) as shed:
+        limiter.acquire(BATCH)
+    assert shed.value.reason == "queue_full"
+
+    limiter.release()
+    interactive.join()
+    assert outcomes[-1] == (INTERACTIVE, "admitted")
+    assert limiter.rejected == {"queue_full": 1, "evicted": 1, "timeout": 0}
+
+
+def test_timeout_sheds_with_503_and_leaks_no_slot():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=2, timeout=0.05)
+    limiter.acquire()
+
+    with pytest.raises(Overloaded) as shed:
+        limiter.acquire()
+    assert shed.value.reason == "timeout"
+    assert shed.value.status == 503
+    assert limiter.stats()["queued"] == 0
+
+    # The timed out waiter must not be handed the freed slot
+    limiter.release()
+    assert limiter.stats()["in_use"] == 0
+    limiter.acquire()
+    assert limiter.stats()["in_use"] == 1
+
+
+def test_retry_after_follows_hold_time_and_queue_length():
+    limiter = AdmissionLimiter("openai", limit=2, queue_size=4, timeout=5)
+    assert limiter.retry_after() == 1
+    limiter.acquire()
+    limiter.release(held=3.0)
+    assert limiter.retry_after() == 2
+
+    limiter.acquire()
+    limiter.acquire()
+    outcomes = []
+    waiter = start_waiter(limiter, INTERACTIVE, outcomes)
+    wait_for_queue(limiter, 1)
+    assert limiter.retry_after() == 3
+    limiter.release()
+    limiter.release()
+    waiter.join()
+
+
+def test_nested_admit_reuses_the_held_slot():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=0, timeout=0.05)
+    with limiter.admit():
+        with limiter.admit():
+            assert limiter.stats()["in_use"] == 1
+    assert limiter.stats()["in_use"] == 0
+    assert limiter.admitted == 1
+
+
+def test_ticket_releases_once():
+    limiter = AdmissionLimiter("openai", limit=1, queue_size=0)
+    release = limiter.ticket()
+    with pytest.raises(Overloaded):
+        limiter.acquire()
+    release()
+    release()
+    assert limiter.stats()["in_use"] == 0
+
+
+def test_async_waiters_share_slots_with_threads():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=2, timeout=1)
+
+    async def main() -> list:
+        order = []
+
+        async def call(name: str, priority: int) -> None:
+            async with limiter.admit_async(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        limiter.acquire()
+        tasks = [asyncio.create_task(call("batch", BATCH))]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(call("interactive", INTERACTIVE)))
+        await asyncio.sleep(0.01)
+        threading.Thread(target=limiter.release).start()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["interactive", "batch"]
+    assert limiter.stats()["in_use"] == 0
+
+
+def test_async_timeout_and_cancellation_leak_no_slot():
+    limiter = AdmissionLimiter("engine", limit=1, queue_size=2, timeout=0.05)
+
+    async def main() -> None:
+        limiter.acquire()
+        with pytest.raises(Overloaded) as shed:
+            await limiter.acquire_async()
+        assert shed.value.reason == "timeout"
+
+        limiter.timeout = 5
+        waiting = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(main())
+    assert limiter.stats()["queued"] == 0
+    limiter.release()
+    assert limiter.stats()["in_use"] == 0
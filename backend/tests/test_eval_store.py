@@ -0,0 +1,42 @@
+import chess
+import chess.engine
+from backend.eval_store import EvaluationStore, decode_record, encode_record, position_key, write_store
+
+
+def lines(board: chess.Board) -> list:
+    return [
+        {"score": chess.engine.PovScore(chess.engine.Cp(35), board.turn), "depth": 22,
+         "pv": [chess.Move.from_uci(uci) for uci in ("e7e5", "g1f3", "b8c6")]},
+        {"score": chess.engine.PovScore(chess.engine.Mate(-3), board.turn), "depth": 21,
+         "pv": [chess.Move.from_uci("a7a8q")]},
+    ]
+
+
+def test_record_round_trip():
+    board = chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+    infos = decode_record(encode_record(lines(board)), board.turn)
+    assert [info["score"] for info in infos] == [info["score"] for info in lines(board)]
+    assert [info["pv"] for info in infos] == [info["pv"] for info in lines(board)]
+    assert [info["depth"] for info in infos] == [21, 21]
+    assert [info["multipv"] for info in infos] == [1, 2]
+
+
+def test_store_round_trip(tmp_path):
+    boards = [chess.Board(), chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")]
+    path = str(tmp_path / "evaluations.bin")
+    assert write_store(path, [(position_key(board), encode_record(lines(board))) for board in boards], 2) == 2
+
+    store = EvaluationStore(path)
+    try:
+        assert len(store) == 2
+        assert store.multipv == 2
+        for board in boards:
+            assert board in store
+            assert [info["pv"] for info in store.get(board, 2)] == [info["pv"] for info in lines(board)]
+        # Same position with other move counters
+        assert store.get(chess.Board("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 4 9")) is not None
+        assert store.get(boards[0], 3) is None
+        assert chess.Board("8/8/8/8/8/8/8/K6k w - - 0 1") not in store
+        assert sorted(store.records()) == sorted((position_key(board), encode_record(lines(board))) for board in boards)
+    finally:
+        store.close()
@@ -0,0 +1,69 @@
+import chess
+import pytest
+from backend.puzzle import Puzzle, PuzzlePack, decode_position, encode_position, position_fen, write_pack
+
+FENS = [
+    chess.STARTING_FEN,
+    # Partial castling rights, black to move
+    "r3k2r/pppq1ppp/2npbn2/4p3/4P3/2NPBN2/PPPQ1PP1/R3K2R b Kq - 3 9",
+    # En passant capture available
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    # Promoted pieces, a halfmove clock over 99 and a three digit move number
+    "8/1Q6/8/4k3/8/2n5/5K2/1q6 b - - 120 143",
+    "8/8/8/8/8/8/8/K6k w - - 0 1",
+]
+
+
+@pytest.mark.parametrize("fen", FENS)
+def test_position_round_trip(fen):
+    board = chess.Board(fen)
+    data = encode_position(board)
+    assert len(data) <= 29
+    assert position_fen(data) == fen
+    assert decode_position(data) == board
+
+
+def test_en_passant_square_without_a_capture_is_kept():
+    # After 1. e4 python-chess keeps e3 though no pawn can take, the position must compare equal
+    board = chess.Board()
+    board.push_uci("e2e4")
+    decoded = decode_position(encode_position(board))
+    assert decoded == board
+    assert decoded.ep_square == chess.E3
+
+
+def test_puzzle_round_trips_through_a_pack(tmp_path):
+    puzzles = [
+        Puzzle.from_dict({
+            "FEN": FENS[1], "Moves": "e8c8 d2d8 c6d8 e3a7", "Rating": 1873, "RatingDeviation": 76,
+            "Popularity": 94, "NbPlays": 1203, "Themes": "advantage middlegame", "GameUrl": "https://lichess.org/x",
+            "OpeningTags": "Italian_Game",
+        }, "00aAb"),
+        # Numbers missing from the Firebase node stay missing
+        Puzzle.from_dict({"FEN": FENS[2], "Moves": "e5f6 d8f6 g1f3 f6e5", "Themes": "opening",
+                          "GameUrl": "https://lichess.org/y", "OpeningTags": ""}, "00aAc"),
+        # Promotions use the upper bits of the move code
+        Puzzle.from_dict({"FEN": "8/P5k1/8/8/8/8/6K1/8 w - - 0 1", "Moves": "a7a8q g7f6 a8a1n", "Rating": 900,
+                          "Themes": "advancedPawn", "GameUrl": "", "OpeningTags": ""}, "01xyz"),
+    ]
+    path = str(tmp_path / "puzzles.pack")
+    assert write_pack(path, puzzles) == 3
+
+    pack = PuzzlePack(path)
+    try:
+        assert len(pack) == 3
+        assert pack.ids() == ["00aAb", "00aAc", "01xyz"]
+        for puzzle in puzzles:
+            assert pack.fetch_puzzle(puzzle.id).to_dict() == puzzle.to_dict()
+        assert pack.fetch_puzzle("00aAc")["Rating"] is None
+        assert pack.fetch_puzzle("01xyz")["Moves"] == "a7a8q g7f6 a8a1n"
+        assert pack.fetch_puzzle("zzzzz") is None
+        assert list(pack.ratings()) == [("00aAb", 1873, "advantage middlegame"), ("01xyz", 900, "advancedPawn")]
+    finally:
+        pack.close()
+
+
+def test_pack_rejects_unsorted_puzzles(tmp_path):
+    puzzles = [Puzzle.from_dict({"FEN": FENS[0], "Moves": "e2e4"}, puzzle_id) for puzzle_id in ("bbbbb", "aaaaa")]
+    with pytest.raises(ValueError):
+        write_pack(str(tmp_path / "puzzles.pack"), puzzles)
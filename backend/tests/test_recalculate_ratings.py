@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from backend.functions import apply_rating
+from backend.recalculate_ratings import GLICKO_SCALE, _g, glicko2_update, replay_elo, replay_glicko2, rounds
+
+
+def test_rounds_hold_each_users_attempts_in_order():
+    users = np.array([0, 1, 0, 2, 0, 1], dtype=np.int32)
+    timestamps = np.array([5.0, 2.0, 1.0, 3.0, 9.0, 4.0])
+    order, bounds = rounds(users, timestamps)
+
+    assert bounds.tolist() == [0, 3, 5, 6]
+    assert sorted(order[0:3].tolist()) == [1, 2, 3]
+    assert sorted(order[3:5].tolist()) == [0, 5]
+    assert order[5:6].tolist() == [4]
+
+
+def test_glicko2_matches_glickmans_example():
+    # Glickman's worked example: 1500/200/0.06 beats 1400/30, loses to 1550/100 and 1700/300, tau 0.5
+    opponents = np.array([1400, 1550, 1700])
+    deviations = np.array([30, 100, 300])
+    scores = np.array([1.0, 0.0, 0.0])
+    mu = np.array([0.0])
+    phi = np.array([200 / GLICKO_SCALE])
+    mu_j = (opponents - 1500) / GLICKO_SCALE
+    g = _g(deviations / GLICKO_SCALE)
+    expected = 1 / (1 + np.exp(-g * (mu - mu_j)))
+
+    new_mu, new_phi, new_sigma = glicko2_update(
+        mu, phi, np.array([0.06]), np.array([np.sum(g ** 2 * expected * (1 - expected))]),
+        np.array([np.sum(g * (scores - expected))]), tau=0.5
+    )
+
+    assert new_mu[0] * GLICKO_SCALE + 1500 == pytest.approx(1464.06, abs=0.01)
+    assert new_phi[0] * GLICKO_SCALE == pytest.approx(151.52, abs=0.01)
+    assert new_sigma[0] == pytest.approx(0.05999, abs=1e-5)
+
+
+def test_glicko2_updates_every_player_independently():
+    mu = np.array([0.0, 0.0])
+    phi = np.array([200 / GLICKO_SCALE, 200 / GLICKO_SCALE])
+    sigma = np.array([0.06, 0.06])
+    g = _g(np.array([30 / GLICKO_SCALE]))
+    expected = 1 / (1 + np.exp(-g * (0 - (1400 - 1500) / GLICKO_SCALE)))
+    v_inverse = np.repeat(g ** 2 * expected * (1 - expected), 2)
+    score_sum = np.concatenate([g * (1 - expected), g * (0 - expected)])
+
+    both = glicko2_update(mu, phi, sigma, v_inverse, score_sum, tau=0.5)
+    for player in range(2):
+        alone = glicko2_update(mu[[player]], phi[[player]], sigma[[player]], v_inverse[[player]],
+                               score_sum[[player]], tau=0.5)
+        for together, single in zip(both, alone):
+            assert together[player] == pytest.approx(single[0])
+
+
+def test_elo_replay_matches_live_rating_updates():
+    # (user, puzzle, correct) in the order they were played
+    attempts = [(0, 0, 1), (1, 0, 0), (0, 1, 0), (0, 2, 1), (1, 1, 1), (2, 2, 0), (1, 2, 1), (0, 0, 1)]
+    puzzle_ratings = [1400.0, 1650.0, 1900.0]
+    users = np.array([a[0] for a in attempts], dtype=np.int32)
+    puzzles = np.array([a[1] for a in attempts], dtype=np.int32)
+    scores = np.array([a[2] for a in attempts], dtype=np.float64)
+    order, bounds = rounds(users, np.arange(len(attempts), dtype=np.float64))
+
+    user_ratings = np.full(3, 1000.0)
+    replay_elo(users, puzzles, scores, order, bounds, user_ratings, np.array(puzzle_ratings))
+
+    live = [{"rating": 1000} for _ in range(3)]
+    for user, puzzle, correct in attempts:
+        apply_rating(live[user], puzzle_ratings[puzzle], bool(correct))
+    assert user_ratings.tolist() == [stats["rating"] for stats in live]
+
+
+def test_glicko2_replay_moves_ratings_towards_results():
+    users = np.array([0, 1, 0, 1], dtype=np.int32)
+    puzzles = np.array([0, 0, 1, 1], dtype=np.int32)
+    scores = np.array([1.0, 0.0, 1.0, 0.0])
+    order, bounds = rounds(users, np.arange(4, dtype=np.float64))
+    user_state = (np.zeros(2), np.full(2, 350 / GLICKO_SCALE), np.full(2, 0.06))
+    puzzle_state = (np.zeros(2), np.full(2, 100 / GLICKO_SCALE), np.full(2, 0.06))
+
+    replay_glicko2(users, puzzles, scores, order, bounds, user_state, puzzle_state)
+
+    assert user_state[0][0] > 0 > user_state[0][1]
+    assert (user_state[1] < 350 / GLICKO_SCALE).all()
+    # Both puzzles were solved once and failed once, by players who started equal
+    assert puzzle_state[0][0] == pytest.approx(0, abs=1e-9)
@@ -0,0 +1,64 @@
+import chess
+import pytest
+from backend.timeline import PuzzleTimeline, decode_move, encode_move
+
+
+@pytest.mark.parametrize("uci", ["e2e4", "a7a8q", "h2h1n", "b7c8r", "g2f1b", "e1g1", "h8a1"])
+def test_move_code_round_trip(uci):
+    move = chess.Move.from_uci(uci)
+    code = encode_move(move)
+    assert 0 <= code < 2 ** 16
+    assert decode_move(code) == move
+
+
+def test_promotion_pieces_get_different_codes():
+    codes = {encode_move(chess.Move.from_uci(f"a7a8{piece}")) for piece in "qrbn"}
+    assert len(codes) == 4
+    assert encode_move(chess.Move.from_uci("a7a8")) not in codes
+
+
+# Black's c7c6 is the opponent's move, then a7a8q mates, and so does a7a8r
+PROMOTION = PuzzleTimeline.from_puzzle("6k1/P1p2ppp/8/8/8/8/5PPP/6K1 b - - 0 1", ["c7c6", "a7a8q"])
+# Both rooks mate on the back rank after the opponent's c7c6 and the player's quiet first move
+BACK_RANK = PuzzleTimeline.from_puzzle("6k1/2p2ppp/8/8/8/8/5PPP/RR4K1 b - - 0 1",
+                                       ["c7c6", "g1f1", "c6c5", "a1a8"])
+
+
+def test_timeline_positions_and_players():
+    assert len(BACK_RANK) == 4
+    assert BACK_RANK.player_moves == 2
+    assert BACK_RANK.player(0) == "black"
+    assert BACK_RANK.player(1) == "white"
+    assert BACK_RANK.fen(4) == "R5k1/5ppp/8/2p5/8/8/5PPP/1R3K2 b - - 1 3"
+
+
+def test_promotion_needs_the_promotion_piece():
+    assert PROMOTION.is_legal(1, "a7a8q")
+    assert PROMOTION.is_legal(1, "a7a8n")
+    assert not PROMOTION.is_legal(1, "a7a8")
+    assert not PROMOTION.is_legal(1, "a7a9")
+
+
+def test_grade_accepts_the_solution():
+    assert PROMOTION.grade(["a7a8q"]) == (True, 1)
+    assert BACK_RANK.grade(["g1f1", "a1a8"]) == (True, 2)
+
+
+def test_grade_accepts_another_mate_on_the_last_move():
+    assert PROMOTION.grade(["a7a8r"]) == (True, 1)
+    assert BACK_RANK.grade(["g1f1", "b1b8"]) == (True, 2)
+
+
+def test_grade_rejects_a_promotion_that_does_not_mate():
+    assert PROMOTION.grade(["a7a8n"]) == (False, 0)
+
+
+def test_grade_only_accepts_alternatives_on_the_last_move():
+    # h2h3 is legal but isn't the solution's first move
+    assert BACK_RANK.grade(["h2h3", "a1a8"]) == (False, 0)
+    assert BACK_RANK.grade(["g1f1", "g2g3"]) == (False, 1)
+
+
+def test_grade_counts_partial_and_extra_moves():
+    assert BACK_RANK.grade(["g1f1"]) == (False, 1)
+    assert BACK_RANK.grade(["g1f1", "a1a8", "a8b8"]) == (False, 2)
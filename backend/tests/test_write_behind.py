@@ -0,0 +1,147 @@
+from typing import Any, Dict, Optional, Set
+import pytest
+from backend.write_behind import WriteBehindQueue
+
+
+class FakeResult:
+    def __init__(self, value: Any):
+        self.value = value
+
+    def val(self) -> Any:
+        return self.value
+
+
+class FakeDatabase:
+    """Just enough of a pyrebase Database: child(...).get() and multi-path update, rejecting some users' paths"""
+
+    def __init__(self, users: Dict[str, Dict[str, Any]], rejected: Optional[Set[str]] = None):
+        self.users = users
+        self.rejected = rejected if rejected is not None else set()
+        self.failing = 0
+        self.updates = []
+        self.path = []
+
+    def child(self, name: str) -> "FakeDatabase":
+        child = FakeDatabase(self.users, self.rejected)
+        child.path = self.path + [name]
+        return child
+
+    def get(self) -> FakeResult:
+        _, userid = self.path
+        user = self.users.get(userid)
+        return FakeResult(dict(user) if user is not None else None)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self.updates.append(data)
+        if self.failing:
+            self.failing -= 1
+            raise ConnectionError("Firebase is unavailable")
+        for path in data:
+            if path.split("/")[1] in self.rejected:
+                raise ValueError(f"Invalid path {path}")
+        for path, value in data.items():
+            _, userid, field = path.split("/")
+            self.users[userid][field] = value
+
+
+def solve(stats: Dict[str, Any]) -> None:
+    stats["rating"] += 10
+    stats["solved"] += 1
+
+
+@pytest.fixture
+def db() -> FakeDatabase:
+    return FakeDatabase({userid: {"rating": 1000, "solved": 0, "name": userid} for userid in ("a", "b", "c")})
+
+
+def test_flush_writes_only_the_changed_fields_in_one_update(db):
+    queue = WriteBehindQueue(lambda: db)
+    queue.update("a", solve)
+    queue.update("a", solve)
+    queue.update("b", solve)
+    assert queue.get("a")["rating"] == 1020
+    assert db.users["a"]["rating"] == 1000
+
+    assert queue.flush() == 2
+    assert db.updates == [{"users/a/rating": 1020, "users/a/solved": 2, "users/b/rating": 1010, "users/b/solved": 1}]
+    assert queue.stats()["pending_users"] == 0
+
+
+def test_rejected_user_is_isolated_and_dropped(db):
+    db.rejected.add("b")
+    queue = WriteBehindQueue(lambda: db, max_failures=2)
+    for userid in ("a", "b", "c"):
+        queue.update(userid, solve)
+
+    # A single failed flush may be transient, everything stays pending
+    with pytest.raises(ValueError):
+        queue.flush()
+    assert queue.stats()["pending_users"] == 3
+    assert db.users["a"]["rating"] == 1000
+
+    # The second one in a row writes user by user, the others land
+    assert queue.flush() == 2
+    assert db.users["a"]["rating"] == 1010
+    assert db.users["c"]["rating"] == 1010
+    assert queue.stats()["pending_users"] == 1
+
+    # The rejected user keeps their changes until max_failures, and never blocks anyone else
+    queue.update("a", solve)
+    with pytest.raises(ValueError):
+        queue.flush()
+    assert queue.flush() == 1
+    assert db.users["a"]["rating"] == 1020
+    assert queue.stats()["pending_users"] == 0
+    assert queue.stats()["dropped_users"] == 1
+    assert db.users["b"]["rating"] == 1000
+
+
+def test_outage_keeps_every_user_pending(db):
+    db.failing = 10
+    queue = WriteBehindQueue(lambda: db, max_failures=1)
+    queue.update("a", solve)
+    queue.update("b", solve)
+
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            queue.flush()
+    assert queue.stats()["pending_users"] == 2
+    assert queue.stats()["dropped_users"] == 0
+
+    db.failing = 0
+    assert queue.flush() == 2
+    assert db.users["a"]["rating"] == db.users["b"]["rating"] == 1010
+
+
+def test_changes_made_during_a_failed_flush_are_kept(db):
+    queue = WriteBehindQueue(lambda: db)
+    queue.update("a", solve)
+    db.failing = 1
+    with pytest.raises(ConnectionError):
+        queue.flush()
+    queue.update("a", solve)
+    queue.flush()
+    assert db.users["a"]["rating"] == 1020
+    assert db.users["a"]["solved"] == 2
+
+
+def test_close_retries_the_final_flush(db):
+    queue = WriteBehindQueue(lambda: db, flush_interval=60).start()
+    queue.update("a", solve)
+    db.failing = 2
+    queue.close(attempts=3)
+    assert db.users["a"]["rating"] == 1010
+    assert queue.stats()["pending_users"] == 0
+
+
+def test_unknown_user_raises_key_error(db):
+    queue = WriteBehindQueue(lambda: db)
+    with pytest.raises(KeyError):
+        queue.update("missing", solve)
+
+
+def test_overlay_applies_unwritten_stats(db):
+    queue = WriteBehindQueue(lambda: db)
+    queue.update("a", solve)
+    assert queue.overlay("a", dict(db.users["a"])) == {"rating": 1010, "solved": 1, "name": "a"}
+    assert queue.overlay("b", db.users["b"]) is db.users["b"]